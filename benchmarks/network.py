@@ -0,0 +1,176 @@
+"""
+Synthetic network with the shape of the Transmetro network.
+
+The stations are placed along a trunk line from south to north. Each troncal
+route goes through the stations in one direction, the first pair of routes
+stops at every station, so every station is connected with every other one, and
+the next pairs are express routes that skip stations. Each alimentador route is
+a line of stops that ends at a parent station. The documents are the same ones
+created by the scripts in the scripts folder
+"""
+
+import math
+import random
+from typing import Dict, List
+
+from bson import ObjectId
+
+# Around Barranquilla
+SOUTH_POINT = (-74.7996, 10.9154)
+NETWORK_LENGTH_IN_METERS = 12000
+STOPS_DISTANCE_IN_METERS = 300
+METERS_PER_DEGREE = 111320
+
+
+def get_object_id(rng: random.Random) -> ObjectId:
+    # ids from the generator so the same seed gives the same network
+    return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+
+def get_location(lon: float, lat: float) -> dict:
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def move(lon: float, lat: float, meters: float, angle: float):
+    """
+    Point at the given meters from (lon, lat) in the direction of the angle
+    """
+    delta_lat = meters * math.cos(angle) / METERS_PER_DEGREE
+    delta_lon = (
+        meters
+        * math.sin(angle)
+        / (METERS_PER_DEGREE * math.cos(math.radians(lat + delta_lat / 2)))
+    )
+    return lon + delta_lon, lat + delta_lat
+
+
+def generate_stations(rng: random.Random, number_of_stations: int) -> List[dict]:
+    spacing = NETWORK_LENGTH_IN_METERS / max(number_of_stations - 1, 1)
+    lon, lat = SOUTH_POINT
+    stations = []
+    for i in range(number_of_stations):
+        stations.append(
+            {
+                "_id": get_object_id(rng),
+                "station_id": 100 + i,
+                "name": f"Estacion {i}",
+                "location": get_location(lon, lat),
+                "destinations": [],
+            }
+        )
+        # the trunk line goes north with some turns
+        lon, lat = move(lon, lat, spacing, rng.uniform(-0.5, 0.5))
+    return stations
+
+
+def add_troncal_route(
+    stations: List[dict], route: dict, route_stations: List[int]
+) -> None:
+    """
+    Add the destinations of a route that stops at the stations in route_stations,
+    as scripts/create_station_destinations.py does
+    """
+    # every stop of a troncal route is at a station, so the stop sequence
+    # increases by the distance between the stations
+    stop_sequences = [abs(s - route_stations[0]) + 1 for s in route_stations]
+    for i, start in enumerate(route_stations):
+        for j in range(i + 1, len(route_stations)):
+            stations[start]["destinations"].append(
+                {
+                    "station": stations[route_stations[j]]["_id"],
+                    "amount_to_arrive": stop_sequences[j] - stop_sequences[i],
+                    "route": route["_id"],
+                }
+            )
+
+
+def generate_troncal_routes(
+    rng: random.Random, stations: List[dict], number_of_routes: int
+) -> List[dict]:
+    routes = []
+    for i in range(number_of_routes):
+        # a route and its opposite direction share the same stations, the first
+        # pair stops at every station and the next ones skip more stations
+        skip = i // 2 + 1
+        route_stations = list(range(0, len(stations), skip))
+        if i % 2:
+            route_stations.reverse()
+
+        type_of_route = "troncal" if skip == 1 else "troncal-express"
+        route = {
+            "_id": get_object_id(rng),
+            "transmetro_id": i + 1,
+            "name": f"{'RS'[i % 2]}{skip}",
+            "type_of_route": type_of_route,
+        }
+        add_troncal_route(stations, route, route_stations)
+        routes.append(route)
+    return routes
+
+
+def generate_alimentador_route(
+    rng: random.Random,
+    index: int,
+    parent_station: dict,
+    stops_per_route: int,
+):
+    route = {
+        "_id": get_object_id(rng),
+        "transmetro_id": 1000 + index,
+        "name": f"A{index}",
+        "type_of_route": "alimentador",
+    }
+
+    # the route goes away from the trunk line and comes back to the station
+    lon, lat = parent_station["location"]["coordinates"]
+    angle = rng.choice([-1, 1]) * rng.uniform(math.pi / 4, 3 * math.pi / 4)
+    coordinates = []
+    for _ in range(stops_per_route):
+        lon, lat = move(lon, lat, STOPS_DISTANCE_IN_METERS, angle)
+        angle += rng.uniform(-0.3, 0.3)
+        coordinates.append((lon, lat))
+    coordinates.reverse()
+
+    # the first and last stops are stations, as in scripts/create_stops.py
+    number_of_stops = stops_per_route + 2
+    stops = [
+        {
+            "_id": get_object_id(rng),
+            "description": f"Parada {index}-{i}",
+            "stop_sequence": str(i + 1),
+            "location": get_location(lon, lat),
+            "amount_to_arrive": number_of_stops - i,
+            "route": route["_id"],
+            "parent_station": parent_station["_id"],
+            "other_parent_stations": [],
+        }
+        for i, (lon, lat) in enumerate(coordinates, start=1)
+    ]
+    return route, stops
+
+
+def generate_network(
+    stations: int = 30,
+    troncal_routes: int = 6,
+    alimentador_routes: int = 40,
+    stops_per_route: int = 25,
+    seed: int = 0,
+) -> Dict[str, List[dict]]:
+    # The first pair of troncal routes connects all the stations
+    if troncal_routes < 2:
+        raise ValueError("At least two troncal routes are needed")
+
+    rng = random.Random(seed)
+
+    station_documents = generate_stations(rng, stations)
+    routes = generate_troncal_routes(rng, station_documents, troncal_routes)
+
+    stops = []
+    for i in range(alimentador_routes):
+        route, route_stops = generate_alimentador_route(
+            rng, i + 1, rng.choice(station_documents), stops_per_route
+        )
+        routes.append(route)
+        stops.extend(route_stops)
+
+    return {"stations": station_documents, "routes": routes, "stops": stops}
@@ -0,0 +1,259 @@
+"""
+Benchmark of the stages of /paths/single on a synthetic network.
+
+The network is loaded in memory as a NetworkSnapshot, the same backend used by
+IN_MEMORY_NETWORK, so no database is needed. Run from the root folder:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.network import generate_network, move
+from core.commons import get_station_and_stops
+from core.encoders import dumps, orjson
+from core.models import Coordinate, Fields
+from core.paths import SingleAlternativePathBuilder
+from core.queries import documents_cache
+from core.response_cache import PathsCache
+from core.snapshot import NetworkSnapshot, set_snapshot
+from core.spatial import SPATIAL_INDEXES
+from core.steps import get_paths_content
+
+# Points are at most this far from a station or stop of the network
+MAX_POINT_DISTANCE_IN_METERS = 400
+# Slower medians are only a regression if they are at least this slower, the
+# fastest stages take a few microseconds and their ratios are noisy
+MIN_REGRESSION_MS = 0.05
+
+
+class Timer:
+    def __init__(self) -> None:
+        self.times: Dict[str, List[float]] = {}
+
+    def measure(self, stage: str, func: Callable, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.add(stage, time.perf_counter() - start)
+        return result
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.times.setdefault(stage, []).append(seconds * 1000)
+
+    def get_stats(self) -> Dict[str, dict]:
+        return {stage: get_stats(times) for stage, times in self.times.items()}
+
+
+def get_percentile(sorted_times: List[float], percentile: float) -> float:
+    index = math.ceil(percentile / 100 * len(sorted_times)) - 1
+    return sorted_times[max(index, 0)]
+
+
+def get_stats(times: List[float]) -> dict:
+    sorted_times = sorted(times)
+    return {
+        "count": len(times),
+        "mean_ms": sum(times) / len(times),
+        "median_ms": get_percentile(sorted_times, 50),
+        "p95_ms": get_percentile(sorted_times, 95),
+        "p99_ms": get_percentile(sorted_times, 99),
+        "min_ms": sorted_times[0],
+        "max_ms": sorted_times[-1],
+    }
+
+
+def get_query_points(
+    network: Dict[str, List[dict]], number_of_queries: int, seed: int
+) -> List[Tuple[Coordinate, Coordinate]]:
+    """
+    Pairs of points near the stations and stops, so the paths use all the
+    strategies
+    """
+    rng = random.Random(seed)
+    places = network["stations"] + network["stops"]
+
+    def get_point() -> Coordinate:
+        lon, lat = rng.choice(places)["location"]["coordinates"]
+        lon, lat = move(
+            lon,
+            lat,
+            rng.uniform(0, MAX_POINT_DISTANCE_IN_METERS),
+            rng.uniform(0, 2 * math.pi),
+        )
+        return Coordinate(lon=lon, lat=lat)
+
+    return [(get_point(), get_point()) for _ in range(number_of_queries)]
+
+
+def run_stages(
+    timer: Timer, start: Coordinate, final: Coordinate, fields: Fields
+) -> None:
+    stations_stops = timer.measure(
+        "get_station_and_stops", get_station_and_stops, start, final, fields
+    )
+
+    path_builder = SingleAlternativePathBuilder(start, final, stations_stops, fields)
+    strategies_paths = [
+        timer.measure(f"strategy.{strategy.__name__}", strategy)
+        for strategy in path_builder.get_strategies()
+    ]
+    paths = path_builder.merge_paths(strategies_paths)
+
+    timer.measure(
+        "serialization", lambda: dumps(get_paths_content(start, final, paths))
+    )
+
+
+async def run_handler(
+    timer: Timer, points: List[Tuple[Coordinate, Coordinate]], fields: Fields
+) -> List[int]:
+    # imported here so the configuration is only needed to run this stage
+    import main
+
+    # the paths cache would only measure cache hits
+    main.paths_cache = PathsCache(maxsize=0)
+
+    response_sizes = []
+    for start, final in points:
+        start_time = time.perf_counter()
+        response = await main.single_paths((start, final), fields)
+        timer.add("handler", time.perf_counter() - start_time)
+        response_sizes.append(len(response.body))
+    return response_sizes
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    network = generate_network(
+        stations=args.stations,
+        troncal_routes=args.troncal_routes,
+        alimentador_routes=args.alimentador_routes,
+        stops_per_route=args.stops_per_route,
+        seed=args.seed,
+    )
+
+    timer = Timer()
+    snapshot = timer.measure(
+        "load_snapshot",
+        lambda: NetworkSnapshot(
+            network["stations"],
+            network["routes"],
+            network["stops"],
+            index_class=SPATIAL_INDEXES[args.index],
+        ),
+    )
+    set_snapshot(snapshot)
+
+    fields = Fields(args.fields)
+    warmup_points = get_query_points(network, args.warmup, args.seed + 1)
+    points = get_query_points(network, args.queries, args.seed)
+
+    for start, final in warmup_points:
+        run_stages(Timer(), start, final, fields)
+
+    # every lookup would be a hit after the warmup
+    documents_cache.invalidate()
+    for start, final in points:
+        run_stages(timer, start, final, fields)
+
+    documents_cache.invalidate()
+    response_sizes = asyncio.run(run_handler(timer, points, fields))
+
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "orjson": orjson is not None,
+        },
+        "config": vars(args),
+        "network": {name: len(documents) for name, documents in network.items()},
+        "stages": timer.get_stats(),
+        "response_bytes": {
+            "mean": sum(response_sizes) / len(response_sizes),
+            "max": max(response_sizes),
+        },
+    }
+
+
+def get_regressions(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for stage, stats in results["stages"].items():
+        baseline_stats = baseline["stages"].get(stage)
+        if baseline_stats is None:
+            continue
+
+        difference = stats["median_ms"] - baseline_stats["median_ms"]
+        ratio = stats["median_ms"] / baseline_stats["median_ms"]
+        if ratio > threshold and difference > MIN_REGRESSION_MS:
+            regressions.append(
+                f"{stage}: {baseline_stats['median_ms']:.3f} ms -> "
+                f"{stats['median_ms']:.3f} ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def print_stats(results: dict) -> None:
+    print(f"{'stage':<60} {'median':>10} {'p95':>10} {'max':>10}")
+    for stage, stats in results["stages"].items():
+        print(
+            f"{stage:<60} {stats['median_ms']:>10.3f} {stats['p95_ms']:>10.3f} "
+            f"{stats['max_ms']:>10.3f}"
+        )
+    print(f"Mean response size: {results['response_bytes']['mean']:.0f} bytes")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stations", type=int, default=30)
+    parser.add_argument("--troncal-routes", type=int, default=6)
+    parser.add_argument("--alimentador-routes", type=int, default=40)
+    parser.add_argument("--stops-per-route", type=int, default=25)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index", choices=sorted(SPATIAL_INDEXES), default="kdtree")
+    parser.add_argument("--fields", choices=[f.value for f in Fields], default="full")
+    parser.add_argument("--output", help="file to save the results as JSON")
+    parser.add_argument("--baseline", help="results to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="ratio of the median to the baseline median considered a regression",
+    )
+    return parser
+
+
+def cli() -> int:
+    args = get_parser().parse_args()
+    results = run_benchmark(args)
+    print_stats(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = get_regressions(
+                results, json.load(baseline_file), args.threshold
+            )
+        for regression in regressions:
+            print(f"Regression in {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -14,3 +14,42 @@ STOP DIFFERENCE is a constant used by the algorithm to determine if there is a
 significant difference between the stops to display a different route alternative
 """
 STOP_DIFFERENCE = 8
+
+"""
+The graph path builder measures every path in stops. Walks are converted to stops
+with WALK_METERS_PER_STOP, the meters that a user would rather walk than ride one
+more stop, and every time the user boards a route TRANSFER_COST stops are added
+so paths with less transfers are preferred
+"""
+WALK_METERS_PER_STOP = 100
+TRANSFER_COST = 5
+
+"""
+Paths returned by the multi alternative path builder, the best ones by the same
+cost of the graph path builder
+"""
+MAX_ALTERNATIVES = 5
+
+"""
+The nearby stations and stops of a point are searched in 500 meters. The adaptive
+search takes the smallest radius of SEARCH_RADII with MIN_CANDIDATES stations and
+routes with stops, so dense areas use a small radius and sparse areas still get
+candidates. Only the nearest MAX_CANDIDATE_STATIONS stations and
+MAX_CANDIDATE_STOPS stops are kept
+"""
+SEARCH_RADII = (250, 500, 1000, 2000)
+MIN_CANDIDATES = 3
+MAX_CANDIDATE_STATIONS = 10
+MAX_CANDIDATE_STOPS = 60
+
+"""
+Pairs of points of a /paths/batch request, whose responses are built in memory.
+/paths/batch/stream has its own limit, BATCH_STREAM_MAX_PAIRS. The stations and
+stops near the points and the stations and routes looked up for the pairs are
+shared by the whole batch, keeping up to MAX_BATCH_LOOKUPS of each, the least
+recently used are dropped. The nearby queries of the points of a batch are made
+up to MAX_BATCH_CONCURRENT_QUERIES at a time
+"""
+MAX_BATCH_PAIRS = 100
+MAX_BATCH_LOOKUPS = 256
+MAX_BATCH_CONCURRENT_QUERIES = 8
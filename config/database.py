@@ -1,8 +1,132 @@
+from threading import Lock
+from typing import List, Optional
+
 import pymongo
 from decouple import config
+from pymongo import monitoring
+from pymongo.database import Database
+
+# Not needed when the network is loaded from NETWORK_SNAPSHOT_FILE
+MONGO_URL = config("MONGO_URL", default="")
+DB_NAME = config("DB_NAME", default="")
+
+# Pool of connections of the client, timeouts in milliseconds (0 is no timeout)
+MONGO_MAX_POOL_SIZE = config("MONGO_MAX_POOL_SIZE", default=100, cast=int)
+MONGO_MIN_POOL_SIZE = config("MONGO_MIN_POOL_SIZE", default=0, cast=int)
+MONGO_MAX_IDLE_TIME_MS = config("MONGO_MAX_IDLE_TIME_MS", default=0, cast=int)
+MONGO_CONNECT_TIMEOUT_MS = config("MONGO_CONNECT_TIMEOUT_MS", default=20000, cast=int)
+MONGO_SOCKET_TIMEOUT_MS = config("MONGO_SOCKET_TIMEOUT_MS", default=0, cast=int)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = config(
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS", default=30000, cast=int
+)
+# Connections opened at startup, before the API is ready
+MONGO_WARMUP_CONNECTIONS = config("MONGO_WARMUP_CONNECTIONS", default=4, cast=int)
+
+# Load stations, routes and stops in memory at startup instead of querying them
+IN_MEMORY_NETWORK = config("IN_MEMORY_NETWORK", default=False, cast=bool)
+# Network file created by scripts/create_snapshot.py, when it is set the network
+# is loaded from it instead of the database. Each worker still decodes the whole
+# file and builds its own indexes at startup
+NETWORK_SNAPSHOT_FILE = config("NETWORK_SNAPSHOT_FILE", default="")
+# Spatial index used by the in memory network: kdtree, grid or brute
+SPATIAL_INDEX = config("SPATIAL_INDEX", default="kdtree")
+
+# Cache of stations and routes retrieved by id, a size of 0 disables it
+DOCUMENTS_CACHE_SIZE = config("DOCUMENTS_CACHE_SIZE", default=512, cast=int)
+# Seconds before a cached document expires, 0 means never
+DOCUMENTS_CACHE_TTL = config("DOCUMENTS_CACHE_TTL", default=0, cast=float)
+
+# Cache of built paths by cells of the start and final points, a size of 0
+# disables it. The total steps of the cached paths are limited to
+# PATHS_CACHE_MAX_STEPS. The precision is the length of the geohash of the cells
+PATHS_CACHE_SIZE = config("PATHS_CACHE_SIZE", default=0, cast=int)
+PATHS_CACHE_MAX_STEPS = config("PATHS_CACHE_MAX_STEPS", default=200000, cast=int)
+PATHS_CACHE_PRECISION = config("PATHS_CACHE_PRECISION", default=7, cast=int)
+
+# Seconds between checks of the network version, when it changes the network in
+# memory is reloaded and the caches are cleared. 0 disables the checks
+NETWORK_VERSION_CHECK_INTERVAL = config(
+    "NETWORK_VERSION_CHECK_INTERVAL", default=30, cast=float
+)
+# Seconds the names of the served collections are used before reading the
+# version document again, 0 reads it in every request
+NETWORK_COLLECTIONS_TTL = config("NETWORK_COLLECTIONS_TTL", default=10, cast=float)
+
+# Pairs of points of a /paths/batch/stream request, its responses are sent as
+# soon as they are built so it can be much larger than MAX_BATCH_PAIRS
+BATCH_STREAM_MAX_PAIRS = config("BATCH_STREAM_MAX_PAIRS", default=10000, cast=int)
+
+# Trace the queries of each request, see core.profiler
+QUERY_PROFILER = config("QUERY_PROFILER", default=False, cast=bool)
+QUERY_PROFILER_TRACES = config("QUERY_PROFILER_TRACES", default=100, cast=int)
+# Times a query with the same shape is made by a request to be flagged
+QUERY_PROFILER_REPEAT_THRESHOLD = config(
+    "QUERY_PROFILER_REPEAT_THRESHOLD", default=3, cast=int
+)
+
+_client: Optional[pymongo.MongoClient] = None
+_client_lock = Lock()
+_event_listeners: List[monitoring.CommandListener] = []
+
+
+def add_event_listener(listener: monitoring.CommandListener) -> None:
+    """
+    Listener of the commands of the client, it must be added before the client
+    is created
+    """
+    if _client is not None:
+        raise RuntimeError("The client of the database is already created")
+    _event_listeners.append(listener)
+
+
+def get_client() -> pymongo.MongoClient:
+    """
+    Client of the database, created the first time it is needed
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not MONGO_URL:
+                    raise RuntimeError("MONGO_URL is not set")
+                _client = pymongo.MongoClient(
+                    MONGO_URL,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS or None,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS or None,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS or None,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    event_listeners=list(_event_listeners),
+                )
+    return _client
+
+
+def get_database() -> Database:
+    return get_client()[DB_NAME]
+
+
+def close_client() -> None:
+    global _client
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+class LazyDatabase:
+    """
+    Stands for the database of get_database, so it can be imported before the
+    client exists
+    """
+
+    def __getitem__(self, name: str):
+        return get_database()[name]
+
+    def __getattr__(self, name: str):
+        return getattr(get_database(), name)
 
-MONGO_URL = config("MONGO_URL")
-DB_NAME = config("DB_NAME")
 
-client = pymongo.MongoClient(MONGO_URL)
-db = client[DB_NAME]
+db = LazyDatabase()
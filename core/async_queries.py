@@ -0,0 +1,68 @@
+"""
+Async version of core.queries.
+
+pymongo is blocking, so every query runs in the threadpool and the event loop
+is free to wait for many of them at the same time. When the network is loaded
+in memory the queries don't block and are answered right away
+"""
+
+from typing import Callable, List, Optional, TypeVar
+
+from bson.objectid import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from core import queries
+from core.models import Coordinate, Fields
+from core.snapshot import get_snapshot
+
+T = TypeVar("T")
+
+
+async def run_blocking(func: Callable[..., T], *args) -> T:
+    if get_snapshot() is not None:
+        return func(*args)
+
+    return await run_in_threadpool(func, *args)
+
+
+async def get_nearby_stations(
+    coordinate: Coordinate,
+    max_distance: int = 500,
+    fields: Fields = Fields.FULL,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    return await run_blocking(
+        queries.get_nearby_stations, coordinate, max_distance, fields, limit
+    )
+
+
+async def get_station_by_object_id(obj_id: ObjectId, fields: Fields = Fields.FULL):
+    return await run_blocking(queries.get_station_by_object_id, obj_id, fields)
+
+
+async def get_route_by_object_id(obj_id: ObjectId, fields: Fields = Fields.FULL):
+    return await run_blocking(queries.get_route_by_object_id, obj_id, fields)
+
+
+async def get_nearby_stops(
+    coordinate: Coordinate,
+    max_distance: int = 500,
+    fields: Fields = Fields.FULL,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    return await run_blocking(
+        queries.get_nearby_stops, coordinate, max_distance, fields, limit
+    )
+
+
+async def get_possible_routes_between_station(
+    start_station_id: ObjectId,
+    final_station_id: ObjectId,
+    fields: Fields = Fields.FULL,
+):
+    return await run_blocking(
+        queries.get_possible_routes_between_station,
+        start_station_id,
+        final_station_id,
+        fields,
+    )
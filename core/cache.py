@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_missing = object()
+
+
+class LRUCache:
+    """
+    Bounded and thread safe least recently used cache.
+
+    Entries can expire after ttl seconds (0 means they never expire) and hits
+    and misses are counted to help to choose the size of the cache.
+
+    Besides the number of entries, the cache can be limited by the total weight
+    of its values (e.g. an estimation of their size in bytes) given by weigh
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 512,
+        ttl: float = 0,
+        max_weight: int = 0,
+        weigh: Callable[[Any], int] = lambda value: 1,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, weight = self._data.pop(key)
+        self.weight -= weight
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _missing)
+
+            if entry is not _missing:
+                value, expires_at, _ = entry
+                if not expires_at or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        weight = self.weigh(value)
+        if self.max_weight and weight > self.max_weight:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, weight)
+            self.weight += weight
+
+            while len(self._data) > self.maxsize or (
+                self.max_weight and self.weight > self.max_weight
+            ):
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        Remove an entry, or all of them if no key is given
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self.weight = 0
+            elif key in self._data:
+                self._remove(key)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "weight": self.weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0,
+        }
+
+
+def cached(cache: LRUCache):
+    """
+    Cache the results of a function in a LRUCache, None results are not cached
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, *args, *sorted(kwargs.items()))
+            value = cache.get(key, _missing)
+            if value is _missing:
+                value = func(*args, **kwargs)
+                if value is not None:
+                    cache.set(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
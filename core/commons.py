@@ -1,10 +1,25 @@
+import asyncio
 import logging
-from typing import Dict, List
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Dict, Iterable, List, Tuple
 
-from config.constants import STOP_DIFFERENCE
-from core.models import Coordinate
-from core.queries import get_nearby_group_stops, get_nearby_stations
-from core.utils import flatten
+from config.constants import (
+    MAX_BATCH_CONCURRENT_QUERIES,
+    MAX_BATCH_LOOKUPS,
+    MAX_CANDIDATE_STATIONS,
+    MAX_CANDIDATE_STOPS,
+    MIN_CANDIDATES,
+    SEARCH_RADII,
+    STOP_DIFFERENCE,
+)
+from core import async_queries
+from core.cache import LRUCache
+from core.metrics import timed_stage
+from core.models import Coordinate, Fields
+from core.queries import get_nearby_stations, get_nearby_stops
+from core.snapshot import get_snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -34,28 +49,148 @@ def get_best_stops(stops: List[dict], from_start_node: bool = True) -> list:
     return best_stops
 
 
+class CandidateStops:
+    """
+    Columns of the stops near a point, to select the best ones of each route
+    """
+
+    __slots__ = ("stops", "routes", "distances", "amounts_to_arrive", "stop_sequences")
+
+    def __init__(self, stops: List[dict]) -> None:
+        self.stops = stops
+        self.routes = [stop["route"] for stop in stops]
+        self.distances = [stop["distance"] for stop in stops]
+        self.amounts_to_arrive = [stop["amount_to_arrive"] for stop in stops]
+        self.stop_sequences = [stop["stop_sequence"] for stop in stops]
+
+    def get_best_stops(self, from_start_node: bool = True) -> List[dict]:
+        """
+        Same as get_best_stops for the stops of each route, in one pass over the
+        columns. The routes are in the order of their first stop
+        """
+        times = self.amounts_to_arrive if from_start_node else self.stop_sequences
+        distances = self.distances
+
+        # route -> [nearest stop, stop with the best time]
+        best: Dict = {}
+        for i, route in enumerate(self.routes):
+            selected = best.get(route)
+            if selected is None:
+                best[route] = [i, i]
+                continue
+            # strict comparisons keep the first one, as sorted and min do
+            if distances[i] < distances[selected[0]]:
+                selected[0] = i
+            if times[i] < times[selected[1]]:
+                selected[1] = i
+
+        best_stops = []
+        for best_distance, best_time in best.values():
+            best_stops.append(self.stops[best_distance])
+            if abs(int(times[best_distance]) - int(times[best_time])) > STOP_DIFFERENCE:
+                best_stops.append(self.stops[best_time])
+
+        return best_stops
+
+
+def count_candidates(stations: List[dict], stops: List[dict]) -> int:
+    return len(stations) + len({stop["route"] for stop in stops})
+
+
+def select_radius(
+    stations: List[dict], stops: List[dict]
+) -> Tuple[List[dict], List[dict], int]:
+    """
+    Stations and stops within the smallest radius of SEARCH_RADII with enough
+    candidates, and that radius. They are sorted by distance and capped, so the
+    ones within a smaller radius are the same the query of that radius returns
+    """
+    station_distances = [station["distance"] for station in stations]
+    stop_distances = [stop["distance"] for stop in stops]
+
+    for radius in SEARCH_RADII:
+        radius_stations = stations[: bisect_right(station_distances, radius)]
+        radius_stops = stops[: bisect_right(stop_distances, radius)]
+        if count_candidates(radius_stations, radius_stops) >= MIN_CANDIDATES:
+            break
+
+    return radius_stations, radius_stops, radius
+
+
+def search_nearby(
+    coordinate: Coordinate, fields: Fields = Fields.FULL
+) -> Tuple[List[dict], List[dict], int]:
+    """
+    Nearby stations and stops in the smallest radius of SEARCH_RADII with
+    enough candidates, and that radius. They are queried once in the largest
+    radius, see select_radius
+    """
+    radius = SEARCH_RADII[-1]
+    return select_radius(
+        get_nearby_stations(coordinate, radius, fields, MAX_CANDIDATE_STATIONS),
+        get_nearby_stops(coordinate, radius, fields, MAX_CANDIDATE_STOPS),
+    )
+
+
+async def search_nearby_async(
+    coordinate: Coordinate, fields: Fields = Fields.FULL
+) -> Tuple[List[dict], List[dict], int]:
+    """
+    Same as search_nearby but the queries are made concurrently
+    """
+    radius = SEARCH_RADII[-1]
+    stations, stops = await asyncio.gather(
+        async_queries.get_nearby_stations(
+            coordinate, radius, fields, MAX_CANDIDATE_STATIONS
+        ),
+        async_queries.get_nearby_stops(coordinate, radius, fields, MAX_CANDIDATE_STOPS),
+    )
+    return select_radius(stations, stops)
+
+
+def get_adaptive_station_and_stops(
+    start_nearby: Tuple[List[dict], List[dict], int],
+    final_nearby: Tuple[List[dict], List[dict], int],
+) -> Dict:
+    start_stations, start_stops, start_radius = start_nearby
+    final_stations, final_stops, final_radius = final_nearby
+
+    return {
+        "start_stations": start_stations,
+        "start_stops": CandidateStops(start_stops).get_best_stops(),
+        "final_stations": final_stations,
+        "final_stops": CandidateStops(final_stops).get_best_stops(
+            from_start_node=False
+        ),
+        "search_radius": {"start": start_radius, "final": final_radius},
+    }
+
+
+@timed_stage
 def get_station_and_stops(
-    start: Coordinate, final: Coordinate
+    start: Coordinate,
+    final: Coordinate,
+    fields: Fields = Fields.FULL,
+    adaptive: bool = False,
 ) -> Dict[str, List[dict]]:
 
+    if adaptive:
+        logging.info("Search start and final stations and stops")
+        return get_adaptive_station_and_stops(
+            search_nearby(start, fields), search_nearby(final, fields)
+        )
+
     # start
     logging.info("Retrieve start stations and stops")
-    start_stations = get_nearby_stations(start)
-    start_group_stops = get_nearby_group_stops(start)
-    best_start_stops = flatten(
-        map(lambda stops_group: get_best_stops(stops_group), start_group_stops)
-    )
+    start_stations = get_nearby_stations(start, fields=fields)
+    start_stops = CandidateStops(get_nearby_stops(start, fields=fields))
+    best_start_stops = start_stops.get_best_stops()
 
     # final
     logging.info("Retrieve final stations and stops")
-    final_stations = get_nearby_stations(final)
-    final_group_stops = get_nearby_group_stops(final)
-    best_final_stops = flatten(
-        map(
-            lambda stops_group: get_best_stops(stops_group, from_start_node=False),
-            final_group_stops,
-        )
-    )
+    final_stations = get_nearby_stations(final, fields=fields)
+    final_stops = CandidateStops(get_nearby_stops(final, fields=fields))
+    best_final_stops = final_stops.get_best_stops(from_start_node=False)
 
     return {
         "start_stations": start_stations,
@@ -63,3 +198,135 @@ def get_station_and_stops(
         "final_stations": final_stations,
         "final_stops": best_final_stops,
     }
+
+
+@timed_stage
+async def get_station_and_stops_async(
+    start: Coordinate,
+    final: Coordinate,
+    fields: Fields = Fields.FULL,
+    adaptive: bool = False,
+) -> Dict[str, List[dict]]:
+    """
+    Same as get_station_and_stops but the four queries are made concurrently
+    """
+
+    if adaptive:
+        logging.info("Search start and final stations and stops")
+        return get_adaptive_station_and_stops(
+            *await asyncio.gather(
+                search_nearby_async(start, fields),
+                search_nearby_async(final, fields),
+            )
+        )
+
+    logging.info("Retrieve start and final stations and stops")
+    (
+        start_stations,
+        start_stops,
+        final_stations,
+        final_stops,
+    ) = await asyncio.gather(
+        async_queries.get_nearby_stations(start, fields=fields),
+        async_queries.get_nearby_stops(start, fields=fields),
+        async_queries.get_nearby_stations(final, fields=fields),
+        async_queries.get_nearby_stops(final, fields=fields),
+    )
+
+    return {
+        "start_stations": start_stations,
+        "start_stops": CandidateStops(start_stops).get_best_stops(),
+        "final_stations": final_stations,
+        "final_stops": CandidateStops(final_stops).get_best_stops(
+            from_start_node=False
+        ),
+    }
+
+
+class BatchStationAndStops:
+    """
+    Stations and stops of many pairs of points, the nearby stations and stops
+    of a coordinate are retrieved only once even if the coordinate is shared by
+    many pairs. Only the nearby places of the last max_lookups coordinates are
+    kept, so long batches don't hold all of them
+    """
+
+    def __init__(
+        self, fields: Fields = Fields.FULL, max_lookups: int = MAX_BATCH_LOOKUPS
+    ) -> None:
+        self.fields = fields
+        # (lon, lat) -> (nearby stations, CandidateStops of the nearby stops)
+        self.nearby = LRUCache(maxsize=max_lookups)
+
+    def get_nearby(self, coordinate: Coordinate) -> Tuple[List[dict], CandidateStops]:
+        key = (coordinate.lon, coordinate.lat)
+        nearby = self.nearby.get(key)
+        if nearby is None:
+            nearby = (
+                get_nearby_stations(coordinate, fields=self.fields),
+                CandidateStops(get_nearby_stops(coordinate, fields=self.fields)),
+            )
+            self.nearby.set(key, nearby)
+        return nearby
+
+    def prefetch(self, coordinates: Iterable[Coordinate]) -> None:
+        """
+        Retrieve the nearby places of the coordinates that are not known yet,
+        the queries to the database are made concurrently
+        """
+        missing = {}
+        for coordinate in coordinates:
+            key = (coordinate.lon, coordinate.lat)
+            if key not in missing and self.nearby.get(key) is None:
+                missing[key] = coordinate
+
+        if get_snapshot() is not None or len(missing) < 2:
+            for coordinate in missing.values():
+                self.get_nearby(coordinate)
+            return
+
+        max_workers = min(len(missing), MAX_BATCH_CONCURRENT_QUERIES)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(copy_context().run, self.get_nearby, coordinate)
+                for coordinate in missing.values()
+            ]
+            for future in futures:
+                future.result()
+
+    def get(self, start: Coordinate, final: Coordinate) -> Dict[str, List[dict]]:
+        start_stations, start_stops = self.get_nearby(start)
+        final_stations, final_stops = self.get_nearby(final)
+        return {
+            "start_stations": start_stations,
+            "start_stops": start_stops.get_best_stops(),
+            "final_stations": final_stations,
+            "final_stops": final_stops.get_best_stops(from_start_node=False),
+        }
+
+
+@timed_stage
+def get_batch_station_and_stops(
+    points: List[Tuple[Coordinate, Coordinate]], fields: Fields = Fields.FULL
+) -> List[Dict[str, List[dict]]]:
+    """
+    Same as get_station_and_stops for many pairs of points, see
+    BatchStationAndStops
+    """
+
+    logging.info(f"Retrieve stations and stops of {len(points)} pairs of points")
+    batch_station_and_stops = BatchStationAndStops(fields)
+
+    # the nearby places of a chunk of pairs are retrieved together and fit in
+    # the lookups of the batch
+    chunk_size = max(batch_station_and_stops.nearby.maxsize // 2, 1)
+    all_stations_stops = []
+    for i in range(0, len(points), chunk_size):
+        chunk = points[i : i + chunk_size]
+        batch_station_and_stops.prefetch(
+            coordinate for pair in chunk for coordinate in pair
+        )
+        all_stations_stops.extend(
+            batch_station_and_stops.get(start, final) for start, final in chunk
+        )
+    return all_stations_stops
@@ -0,0 +1,71 @@
+"""
+Fast JSON encoding of the responses.
+
+The content is encoded with orjson (when it is installed) handling ObjectId and
+Enum values directly, which gives the same bytes as the default FastAPI
+response (jsonable_encoder and JSONResponse) without going through pydantic
+"""
+
+import json
+from enum import Enum
+from typing import Any, AsyncIterable, AsyncIterator
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from core.metrics import STAGE_DURATION
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=default)
+
+    return json.dumps(
+        content,
+        default=default,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with STAGE_DURATION.time(stage="encoding"):
+            return dumps(content)
+
+
+async def encode_ndjson(records: AsyncIterable[Any]) -> AsyncIterator[bytes]:
+    async for record in records:
+        with STAGE_DURATION.time(stage="encoding"):
+            line = dumps(record) + b"\n"
+        yield line
+
+
+class NDJSONResponse(StreamingResponse):
+    """
+    Each record of the content is sent as a line of JSON as soon as it is
+    produced, so the whole response is never in memory
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    def __init__(self, content: AsyncIterable[Any], **kwargs) -> None:
+        super().__init__(encode_ndjson(content), **kwargs)
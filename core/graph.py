@@ -0,0 +1,297 @@
+"""
+Transit graph compiled from the network and a path builder that searches it.
+
+Nodes are stations and stops and edges are rides:
+
+* station -> station on a troncal route (the stations' destinations)
+* stop -> parent station on an alimentador route
+* parent station -> stop on an alimentador route
+
+The edges are stored as a compressed sparse row adjacency (CSR) in arrays, and
+the walks from the start point and to the final point are added on each search
+"""
+
+import heapq
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from bson.objectid import ObjectId
+
+from config.constants import TRANSFER_COST, WALK_METERS_PER_STOP
+from config.database import db
+from core.models import Coordinate, Fields, Method, ToType
+from core.paths import PathBuilder
+from core.queries import (
+    SLIM_ROUTE_FIELDS,
+    SLIM_STATION_FIELDS,
+    SLIM_STOP_FIELDS,
+    get_slim_field_names,
+)
+from core.snapshot import NetworkSnapshot, get_snapshot, project
+from core.steps import Ride, Step, Walk
+
+logger = logging.getLogger(__name__)
+
+# Reached from the start point walking or riding at least one route
+WALKED, RODE = 0, 1
+
+# (node, WALKED or RODE)
+State = Tuple[int, int]
+
+
+class TransitGraph:
+    def __init__(self, snapshot: NetworkSnapshot) -> None:
+        self.snapshot = snapshot
+
+        self.stations: List[dict] = list(snapshot.stations.values())
+        self.stops: List[dict] = snapshot.stops
+        self.routes: List[dict] = list(snapshot.routes.values())
+
+        self.node_ids: List[ObjectId] = [s["_id"] for s in self.stations] + [
+            s["_id"] for s in self.stops
+        ]
+        self.node_index: Dict[ObjectId, int] = {
+            obj_id: i for i, obj_id in enumerate(self.node_ids)
+        }
+        route_index = {route["_id"]: i for i, route in enumerate(self.routes)}
+
+        # (from node, to node, route, amount to arrive)
+        edges: List[Tuple[int, int, int, int]] = []
+
+        for station_id, destinations in snapshot.destinations.items():
+            for destination in destinations:
+                if destination["route"] not in route_index:
+                    continue
+                edges.append(
+                    (
+                        self.node_index[station_id],
+                        self.node_index[destination["station"]],
+                        route_index[destination["route"]],
+                        int(destination["amount_to_arrive"]),
+                    )
+                )
+
+        for stop in self.stops:
+            if stop["route"] not in route_index:
+                continue
+            stop_node = self.node_index[stop["_id"]]
+            station_node = self.node_index[stop["parent_station"]]
+            route = route_index[stop["route"]]
+            edges.append(
+                (stop_node, station_node, route, int(stop["amount_to_arrive"]))
+            )
+            edges.append((station_node, stop_node, route, int(stop["stop_sequence"])))
+
+        edges.sort()
+        self.offsets = array("l", [0] * (len(self.node_ids) + 1))
+        for from_node, _, _, _ in edges:
+            self.offsets[from_node + 1] += 1
+        for i in range(len(self.node_ids)):
+            self.offsets[i + 1] += self.offsets[i]
+
+        self.targets = array("l", (e[1] for e in edges))
+        self.edge_routes = array("l", (e[2] for e in edges))
+        self.amounts = array("l", (e[3] for e in edges))
+
+        logger.info(
+            f"Transit graph compiled: {len(self.node_ids)} nodes, {len(edges)} edges"
+        )
+
+    def is_station(self, node: int) -> bool:
+        return node < len(self.stations)
+
+    def get_document(self, node: int) -> dict:
+        if self.is_station(node):
+            return self.stations[node]
+        return self.stops[node - len(self.stations)]
+
+    def get_edges(self, node: int):
+        for edge in range(self.offsets[node], self.offsets[node + 1]):
+            yield edge, self.targets[edge], self.amounts[edge]
+
+    def search(
+        self, start_walks: Dict[int, float], final_walks: Dict[int, float]
+    ) -> Optional[List[Tuple[int, Optional[int]]]]:
+        """
+        Dijkstra search from the nodes walked from the start point to the nodes
+        from where the final point is walked. The walks are given in meters.
+
+        Returns the nodes of the best path with the edge used to reach each of
+        them (None for the first one) or None if there is no path
+        """
+
+        costs: Dict[State, float] = {}
+        previous: Dict[State, Tuple[Optional[State], Optional[int]]] = {}
+        queue = []
+
+        for node, distance in start_walks.items():
+            state = (node, WALKED)
+            costs[state] = distance / WALK_METERS_PER_STOP
+            previous[state] = (None, None)
+            heapq.heappush(queue, (costs[state], state))
+
+        best_cost = float("inf")
+        best_state = None
+
+        while queue:
+            cost, state = heapq.heappop(queue)
+            if cost > costs[state] or cost >= best_cost:
+                continue
+
+            node, layer = state
+            if layer == RODE and node in final_walks:
+                final_cost = cost + final_walks[node] / WALK_METERS_PER_STOP
+                if final_cost < best_cost:
+                    best_cost = final_cost
+                    best_state = state
+
+            for edge, target, amount in self.get_edges(node):
+                next_state = (target, RODE)
+                next_cost = cost + amount + TRANSFER_COST
+                if next_cost < costs.get(next_state, float("inf")):
+                    costs[next_state] = next_cost
+                    previous[next_state] = (state, edge)
+                    heapq.heappush(queue, (next_cost, next_state))
+
+        if best_state is None:
+            return None
+
+        path = []
+        state = best_state
+        while state is not None:
+            prev_state, edge = previous[state]
+            path.append((state[0], edge))
+            state = prev_state
+
+        return path[::-1]
+
+
+_graph: Optional[TransitGraph] = None
+# only one thread builds the graph, the others wait for it
+_graph_lock = threading.Lock()
+
+
+def get_transit_graph() -> TransitGraph:
+    """
+    Graph of the loaded network snapshot, if the network is not in memory it is
+    loaded from the database only to compile the graph
+    """
+    global _graph
+
+    snapshot = get_snapshot()
+    graph = _graph
+    if graph is None or (snapshot is not None and graph.snapshot is not snapshot):
+        with _graph_lock:
+            # another thread may have built it while this one waited
+            graph = _graph
+            if graph is None or (
+                snapshot is not None and graph.snapshot is not snapshot
+            ):
+                if snapshot is None:
+                    snapshot = NetworkSnapshot.from_database(db)
+                graph = _graph = TransitGraph(snapshot)
+
+    return graph
+
+
+def invalidate_transit_graph() -> None:
+    global _graph
+    with _graph_lock:
+        _graph = None
+
+
+class GraphPathBuilder(PathBuilder):
+    """
+    Create the best path searching the transit graph, the path can have any
+    number of transfers between routes
+    """
+
+    def __init__(
+        self,
+        start: Coordinate,
+        final: Coordinate,
+        stations_stops: Dict[str, List[dict]],
+        fields: Fields = Fields.FULL,
+        graph: Optional[TransitGraph] = None,
+    ) -> None:
+        super().__init__(start, final, stations_stops, fields)
+        self.graph = graph or get_transit_graph()
+
+    def project(self, doc: dict, slim_field_names: Tuple[str, ...]) -> dict:
+        return project(doc, get_slim_field_names(self.fields, slim_field_names))
+
+    def get_walks(self, documents: List[dict]) -> Dict[int, dict]:
+        walks = {}
+        for doc in documents:
+            node = self.graph.node_index.get(doc["_id"])
+            if node is not None:
+                walks[node] = doc
+        return walks
+
+    def get_step(
+        self, node: int, edge: Optional[int], previous_node: int, data: dict
+    ) -> Step:
+        place_type = ToType.STATION if self.graph.is_station(node) else ToType.STOP
+
+        if edge is None:
+            return Step(place_type, data, Walk(distance=data["distance"]))
+
+        # Only troncal routes go from station to station
+        is_troncal = self.graph.is_station(node) and self.graph.is_station(
+            previous_node
+        )
+        method = Method.TRONCAL if is_troncal else Method.ALIMENTADOR
+        route = self.project(
+            self.graph.routes[self.graph.edge_routes[edge]], SLIM_ROUTE_FIELDS
+        )
+        through = Ride(
+            method=method,
+            route_data=route,
+            amount_to_arrive=self.graph.amounts[edge],
+        )
+        return Step(place_type, data, through)
+
+    def get_best_path(self) -> List[List[Step]]:
+        logger.info("Search the best path in the transit graph")
+
+        start_docs = self.get_walks([*self.start_stations, *self.start_stops])
+        final_docs = self.get_walks([*self.final_stations, *self.final_stops])
+
+        path = self.graph.search(
+            {node: doc["distance"] for node, doc in start_docs.items()},
+            {node: doc["distance"] for node, doc in final_docs.items()},
+        )
+        if path is None:
+            return [[]]
+
+        steps = []
+        previous_node = None
+        for i, (node, edge) in enumerate(path):
+            if i == 0:
+                data = start_docs[node]
+            elif i == len(path) - 1:
+                data = final_docs[node]
+            else:
+                data = self.project(
+                    self.graph.get_document(node),
+                    (
+                        SLIM_STATION_FIELDS
+                        if self.graph.is_station(node)
+                        else SLIM_STOP_FIELDS
+                    ),
+                )
+            steps.append(self.get_step(node, edge, previous_node, data))
+            previous_node = node
+
+        last_node = path[-1][0]
+        final_through = Walk(distance=final_docs[last_node]["distance"])
+        steps.append(
+            Step.place(data=self.final.to_geo_json_dict(), through=final_through)
+        )
+
+        return [steps]
+
+    def get_strategies(self):
+        return [self.get_best_path]
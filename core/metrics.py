@@ -0,0 +1,314 @@
+"""
+Metrics of the API in the Prometheus text format.
+
+A minimal registry of counters and histograms with labels, enough to know where
+the time of a request goes (queries, stages of the path builders and encoding),
+the database round trips of each request, the hit rate of the caches and the
+number of paths returned. Observing a value only takes a lock and a few
+additions, the text is built when /metrics is requested
+"""
+
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# the response adds the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    labels = ",".join(
+        f'{name}="{escape_label_value(str(value))}"'
+        for name, value in zip(names, values)
+    )
+    return f"{{{labels}}}" if labels else ""
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = Lock()
+
+    def get_label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.get_samples())
+        return lines
+
+    def get_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names=()) -> None:
+        super().__init__(name, documentation, label_names)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get_samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names=(),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # label values -> (count of each bucket, sum)
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.get_label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = ([0] * len(self.buckets), [0.0])
+            counts, total = self.values[key]
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_samples(self) -> List[str]:
+        with self.lock:
+            values = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self.values.items()
+            ]
+
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    (*self.label_names, "le"), (*key, format_value(bucket))
+                )
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {format_value(total)}")
+            samples.append(f"{self.name}_count{labels} {cumulative}")
+        return samples
+
+
+class CacheCollector:
+    """
+    Hits and misses of LRU caches, read from their stats when collected
+    """
+
+    def __init__(self, name: str, get_caches: Callable[[], dict]) -> None:
+        self.name = name
+        self.get_caches = get_caches
+
+    def collect(self) -> List[str]:
+        caches = [(name, cache.stats()) for name, cache in self.get_caches().items()]
+        lines = []
+        for suffix, stat, type_name, documentation in (
+            ("hits_total", "hits", "counter", "Lookups found in the cache"),
+            ("misses_total", "misses", "counter", "Lookups not found in the cache"),
+            ("hit_ratio", "hit_rate", "gauge", "Hits over all the lookups"),
+            ("size", "size", "gauge", "Entries in the cache"),
+        ):
+            name = f"{self.name}_{suffix}"
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {type_name}")
+            for cache_name, stats in caches:
+                labels = format_labels(("cache",), (cache_name,))
+                lines.append(f"{name}{labels} {format_value(stats[stat])}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.collectors: list = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def render(self) -> bytes:
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.collect())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(
+    Histogram(
+        "transmetro_request_duration_seconds",
+        "Duration of the requests",
+        ["path"],
+    )
+)
+STAGE_DURATION = registry.register(
+    Histogram(
+        "transmetro_stage_duration_seconds",
+        "Duration of the stages of a request",
+        ["stage"],
+    )
+)
+QUERY_DURATION = registry.register(
+    Histogram(
+        "transmetro_query_duration_seconds",
+        "Duration of the queries not answered by a cache",
+        ["query", "source"],
+    )
+)
+DB_ROUND_TRIPS = registry.register(
+    Histogram(
+        "transmetro_db_round_trips_per_request",
+        "Queries sent to the database by a request",
+        ["path"],
+        buckets=COUNT_BUCKETS,
+    )
+)
+PATHS_RETURNED = registry.register(
+    Histogram(
+        "transmetro_paths_returned",
+        "Paths returned for a pair of points",
+        ["endpoint"],
+        buckets=COUNT_BUCKETS,
+    )
+)
+
+
+class RequestStats:
+    __slots__ = ("db_round_trips",)
+
+    def __init__(self) -> None:
+        self.db_round_trips = 0
+
+
+# Stats of the request in progress, the threadpool copies the context so the
+# queries made in it are counted too
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def count_db_round_trip() -> None:
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_round_trips += 1
+
+
+def timed_stage(func):
+    """
+    Record the duration of the function as a stage with the name of the function
+    """
+    stage = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with STAGE_DURATION.time(stage=stage):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with STAGE_DURATION.time(stage=stage):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the duration and database round trips of each
+    request, by the path of its route
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_stats.reset(token)
+            # the route path, so ids in the url don't create new labels
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, path=path)
+            DB_ROUND_TRIPS.observe(stats.db_round_trips, path=path)
@@ -1,8 +1,10 @@
 from enum import Enum
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from bson import ObjectId
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist
+
+from config.constants import MAX_BATCH_PAIRS
 
 
 class Coordinate(BaseModel):
@@ -25,6 +27,15 @@ class ToType(Enum):
     PLACE = "Place"
 
 
+class Fields(Enum):
+    """
+    Fields of the stations, stops and routes included in the paths
+    """
+
+    SLIM = "slim"
+    FULL = "full"
+
+
 # Through
 
 
@@ -85,8 +96,26 @@ class SinglePathResponse(BaseModel):
     start: Coordinate
     final: Coordinate
     paths: List[List[Union[ToStation, ToStop, ToPlace]]]
+    # radius of the start and final points, only with the adaptive search
+    search_radius: Optional[Dict[str, int]] = None
 
     class Config:
         json_encoders = {
             ObjectId: lambda o: str(o),
         }
+
+
+class PathQuery(BaseModel):
+    start: Coordinate
+    final: Coordinate
+
+
+class BatchPathRequest(BaseModel):
+    # all the responses are built in memory before they are sent
+    pairs: conlist(PathQuery, max_items=MAX_BATCH_PAIRS)
+
+
+class BatchPathStreamRequest(BaseModel):
+    # the responses are sent one by one, the number of pairs is limited by
+    # BATCH_STREAM_MAX_PAIRS
+    pairs: List[PathQuery]
@@ -0,0 +1,134 @@
+"""
+Version of the network stored in the database.
+
+The network is rebuilt in new collections named after the version. Once they
+are ready, the current document of the network_version collection is replaced
+by one with the new version and the names of its collections, so a single write
+swaps the stations, routes and stops at the same time. The API reads the names
+of the collections from that document again every NETWORK_COLLECTIONS_TTL
+seconds, and checks the version to reload the network in memory and drop the
+documents and paths cached from the previous one
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from config.database import NETWORK_COLLECTIONS_TTL
+
+logger = logging.getLogger(__name__)
+
+NETWORK_VERSION_COLLECTION = "network_version"
+CURRENT_VERSION_ID = "current"
+NETWORK_COLLECTIONS = ("stations", "routes", "stops")
+
+Collections = Dict[str, str]
+
+
+def get_version_document(db) -> Optional[dict]:
+    return db[NETWORK_VERSION_COLLECTION].find_one({"_id": CURRENT_VERSION_ID})
+
+
+def get_version_collections(document: Optional[dict]) -> Collections:
+    """
+    Names of the collections of a version, the collections without a version
+    are used until the network is rebuilt for the first time
+    """
+    if document is None or "collections" not in document:
+        return {name: name for name in NETWORK_COLLECTIONS}
+    return dict(document["collections"])
+
+
+# Collections of the served version, read from the database again when they are
+# older than NETWORK_COLLECTIONS_TTL
+_collections: Optional[Collections] = None
+_collections_read_at = 0.0
+
+# Collections used by the request in progress, so all its queries are made to
+# the same version even if it changes in the middle of the request
+_request_collections: ContextVar[Optional[Collections]] = ContextVar(
+    "request_collections", default=None
+)
+
+
+def set_network_collections(collections: Optional[Collections]) -> None:
+    global _collections, _collections_read_at
+    _collections = collections
+    _collections_read_at = time.monotonic()
+
+
+def get_network_collections(db) -> Collections:
+    request_collections = _request_collections.get()
+    if request_collections:
+        return request_collections
+
+    collections = _collections
+    if (
+        collections is None
+        or time.monotonic() - _collections_read_at >= NETWORK_COLLECTIONS_TTL
+    ):
+        collections = get_version_collections(get_version_document(db))
+        set_network_collections(collections)
+
+    if request_collections is not None:
+        request_collections.update(collections)
+    return collections
+
+
+@contextmanager
+def pinned_network_collections():
+    """
+    Inside this context, the collections are the ones served when the first
+    query is made
+    """
+    token = _request_collections.set({})
+    try:
+        yield
+    finally:
+        _request_collections.reset(token)
+
+
+class NetworkVersionMiddleware:
+    """
+    ASGI middleware that makes all the queries of a request to one version of
+    the network
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with pinned_network_collections():
+            await self.app(scope, receive, send)
+
+
+class NetworkVersionWatcher:
+    def __init__(self, db, on_change: Callable[[], None]) -> None:
+        self.db = db
+        self.on_change = on_change
+        self.version: Optional[str] = None
+
+    def sync(self) -> None:
+        """
+        Take the current version as the served one, without calling on_change
+        """
+        document = get_version_document(self.db)
+        self.version = document["version"] if document is not None else None
+        set_network_collections(get_version_collections(document))
+
+    def check(self) -> bool:
+        document = get_version_document(self.db)
+        version = document["version"] if document is not None else None
+        if version == self.version:
+            return False
+
+        logger.info(f"Network version changed from {self.version} to {version}")
+        self.version = version
+        set_network_collections(get_version_collections(document))
+        self.on_change()
+        return True
@@ -1,46 +1,59 @@
+import asyncio
 import logging
-from typing import Dict, List, Tuple
-
-from core.models import (
-    Coordinate,
-    Method,
-    Through,
-    ThroughRoute,
-    ThroughWalk,
-    ToPlace,
-    ToSomewhere,
-    ToStation,
-    ToStop,
+from bisect import insort
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
 )
+
+from bson.objectid import ObjectId
+
+from config.constants import MAX_ALTERNATIVES, TRANSFER_COST, WALK_METERS_PER_STOP
+from core.async_queries import run_blocking
+from core.encoders import dumps
+from core.metrics import STAGE_DURATION
+from core.models import Coordinate, Fields, Method
 from core.queries import (
     get_possible_routes_between_station,
+    get_possible_routes_between_stations,
     get_route_by_object_id,
     get_station_by_object_id,
 )
+from core.steps import Ride, Step, Walk
 
 logger = logging.getLogger(__name__)
 
 
 def get_steps_between_start_station_and_final_station(
-    start_station: dict, final_station: dict, start_through: Through
-) -> List[List[ToStation]]:
+    start_station: dict,
+    final_station: dict,
+    start_through: Union[Walk, Ride],
+    fields: Fields = Fields.FULL,
+) -> List[List[Step]]:
     logger.info("Retrieve possible routes between stations")
     troncal_route_data = get_possible_routes_between_station(
-        start_station["_id"], final_station["_id"]
+        start_station["_id"], final_station["_id"], fields
     )
 
     # You must arrive to the station in some way
-    base_step = ToStation(data=start_station, through=start_through)
+    base_step = Step.station(data=start_station, through=start_through)
 
     steps = []
 
     for route_data in troncal_route_data:
-        through = ThroughRoute(
+        through = Ride(
             method=Method.TRONCAL,
             route_data=route_data["route"],
             amount_to_arrive=route_data["destination_data"]["amount_to_arrive"],
         )
-        steps.append([base_step, ToStation(data=final_station, through=through)])
+        steps.append([base_step, Step.station(data=final_station, through=through)])
 
     return steps
 
@@ -51,51 +64,103 @@ class PathBuilder:
         start: Coordinate,
         final: Coordinate,
         stations_stops: Dict[str, List[dict]],
+        fields: Fields = Fields.FULL,
     ) -> None:
         self.start = start
         self.final = final
+        self.fields = fields
 
         self.start_stations = stations_stops["start_stations"]
         self.final_stations = stations_stops["final_stations"]
         self.start_stops = stations_stops["start_stops"]
         self.final_stops = stations_stops["final_stops"]
 
-    def get_final_step(self, final_through: Through):
-        return ToPlace(data=self.final.to_geo_json_dict(), through=final_through)
+    def get_final_step(self, final_through: Union[Walk, Ride]):
+        return Step.place(data=self.final.to_geo_json_dict(), through=final_through)
 
     def get_paths_between_start_stations_and_final_stations(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
         return [[]]
 
     def get_paths_between_start_stops_and_final_stations(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
         pass
 
     def get_paths_between_start_stations_and_final_stops(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
         pass
 
     def get_paths_between_start_stops_and_final_stops(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
         pass
 
-    def get_all_possible_paths(self) -> List[List[ToSomewhere]]:
+    def get_strategies(self) -> List[Callable[[], List[List[Step]]]]:
+        return [
+            self.get_paths_between_start_stations_and_final_stations,
+            self.get_paths_between_start_stops_and_final_stations,
+            self.get_paths_between_start_stations_and_final_stops,
+            self.get_paths_between_start_stops_and_final_stops,
+        ]
 
+    def merge_paths(self, strategies_paths: List[List[List[Step]]]) -> List[List[Step]]:
         paths = []
 
-        paths.extend(self.get_paths_between_start_stations_and_final_stations())
-        paths.extend(self.get_paths_between_start_stops_and_final_stations())
-        paths.extend(self.get_paths_between_start_stations_and_final_stops())
-        paths.extend(self.get_paths_between_start_stops_and_final_stops())
+        for strategy_paths in strategies_paths:
+            paths.extend(strategy_paths)
 
         paths = list(filter(lambda p: bool(p), paths))
 
         return paths
 
+    def run_strategy(
+        self, strategy: Callable[[], List[List[Step]]]
+    ) -> List[List[Step]]:
+        with STAGE_DURATION.time(stage=f"strategy.{strategy.__name__}"):
+            return strategy()
+
+    def get_all_possible_paths(self) -> List[List[Step]]:
+        return self.merge_paths(
+            [self.run_strategy(strategy) for strategy in self.get_strategies()]
+        )
+
+    async def get_all_possible_paths_async(self) -> List[List[Step]]:
+        """
+        Run the strategies concurrently in the threadpool, the paths are
+        returned in the same order as get_all_possible_paths
+        """
+        strategies_paths = await asyncio.gather(
+            *(
+                run_blocking(self.run_strategy, strategy)
+                for strategy in self.get_strategies()
+            )
+        )
+        return self.merge_paths(strategies_paths)
+
+    def iter_paths(self) -> Iterator[List[Step]]:
+        """
+        Same paths as get_all_possible_paths, each one yielded as soon as its
+        strategy has built it
+        """
+        for strategy in self.get_strategies():
+            for path in self.run_strategy(strategy):
+                if path:
+                    yield path
+
+    async def iter_paths_async(self) -> AsyncIterator[List[Step]]:
+        """
+        Same as iter_paths but the paths are built in the threadpool
+        """
+        paths = self.iter_paths()
+        while True:
+            path = await run_blocking(next, paths, None)
+            if path is None:
+                return
+            yield path
+
 
 class SingleAlternativePathBuilder(PathBuilder):
     """
@@ -109,26 +174,26 @@ class SingleAlternativePathBuilder(PathBuilder):
         return min(self.final_stations, key=lambda s: s["distance"])
 
     def get_troncal_steps(
-        self, start_station: dict, final_station: dict, start_through: Through
+        self, start_station: dict, final_station: dict, start_through: Union[Walk, Ride]
     ):
         # All Stations are connected, so at least it will return a route
         all_troncal_steps = get_steps_between_start_station_and_final_station(
-            start_station, final_station, start_through
+            start_station, final_station, start_through, self.fields
         )
         return all_troncal_steps[0]
 
     def get_data_from_stop(self, stop: dict) -> Tuple[dict, dict]:
         # Ignore other parent stations (Special case)
         logging.info(f"Get parent station of id: {stop['parent_station']}")
-        station = get_station_by_object_id(stop["parent_station"])
+        station = get_station_by_object_id(stop["parent_station"], self.fields)
         logging.info(f"Get route of id: {stop['route']}")
-        alimentador_route = get_route_by_object_id(stop["route"])
+        alimentador_route = get_route_by_object_id(stop["route"], self.fields)
 
         return station, alimentador_route
 
     def get_paths_between_start_stations_and_final_stations(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
 
         logger.info("Retrieve paths between start stations and final stations")
         if self.start_stations and self.final_stations:
@@ -139,12 +204,12 @@ class SingleAlternativePathBuilder(PathBuilder):
             if start_station["_id"] == final_station["_id"]:
                 return [[]]
 
-            start_through = ThroughWalk(distance=start_station["distance"])
+            start_through = Walk(distance=start_station["distance"])
             troncal_steps = self.get_troncal_steps(
                 start_station, final_station, start_through
             )
 
-            final_through = ThroughWalk(distance=final_station["distance"])
+            final_through = Walk(distance=final_station["distance"])
 
             return [[*troncal_steps, self.get_final_step(final_through)]]
 
@@ -152,7 +217,7 @@ class SingleAlternativePathBuilder(PathBuilder):
 
     def get_paths_between_start_stops_and_final_stations(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
 
         logger.info("Retrieve paths between start stops and final stations")
         if self.start_stops and self.final_stations:
@@ -160,13 +225,13 @@ class SingleAlternativePathBuilder(PathBuilder):
             start_stop = min(self.start_stops, key=lambda s: s["distance"])
             final_station = self.get_final_station()
 
-            start_step = ToStop(
-                data=start_stop, through=ThroughWalk(distance=start_stop["distance"])
+            start_step = Step.stop(
+                data=start_stop, through=Walk(distance=start_stop["distance"])
             )
 
             start_station, alimentador_route = self.get_data_from_stop(start_stop)
 
-            route_through = ThroughRoute(
+            route_through = Ride(
                 method=Method.ALIMENTADOR,
                 route_data=alimentador_route,
                 amount_to_arrive=start_stop["amount_to_arrive"],
@@ -174,13 +239,15 @@ class SingleAlternativePathBuilder(PathBuilder):
 
             # Special case
             if start_station["_id"] == final_station["_id"]:
-                troncal_steps = [ToStation(data=start_station, through=route_through)]
+                troncal_steps = [
+                    Step.station(data=start_station, through=route_through)
+                ]
             else:
                 troncal_steps = self.get_troncal_steps(
                     start_station, final_station, route_through
                 )
 
-            final_through = ThroughWalk(distance=final_station["distance"])
+            final_through = Walk(distance=final_station["distance"])
 
             return [[start_step, *troncal_steps, self.get_final_step(final_through)]]
 
@@ -188,7 +255,7 @@ class SingleAlternativePathBuilder(PathBuilder):
 
     def get_paths_between_start_stations_and_final_stops(
         self,
-    ) -> List[List[ToSomewhere]]:
+    ) -> List[List[Step]]:
 
         logger.info("Retrieve paths between start stations and final stops")
         if self.start_stations and self.final_stops:
@@ -198,32 +265,34 @@ class SingleAlternativePathBuilder(PathBuilder):
 
             final_station, alimentador_route = self.get_data_from_stop(final_stop)
 
-            start_through = ThroughWalk(distance=start_station["distance"])
+            start_through = Walk(distance=start_station["distance"])
 
             # Special case
             if start_station["_id"] == final_station["_id"]:
-                troncal_steps = [ToStation(data=start_station, through=start_through)]
+                troncal_steps = [
+                    Step.station(data=start_station, through=start_through)
+                ]
             else:
                 troncal_steps = self.get_troncal_steps(
                     start_station, final_station, start_through
                 )
 
-            stop_step = ToStop(
+            stop_step = Step.stop(
                 data=final_stop,
-                through=ThroughRoute(
+                through=Ride(
                     method=Method.ALIMENTADOR,
                     route_data=alimentador_route,
                     amount_to_arrive=final_stop["stop_sequence"],
                 ),
             )
 
-            final_through = ThroughWalk(distance=final_stop["distance"])
+            final_through = Walk(distance=final_stop["distance"])
 
             return [[*troncal_steps, stop_step, self.get_final_step(final_through)]]
 
         return [[]]
 
-    def get_paths_between_start_stops_and_final_stops(self) -> List[List[ToSomewhere]]:
+    def get_paths_between_start_stops_and_final_stops(self) -> List[List[Step]]:
 
         logger.info("Retrieve paths between start stops and final stops")
         if self.start_stops and self.final_stops:
@@ -234,11 +303,11 @@ class SingleAlternativePathBuilder(PathBuilder):
             start_station, start_alimentador_route = self.get_data_from_stop(start_stop)
             final_station, final_alimentador_route = self.get_data_from_stop(final_stop)
 
-            start_step = ToStop(
-                data=start_stop, through=ThroughWalk(distance=start_stop["distance"])
+            start_step = Step.stop(
+                data=start_stop, through=Walk(distance=start_stop["distance"])
             )
 
-            route_through = ThroughRoute(
+            route_through = Ride(
                 method=Method.ALIMENTADOR,
                 route_data=start_alimentador_route,
                 amount_to_arrive=start_stop["amount_to_arrive"],
@@ -246,22 +315,24 @@ class SingleAlternativePathBuilder(PathBuilder):
 
             # Special case
             if start_station["_id"] == final_station["_id"]:
-                troncal_steps = [ToStation(data=start_station, through=route_through)]
+                troncal_steps = [
+                    Step.station(data=start_station, through=route_through)
+                ]
             else:
                 troncal_steps = self.get_troncal_steps(
                     start_station, final_station, route_through
                 )
 
-            stop_step = ToStop(
+            stop_step = Step.stop(
                 data=final_stop,
-                through=ThroughRoute(
+                through=Ride(
                     method=Method.ALIMENTADOR,
                     route_data=final_alimentador_route,
                     amount_to_arrive=final_stop["stop_sequence"],
                 ),
             )
 
-            final_through = ThroughWalk(distance=final_stop["distance"])
+            final_through = Walk(distance=final_stop["distance"])
 
             return [
                 [
@@ -275,9 +346,255 @@ class SingleAlternativePathBuilder(PathBuilder):
         return [[]]
 
 
-def get_json_from_tosomewhere_steps(path: List[ToSomewhere]):
-    return "[" + ",".join(map(lambda ts: ts.json(), path)) + "]"
+class PathOption(NamedTuple):
+    """
+    A way to go from the start point to a station or from a station to the final
+    point, walking to the place or riding an alimentador route from a stop
+    """
+
+    cost: float
+    station_id: ObjectId
+    place: dict
+    is_stop: bool
+
+
+class MultiAlternativePathBuilder(SingleAlternativePathBuilder):
+    """
+    Create the best paths combining every start and final station and stop, not
+    only the nearest ones.
+
+    The paths are measured in stops as in the graph path builder. The cost of
+    reaching the stations is known from the stations and stops, only the troncal
+    part needs a lookup, so the combinations are evaluated from the lowest bound
+    of their cost and the evaluation stops when no remaining combination can be
+    better than the paths found
+    """
+
+    def __init__(
+        self,
+        start: Coordinate,
+        final: Coordinate,
+        stations_stops: Dict[str, List[dict]],
+        fields: Fields = Fields.FULL,
+        max_paths: int = MAX_ALTERNATIVES,
+    ) -> None:
+        super().__init__(start, final, stations_stops, fields)
+        self.max_paths = max_paths
+        self.troncal_routes: Dict[Tuple[ObjectId, ObjectId], Optional[dict]] = {}
+        self.stops_data: Dict[Tuple[ObjectId, ObjectId], Tuple[dict, dict]] = {}
+
+    def get_walk_cost(self, place: dict) -> float:
+        return place["distance"] / WALK_METERS_PER_STOP
+
+    def get_start_options(self) -> List[PathOption]:
+        options = [
+            PathOption(self.get_walk_cost(station), station["_id"], station, False)
+            for station in self.start_stations
+        ]
+        for stop in self.start_stops:
+            cost = (
+                self.get_walk_cost(stop) + int(stop["amount_to_arrive"]) + TRANSFER_COST
+            )
+            options.append(PathOption(cost, stop["parent_station"], stop, True))
+        return options
+
+    def get_final_options(self) -> List[PathOption]:
+        options = [
+            PathOption(self.get_walk_cost(station), station["_id"], station, False)
+            for station in self.final_stations
+        ]
+        for stop in self.final_stops:
+            cost = self.get_walk_cost(stop) + int(stop["stop_sequence"]) + TRANSFER_COST
+            options.append(PathOption(cost, stop["parent_station"], stop, True))
+        return options
+
+    def get_shortest_troncal_route(self, troncal_routes: List[dict]) -> Optional[dict]:
+        return min(
+            troncal_routes,
+            key=lambda r: r["destination_data"]["amount_to_arrive"],
+            default=None,
+        )
+
+    def prefetch_troncal_routes(
+        self, start_options: List[PathOption], final_options: List[PathOption]
+    ) -> None:
+        """
+        Look up the troncal routes between every start and final station at
+        once, instead of a lookup for each combination
+        """
+        start_station_ids = list(dict.fromkeys(o.station_id for o in start_options))
+        final_station_ids = list(dict.fromkeys(o.station_id for o in final_options))
+        if not start_station_ids or not final_station_ids:
+            return
+
+        station_routes = get_possible_routes_between_stations(
+            start_station_ids, final_station_ids, self.fields
+        )
+
+        for start_station_id in start_station_ids:
+            for final_station_id in final_station_ids:
+                key = (start_station_id, final_station_id)
+                if start_station_id != final_station_id:
+                    self.troncal_routes[key] = self.get_shortest_troncal_route(
+                        station_routes.get(key, [])
+                    )
+
+    def get_troncal_route(
+        self, start_station_id: ObjectId, final_station_id: ObjectId
+    ) -> Optional[dict]:
+        """
+        Troncal route with less stops between the stations, looked up once
+        """
+        key = (start_station_id, final_station_id)
+        if key not in self.troncal_routes:
+            self.troncal_routes[key] = self.get_shortest_troncal_route(
+                get_possible_routes_between_station(
+                    start_station_id, final_station_id, self.fields
+                )
+            )
+        return self.troncal_routes[key]
+
+    def get_troncal_cost(
+        self, start_station_id: ObjectId, final_station_id: ObjectId
+    ) -> Optional[float]:
+        if start_station_id == final_station_id:
+            return 0
+
+        troncal_route = self.get_troncal_route(start_station_id, final_station_id)
+        if troncal_route is None:
+            return None
+        return (
+            int(troncal_route["destination_data"]["amount_to_arrive"]) + TRANSFER_COST
+        )
+
+    def get_data_from_stop(self, stop: dict) -> Tuple[dict, dict]:
+        key = (stop["parent_station"], stop["route"])
+        if key not in self.stops_data:
+            self.stops_data[key] = super().get_data_from_stop(stop)
+        return self.stops_data[key]
+
+    def get_best_options(self) -> List[Tuple[PathOption, PathOption]]:
+        start_options = self.get_start_options()
+        final_options = self.get_final_options()
+        self.prefetch_troncal_routes(start_options, final_options)
+
+        combinations = []
+        for start_option in start_options:
+            for final_option in final_options:
+                same_station = start_option.station_id == final_option.station_id
+
+                # Special case, walking to a station and walking away from it
+                if (
+                    same_station
+                    and not start_option.is_stop
+                    and not final_option.is_stop
+                ):
+                    continue
+
+                # The troncal part takes at least one stop if the stations differ
+                lower_bound = start_option.cost + final_option.cost
+                if not same_station:
+                    lower_bound += 1 + TRANSFER_COST
+                combinations.append((lower_bound, start_option, final_option))
+
+        combinations.sort(key=lambda c: c[0])
+
+        # (cost, position, start option, final option) sorted by cost
+        best: List[Tuple[float, int, PathOption, PathOption]] = []
+        for position, (lower_bound, start_option, final_option) in enumerate(
+            combinations
+        ):
+            if len(best) == self.max_paths and lower_bound >= best[-1][0]:
+                break
+
+            troncal_cost = self.get_troncal_cost(
+                start_option.station_id, final_option.station_id
+            )
+            if troncal_cost is None:
+                continue
+
+            cost = start_option.cost + troncal_cost + final_option.cost
+            insort(best, (cost, position, start_option, final_option))
+            del best[self.max_paths :]
+
+        return [
+            (start_option, final_option) for _, _, start_option, final_option in best
+        ]
+
+    def get_path(
+        self, start_option: PathOption, final_option: PathOption
+    ) -> List[Step]:
+        steps = []
+
+        start_place = start_option.place
+        if start_option.is_stop:
+            steps.append(
+                Step.stop(
+                    data=start_place, through=Walk(distance=start_place["distance"])
+                )
+            )
+            start_station, alimentador_route = self.get_data_from_stop(start_place)
+            start_through = Ride(
+                method=Method.ALIMENTADOR,
+                route_data=alimentador_route,
+                amount_to_arrive=start_place["amount_to_arrive"],
+            )
+        else:
+            start_station = start_place
+            start_through = Walk(distance=start_place["distance"])
+
+        steps.append(Step.station(data=start_station, through=start_through))
+
+        final_place = final_option.place
+        if final_option.is_stop:
+            final_station, final_alimentador_route = self.get_data_from_stop(
+                final_place
+            )
+        else:
+            final_station = final_place
+
+        if start_option.station_id != final_option.station_id:
+            troncal_route = self.get_troncal_route(
+                start_option.station_id, final_option.station_id
+            )
+            troncal_through = Ride(
+                method=Method.TRONCAL,
+                route_data=troncal_route["route"],
+                amount_to_arrive=troncal_route["destination_data"]["amount_to_arrive"],
+            )
+            steps.append(Step.station(data=final_station, through=troncal_through))
+
+        if final_option.is_stop:
+            stop_through = Ride(
+                method=Method.ALIMENTADOR,
+                route_data=final_alimentador_route,
+                amount_to_arrive=final_place["stop_sequence"],
+            )
+            steps.append(Step.stop(data=final_place, through=stop_through))
+
+        steps.append(self.get_final_step(Walk(distance=final_place["distance"])))
+        return steps
+
+    def iter_best_paths(self) -> Iterator[List[Step]]:
+        logger.info(f"Retrieve the best {self.max_paths} paths")
+        for start_option, final_option in self.get_best_options():
+            yield self.get_path(start_option, final_option)
+
+    def get_best_paths(self) -> List[List[Step]]:
+        return list(self.iter_best_paths())
+
+    def get_strategies(self) -> List[Callable[[], List[List[Step]]]]:
+        return [self.get_best_paths]
+
+    def iter_paths(self) -> Iterator[List[Step]]:
+        # the options are sorted first, then each path is built when the
+        # previous one is consumed
+        return self.iter_best_paths()
+
+
+def get_json_from_tosomewhere_steps(path: List[Step]):
+    return dumps([step.to_dict() for step in path]).decode()
 
 
-def get_json_from_list_of_paths(paths: List[List[ToSomewhere]]):
-    return "[" + ",".join(map(get_json_from_tosomewhere_steps, paths)) + "]"
+def get_json_from_list_of_paths(paths: List[List[Step]]):
+    return dumps([[step.to_dict() for step in path] for path in paths]).decode()
@@ -0,0 +1,191 @@
+"""
+Profiler of the queries sent to the database.
+
+It listens to the commands of the pymongo client and records, for the request
+that sent each one, its shape (the pipeline or filter without the values), its
+duration, the documents returned and the size of the reply. When the request
+ends its trace is logged and kept to be inspected in /stats/queries, and the
+queries with the same shape made many times by the same request are flagged,
+since they usually are lookups that can be made once (N+1 queries)
+"""
+
+import json
+import logging
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+import bson
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Commands of the driver itself, not sent by the code
+IGNORED_COMMANDS = {
+    "hello",
+    "ismaster",
+    "isMaster",
+    "ping",
+    "endSessions",
+    "saslStart",
+    "saslContinue",
+    "killCursors",
+}
+
+
+def get_shape(value: Any) -> Any:
+    """
+    Same structure of the value with every value replaced by "?"
+    """
+    if isinstance(value, dict):
+        return {key: get_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [get_shape(item) for item in value]
+    return "?"
+
+
+def get_command_shape(command_name: str, command: dict) -> str:
+    if command_name == "aggregate":
+        shape = get_shape(command.get("pipeline", []))
+    elif command_name == "find":
+        shape = {
+            "filter": get_shape(command.get("filter", {})),
+            "projection": get_shape(command.get("projection", {})),
+        }
+    else:
+        shape = get_shape({k: v for k, v in command.items() if k != command_name})
+    return json.dumps(shape, separators=(",", ":"))
+
+
+def get_returned_documents(reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    return reply.get("n", 0)
+
+
+class RequestTrace:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration_ms = 0.0
+        self.queries: List[dict] = []
+
+    def get_repeated_queries(self, threshold: int) -> List[dict]:
+        counts = Counter(
+            (query["command"], query["collection"], query["shape"])
+            for query in self.queries
+        )
+        return [
+            {"command": command, "collection": collection, "shape": shape, "count": n}
+            for (command, collection, shape), n in counts.items()
+            if n >= threshold
+        ]
+
+    def to_dict(self, repeat_threshold: int) -> dict:
+        return {
+            "request": self.name,
+            "duration_ms": self.duration_ms,
+            "queries_duration_ms": sum(q["duration_ms"] for q in self.queries),
+            "queries": self.queries,
+            "repeated_queries": self.get_repeated_queries(repeat_threshold),
+        }
+
+
+_request_trace: ContextVar[Optional[RequestTrace]] = ContextVar(
+    "request_trace", default=None
+)
+
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, max_traces: int = 100, repeat_threshold: int = 3) -> None:
+        self.repeat_threshold = repeat_threshold
+        self.traces: deque = deque(maxlen=max_traces)
+        # (connection, request id) -> (trace, query) of the commands in progress
+        self.pending: Dict[Tuple[Any, int], Tuple[RequestTrace, dict]] = {}
+        self.lock = Lock()
+
+    @contextmanager
+    def trace(self, name: str):
+        trace = RequestTrace(name)
+        token = _request_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _request_trace.reset(token)
+            trace.duration_ms = (time.perf_counter() - trace.start) * 1000
+            self.add_trace(trace)
+
+    def add_trace(self, trace: RequestTrace) -> None:
+        trace_data = trace.to_dict(self.repeat_threshold)
+        self.traces.append(trace_data)
+
+        if trace_data["repeated_queries"]:
+            logger.warning(
+                f"Repeated queries in {trace.name}: {trace_data['repeated_queries']}"
+            )
+        logger.info(f"Query trace: {json.dumps(trace_data, default=str)}")
+
+    def get_traces(self) -> List[dict]:
+        return list(self.traces)
+
+    def started(self, event) -> None:
+        trace = _request_trace.get()
+        if trace is None or event.command_name in IGNORED_COMMANDS:
+            return
+
+        command = event.command
+        query = {
+            "command": event.command_name,
+            "collection": command.get(event.command_name),
+            "shape": get_command_shape(event.command_name, command),
+        }
+        with self.lock:
+            self.pending[(event.connection_id, event.request_id)] = (trace, query)
+
+    def succeeded(self, event) -> None:
+        with self.lock:
+            pending = self.pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+
+        trace, query = pending
+        query["duration_ms"] = event.duration_micros / 1000
+        query["documents"] = get_returned_documents(event.reply)
+        query["bytes"] = len(bson.encode(event.reply))
+        trace.queries.append(query)
+
+    def failed(self, event) -> None:
+        with self.lock:
+            pending = self.pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+
+        trace, query = pending
+        query["duration_ms"] = event.duration_micros / 1000
+        query["failure"] = str(event.failure)
+        trace.queries.append(query)
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware that traces the queries of each request
+    """
+
+    def __init__(self, app, profiler: QueryProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        name = f"{scope['method']} {scope['path']}"
+        if scope.get("query_string"):
+            name = f"{name}?{scope['query_string'].decode('latin-1')}"
+
+        with self.profiler.trace(name):
+            await self.app(scope, receive, send)
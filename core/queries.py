@@ -1,80 +1,343 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from bson.objectid import ObjectId
 
-from config.database import db
-from core.models import Coordinate
-
-
-def get_nearby_stations(coordinate: Coordinate, max_distance: int = 500) -> List[dict]:
-    return list(
-        db["stations"].aggregate(
-            [
-                {
-                    "$geoNear": {
-                        "near": coordinate.to_geo_json_dict(),
-                        "maxDistance": max_distance,
-                        "spherical": True,
-                        "distanceField": "distance",
-                    }
-                },
-                {"$project": {"destinations": 0}},
-            ]
+from config.constants import MAX_BATCH_LOOKUPS
+from config.database import DOCUMENTS_CACHE_SIZE, DOCUMENTS_CACHE_TTL, db
+from core.cache import LRUCache, cached
+from core.metrics import QUERY_DURATION, count_db_round_trip
+from core.models import Coordinate, Fields
+from core.network_version import get_network_collections
+from core.snapshot import get_snapshot
+
+# Fields of the documents returned with Fields.SLIM, enough to show the paths
+SLIM_STATION_FIELDS = ("_id", "station_id", "name", "location", "distance")
+SLIM_ROUTE_FIELDS = ("_id", "transmetro_id", "name", "type_of_route")
+SLIM_STOP_FIELDS = (
+    "_id",
+    "description",
+    "stop_sequence",
+    "amount_to_arrive",
+    "location",
+    "route",
+    "parent_station",
+    "distance",
+)
+# Shared by all the requests, stations and routes rarely change
+documents_cache = LRUCache(maxsize=DOCUMENTS_CACHE_SIZE, ttl=DOCUMENTS_CACHE_TTL)
+
+_shared_lookups: ContextVar[Optional[LRUCache]] = ContextVar(
+    "shared_lookups", default=None
+)
+_missing = object()
+
+
+@contextmanager
+def shared_lookups(lookups: Optional[LRUCache] = None):
+    """
+    Inside this context, lookups decorated with share_lookup are made only once
+    for the same arguments, while they are among the last MAX_BATCH_LOOKUPS.
+    Useful when many paths are built together. The lookups of a previous
+    context can be passed to keep sharing them
+    """
+    if lookups is None:
+        lookups = LRUCache(maxsize=MAX_BATCH_LOOKUPS)
+    token = _shared_lookups.set(lookups)
+    try:
+        yield
+    finally:
+        _shared_lookups.reset(token)
+
+
+def get_collection(name: str):
+    """
+    Collection of the served version of the network
+    """
+    return db[get_network_collections(db)[name]]
+
+
+def get_projection(field_names: Tuple[str, ...], prefix: str = "") -> dict:
+    return {f"{prefix}{name}": 1 for name in field_names}
+
+
+def get_station_projection(fields: Fields) -> dict:
+    if fields == Fields.SLIM:
+        return get_projection(SLIM_STATION_FIELDS)
+    return {"destinations": 0}
+
+
+def get_slim_field_names(fields: Fields, field_names: Tuple[str, ...]):
+    """
+    Names of the fields to keep in the in memory documents, None to keep all
+    """
+    return field_names if fields == Fields.SLIM else None
+
+
+def share_lookup(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        lookups = _shared_lookups.get()
+        if lookups is None:
+            return func(*args, **kwargs)
+
+        key = (func.__name__, *args, *sorted(kwargs.items()))
+        value = lookups.get(key, _missing)
+        if value is _missing:
+            value = func(*args, **kwargs)
+            lookups.set(key, value)
+        return value
+
+    return wrapper
+
+
+def instrument_query(func):
+    """
+    Record the duration of the query and count it as a round trip when it is
+    sent to the database
+    """
+    query = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        source = "snapshot" if get_snapshot() is not None else "database"
+        if source == "database":
+            count_db_round_trip()
+
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            QUERY_DURATION.observe(perf_counter() - start, query=query, source=source)
+
+    return wrapper
+
+
+@instrument_query
+def get_nearby_stations(
+    coordinate: Coordinate,
+    max_distance: int = 500,
+    fields: Fields = Fields.FULL,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_nearby_stations(
+            coordinate,
+            max_distance,
+            get_slim_field_names(fields, SLIM_STATION_FIELDS),
+            limit,
+        )
+
+    pipeline = [
+        {
+            "$geoNear": {
+                "near": coordinate.to_geo_json_dict(),
+                "maxDistance": max_distance,
+                "spherical": True,
+                "distanceField": "distance",
+            }
+        }
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": get_station_projection(fields)})
+
+    return list(get_collection("stations").aggregate(pipeline))
+
+
+@share_lookup
+@cached(documents_cache)
+@instrument_query
+def get_station_by_object_id(obj_id: ObjectId, fields: Fields = Fields.FULL):
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_station_by_object_id(
+            obj_id, get_slim_field_names(fields, SLIM_STATION_FIELDS)
         )
+
+    return get_collection("stations").find_one(
+        {"_id": obj_id}, get_station_projection(fields)
     )
 
 
-def get_station_by_object_id(obj_id: ObjectId):
-    return db["stations"].find_one({"_id": obj_id}, {"destinations": 0})
+@share_lookup
+@cached(documents_cache)
+@instrument_query
+def get_route_by_object_id(obj_id: ObjectId, fields: Fields = Fields.FULL):
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_route_by_object_id(
+            obj_id, get_slim_field_names(fields, SLIM_ROUTE_FIELDS)
+        )
 
+    projection = get_projection(SLIM_ROUTE_FIELDS) if fields == Fields.SLIM else None
+    return get_collection("routes").find_one({"_id": obj_id}, projection)
 
-def get_route_by_object_id(obj_id: ObjectId):
-    return db["routes"].find_one({"_id": obj_id})
 
+@instrument_query
+def get_nearby_stops(
+    coordinate: Coordinate,
+    max_distance: int = 500,
+    fields: Fields = Fields.FULL,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    """
+    Stops near the coordinate sorted by distance, the best stops of each route
+    are selected from them in memory, see core.commons.CandidateStops
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_nearby_stops(
+            coordinate,
+            max_distance,
+            get_slim_field_names(fields, SLIM_STOP_FIELDS),
+            limit,
+        )
 
-def get_nearby_group_stops(
-    coordinate: Coordinate, max_distance: int = 500
-) -> List[List]:
-    stops_data = db["stops"].aggregate(
-        [
-            {
-                "$geoNear": {
-                    "near": coordinate.to_geo_json_dict(),
-                    "maxDistance": max_distance,
-                    "spherical": True,
-                    "distanceField": "distance",
-                }
-            },
-            {"$group": {"_id": "$route", "stops": {"$push": "$$ROOT"}}},
-        ]
-    )
-    return list(map(lambda st: st["stops"], stops_data))
+    pipeline = [
+        {
+            "$geoNear": {
+                "near": coordinate.to_geo_json_dict(),
+                "maxDistance": max_distance,
+                "spherical": True,
+                "distanceField": "distance",
+            }
+        }
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    if fields == Fields.SLIM:
+        pipeline.append({"$project": get_projection(SLIM_STOP_FIELDS)})
 
+    return list(get_collection("stops").aggregate(pipeline))
 
+
+@share_lookup
+@instrument_query
 def get_possible_routes_between_station(
-    start_station_id: ObjectId, final_station_id: ObjectId
+    start_station_id: ObjectId,
+    final_station_id: ObjectId,
+    fields: Fields = Fields.FULL,
 ):
-    return list(
-        db["stations"].aggregate(
-            [
-                {"$match": {"_id": start_station_id}},
-                {"$project": {"destinations": 1, "_id": 0}},
-                {"$unwind": {"path": "$destinations"}},
-                {"$match": {"destinations.station": final_station_id}},
-                {
-                    "$lookup": {
-                        "from": "routes",
-                        "localField": "destinations.route",
-                        "foreignField": "_id",
-                        "as": "route",
-                    }
-                },
-                {
-                    "$project": {
-                        "destination_data": "$destinations",
-                        "route": {"$arrayElemAt": ["$route", 0]},
-                    }
-                },
-            ]
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_possible_routes_between_station(
+            start_station_id,
+            final_station_id,
+            get_slim_field_names(fields, SLIM_ROUTE_FIELDS),
         )
-    )
+
+    pipeline = [
+        {"$match": {"_id": start_station_id}},
+        {"$project": {"destinations": 1, "_id": 0}},
+        {"$unwind": {"path": "$destinations"}},
+        {"$match": {"destinations.station": final_station_id}},
+        {
+            "$lookup": {
+                "from": get_network_collections(db)["routes"],
+                "localField": "destinations.route",
+                "foreignField": "_id",
+                "as": "route",
+            }
+        },
+        {
+            "$project": {
+                "destination_data": "$destinations",
+                "route": {"$arrayElemAt": ["$route", 0]},
+            }
+        },
+    ]
+    if fields == Fields.SLIM:
+        pipeline.append(
+            {
+                "$project": {
+                    "destination_data": 1,
+                    **get_projection(SLIM_ROUTE_FIELDS, prefix="route."),
+                }
+            }
+        )
+
+    return list(get_collection("stations").aggregate(pipeline))
+
+
+@instrument_query
+def get_possible_routes_between_stations(
+    start_station_ids: Iterable[ObjectId],
+    final_station_ids: Iterable[ObjectId],
+    fields: Fields = Fields.FULL,
+) -> Dict[Tuple[ObjectId, ObjectId], List[dict]]:
+    """
+    Possible routes of every pair of start and final stations by the pair, in a
+    single query. The pairs without routes are not included
+    """
+    start_station_ids = list(start_station_ids)
+    final_station_ids = list(final_station_ids)
+
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_possible_routes_between_stations(
+            start_station_ids,
+            final_station_ids,
+            get_slim_field_names(fields, SLIM_ROUTE_FIELDS),
+        )
+
+    pipeline = [
+        {"$match": {"_id": {"$in": start_station_ids}}},
+        {"$project": {"destinations": 1}},
+        {"$unwind": {"path": "$destinations"}},
+        {"$match": {"destinations.station": {"$in": final_station_ids}}},
+        {
+            "$lookup": {
+                "from": get_network_collections(db)["routes"],
+                "localField": "destinations.route",
+                "foreignField": "_id",
+                "as": "route",
+            }
+        },
+        {
+            "$project": {
+                "destination_data": "$destinations",
+                "route": {"$arrayElemAt": ["$route", 0]},
+            }
+        },
+    ]
+    if fields == Fields.SLIM:
+        pipeline.append(
+            {
+                "$project": {
+                    "destination_data": 1,
+                    **get_projection(SLIM_ROUTE_FIELDS, prefix="route."),
+                }
+            }
+        )
+
+    station_routes: Dict[Tuple[ObjectId, ObjectId], List[dict]] = {}
+    for possible_route in get_collection("stations").aggregate(pipeline):
+        start_station_id = possible_route.pop("_id")
+        key = (start_station_id, possible_route["destination_data"]["station"])
+        station_routes.setdefault(key, []).append(possible_route)
+    return station_routes
+
+
+def warm_up(connections: int = 1) -> None:
+    """
+    Open connections of the pool and run the geo queries once, so their indexes
+    are loaded before the first request
+    """
+    if get_snapshot() is not None:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(connections, 1)) as executor:
+        list(executor.map(lambda _: db.command("ping"), range(connections)))
+
+    station = get_collection("stations").find_one({}, {"location": 1})
+    if station is not None:
+        lon, lat = station["location"]["coordinates"]
+        coordinate = Coordinate(lon=lon, lat=lat)
+        get_nearby_stations(coordinate)
+        get_nearby_stops(coordinate)
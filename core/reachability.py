@@ -0,0 +1,192 @@
+"""
+Stations reachable from a point riding at most one or two routes.
+
+The index is compiled once from the network: for every station, the stations
+reachable with no transfer (one troncal route, the stations' destinations) and
+with one transfer (two troncal routes), with the minimum amount of stops to
+arrive. Each set of stations is also kept as a bitset, an int with the bit of
+every reachable station, so the stations reachable from all the stations and
+stops near a point are the union of a few bitsets.
+
+A point reaches the stations near it walking, and the parent station of each
+stop near it riding its alimentador route, which is the first route of the trip
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from bson.objectid import ObjectId
+
+from config.database import db
+from core.snapshot import NetworkSnapshot, get_snapshot
+
+logger = logging.getLogger(__name__)
+
+MAX_TRANSFERS = 1
+
+# station -> (stops to arrive, routes already ridden)
+Origins = Dict[int, Tuple[int, int]]
+
+
+def get_station_indexes(bitset: int) -> List[int]:
+    indexes = []
+    while bitset:
+        lowest_bit = bitset & -bitset
+        indexes.append(lowest_bit.bit_length() - 1)
+        bitset ^= lowest_bit
+    return indexes
+
+
+class ReachabilityIndex:
+    def __init__(self, snapshot: NetworkSnapshot) -> None:
+        self.snapshot = snapshot
+
+        self.stations: List[dict] = list(snapshot.stations.values())
+        self.station_index: Dict[ObjectId, int] = {
+            station["_id"]: i for i, station in enumerate(self.stations)
+        }
+
+        # reach[transfers][station] -> {station: minimum stops to arrive}
+        direct: List[Dict[int, int]] = [{} for _ in self.stations]
+        for station_id, destinations in snapshot.destinations.items():
+            for destination in destinations:
+                if destination["route"] not in snapshot.routes:
+                    continue
+                start = self.station_index[station_id]
+                final = self.station_index.get(destination["station"])
+                if final is None or final == start:
+                    continue
+                amount = int(destination["amount_to_arrive"])
+                if amount < direct[start].get(final, amount + 1):
+                    direct[start][final] = amount
+
+        one_transfer: List[Dict[int, int]] = []
+        for start, transfer_stations in enumerate(direct):
+            reachable = dict(transfer_stations)
+            for transfer, amount in transfer_stations.items():
+                for final, final_amount in direct[transfer].items():
+                    if final == start:
+                        continue
+                    if amount + final_amount < reachable.get(final, float("inf")):
+                        reachable[final] = amount + final_amount
+            one_transfer.append(reachable)
+
+        self.reach: List[List[Dict[int, int]]] = [direct, one_transfer]
+        self.bitsets: List[List[int]] = [
+            [sum(1 << final for final in reachable) for reachable in level]
+            for level in self.reach
+        ]
+
+        logger.info(f"Reachability index compiled: {len(self.stations)} stations")
+
+    def get_origins(
+        self, nearby_stations: List[dict], nearby_stops: List[dict]
+    ) -> Origins:
+        origins: Origins = {}
+
+        def add_origin(station_id: ObjectId, amount: int, routes: int) -> None:
+            station = self.station_index.get(station_id)
+            if station is not None and (amount, routes) < origins.get(
+                station, (float("inf"), 0)
+            ):
+                origins[station] = (amount, routes)
+
+        for station in nearby_stations:
+            add_origin(station["_id"], 0, 0)
+        for stop in nearby_stops:
+            add_origin(stop["parent_station"], int(stop["amount_to_arrive"]), 1)
+
+        return origins
+
+    def get_reachable_bitset(self, origins: Origins, max_transfers: int) -> int:
+        bitset = 0
+        for station, (_, routes) in origins.items():
+            bitset |= 1 << station
+            # riding the alimentador route is the first route of the trip
+            transfers = max_transfers - routes
+            if transfers >= 0:
+                bitset |= self.bitsets[transfers][station]
+        return bitset
+
+    def get_amount_to_arrive(
+        self, origins: Origins, final: int, transfers: int
+    ) -> Optional[int]:
+        """
+        Minimum stops to arrive to the final station with at most the given
+        transfers
+        """
+        best = None
+        for station, (amount, routes) in origins.items():
+            if station == final:
+                # stops of the alimentador route, or 0 walking to the station
+                stops = amount
+            elif transfers - routes >= 0:
+                stops = self.reach[transfers - routes][station].get(final)
+                if stops is None:
+                    continue
+                stops += amount
+            else:
+                continue
+            if best is None or stops < best:
+                best = stops
+        return best
+
+    def get_reachable_stations(
+        self,
+        nearby_stations: List[dict],
+        nearby_stops: List[dict],
+        max_transfers: int = MAX_TRANSFERS,
+        max_stops: Optional[int] = None,
+    ) -> List[Tuple[dict, int, int]]:
+        """
+        (station, transfers, amount to arrive) of the stations reachable from
+        the nearby stations and stops, with the fewest transfers and then the
+        fewest stops, and in at most max_stops stops if it is given
+        """
+        origins = self.get_origins(nearby_stations, nearby_stops)
+        bitset = self.get_reachable_bitset(origins, max_transfers)
+
+        reachable = []
+        for final in get_station_indexes(bitset):
+            for transfers in range(max_transfers + 1):
+                amount = self.get_amount_to_arrive(origins, final, transfers)
+                if amount is not None and (max_stops is None or amount <= max_stops):
+                    reachable.append((self.stations[final], transfers, amount))
+                    break
+
+        return sorted(reachable, key=lambda r: (r[1], r[2], r[0]["station_id"]))
+
+
+_index: Optional[ReachabilityIndex] = None
+# only one thread builds the index, the others wait for it
+_index_lock = threading.Lock()
+
+
+def get_reachability_index() -> ReachabilityIndex:
+    """
+    Index of the loaded network snapshot, if the network is not in memory it is
+    loaded from the database only to compile the index
+    """
+    global _index
+
+    snapshot = get_snapshot()
+    index = _index
+    if index is None or (snapshot is not None and index.snapshot is not snapshot):
+        with _index_lock:
+            # another thread may have built it while this one waited
+            index = _index
+            if index is None or (
+                snapshot is not None and index.snapshot is not snapshot
+            ):
+                if snapshot is None:
+                    snapshot = NetworkSnapshot.from_database(db)
+                index = _index = ReachabilityIndex(snapshot)
+
+    return index
+
+
+def invalidate_reachability_index() -> None:
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,100 @@
+"""
+Cache of built paths keyed by the cells of the start and final points.
+
+Points a few meters apart get the same stations, stops and paths, so the paths
+built for a pair of cells are reused for every request inside those cells. The
+walks at the beginning and at the end are always recomputed with the exact
+start and final points of the request
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+from core.cache import LRUCache
+from core.models import Coordinate, Fields, ToType
+from core.steps import Step, Walk
+from core.utils import encode_geohash, get_spherical_distance
+
+logger = logging.getLogger(__name__)
+
+
+def relocate_data(step: Step, coordinate: Coordinate) -> Tuple[dict, float]:
+    """
+    Copy of the data of a step that is walked from or to the coordinate and the
+    distance to that coordinate. The distance is only updated in the data that
+    has one, the stations looked up by id (e.g. the parent station of the
+    start stop) don't have it
+    """
+    distance = get_spherical_distance(
+        [coordinate.lon, coordinate.lat], step.data["location"]["coordinates"]
+    )
+    if "distance" not in step.data:
+        return step.data, distance
+    return {**step.data, "distance": distance}, distance
+
+
+def relocate_path(path: List[Step], start: Coordinate, final: Coordinate) -> List[Step]:
+    path = list(path)
+
+    first_step = path[0]
+    if isinstance(first_step.through, Walk):
+        data, distance = relocate_data(first_step, start)
+        path[0] = Step(first_step.place_type, data, Walk(distance=distance))
+
+    if len(path) > 1 and path[-1].place_type == ToType.PLACE:
+        last_stop = path[-2]
+        data, distance = relocate_data(last_stop, final)
+        path[-2] = Step(last_stop.place_type, data, last_stop.through)
+        path[-1] = Step.place(
+            data=final.to_geo_json_dict(), through=Walk(distance=distance)
+        )
+
+    return path
+
+
+class PathsCache:
+    def __init__(self, precision: int = 7, maxsize: int = 0, max_steps: int = 0):
+        self.precision = precision
+        self.cache = LRUCache(
+            maxsize=maxsize,
+            max_weight=max_steps,
+            # steps of the paths as an estimation of the used memory, without
+            # serializing them
+            weigh=lambda paths: sum(len(path) for path in paths),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.maxsize > 0
+
+    def get_key(
+        self, start: Coordinate, final: Coordinate, fields: Fields
+    ) -> Tuple[str, str, Fields]:
+        return (
+            encode_geohash(start.lon, start.lat, self.precision),
+            encode_geohash(final.lon, final.lat, self.precision),
+            fields,
+        )
+
+    def get(
+        self, start: Coordinate, final: Coordinate, fields: Fields = Fields.FULL
+    ) -> Optional[List[List[Step]]]:
+        if not self.enabled:
+            return None
+
+        paths = self.cache.get(self.get_key(start, final, fields))
+        if paths is None:
+            return None
+
+        logger.info("Paths retrieved from cache")
+        return [relocate_path(path, start, final) for path in paths]
+
+    def set(
+        self,
+        start: Coordinate,
+        final: Coordinate,
+        paths: List[List[Step]],
+        fields: Fields = Fields.FULL,
+    ) -> None:
+        if self.enabled:
+            self.cache.set(self.get_key(start, final, fields), paths)
@@ -0,0 +1,251 @@
+import logging
+import os
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+import bson
+from bson.objectid import ObjectId
+
+from core.models import Coordinate
+from core.network_version import get_network_collections
+from core.spatial import KDTreeIndex, SpatialIndex
+
+logger = logging.getLogger(__name__)
+
+FieldNames = Optional[Tuple[str, ...]]
+
+# Network file written by scripts/create_snapshot.py: a header document followed
+# by the stations, routes and stops, all of them as BSON documents. It is an
+# export of the collections, not of the built network: every process that loads
+# it decodes all the documents and builds the spatial indexes and the maps of
+# stations, routes and destinations again, as from_database does. It only saves
+# the queries to the database, so the API can run without one
+SNAPSHOT_FILE_FORMAT = "transmetro-network"
+SNAPSHOT_FILE_VERSION = 1
+SNAPSHOT_COLLECTIONS = ("stations", "routes", "stops")
+
+
+def project(doc: dict, field_names: FieldNames) -> dict:
+    """
+    Copy of the document with only the given fields, or all of them if None
+    """
+    if field_names is None:
+        return dict(doc)
+    return {k: v for k, v in doc.items() if k in field_names}
+
+
+class NetworkSnapshot:
+    """
+    In memory copy of the network (stations, routes and stops).
+
+    The network almost never changes, so it can be loaded once and used to answer
+    the same queries of core.queries without any round trip to the database
+    """
+
+    def __init__(
+        self,
+        stations: List[dict],
+        routes: List[dict],
+        stops: List[dict],
+        index_class: Type[SpatialIndex] = KDTreeIndex,
+    ) -> None:
+        self.stations: Dict[ObjectId, dict] = {}
+        self.destinations: Dict[ObjectId, List[dict]] = {}
+
+        for station in stations:
+            station_data = {k: v for k, v in station.items() if k != "destinations"}
+            self.stations[station["_id"]] = station_data
+            self.destinations[station["_id"]] = station.get("destinations", [])
+
+        self.routes: Dict[ObjectId, dict] = {route["_id"]: route for route in routes}
+        self.stops: List[dict] = stops
+
+        # (start station, final station) -> troncal routes between them
+        self.station_routes: Dict[Tuple[ObjectId, ObjectId], List[dict]] = {}
+        for station_id, destinations in self.destinations.items():
+            for destination in destinations:
+                possible_route = {"destination_data": destination}
+                route = self.routes.get(destination["route"])
+                if route is not None:
+                    possible_route["route"] = route
+
+                key = (station_id, destination["station"])
+                self.station_routes.setdefault(key, []).append(possible_route)
+
+        self.stations_index = index_class(self.stations.values())
+        self.stops_index = index_class(self.stops)
+
+    @classmethod
+    def from_database(
+        cls, db, index_class: Type[SpatialIndex] = KDTreeIndex
+    ) -> "NetworkSnapshot":
+        collections = get_network_collections(db)
+        return cls(
+            stations=list(db[collections["stations"]].find()),
+            routes=list(db[collections["routes"]].find()),
+            stops=list(db[collections["stops"]].find()),
+            index_class=index_class,
+        )
+
+    @classmethod
+    def from_file(
+        cls, path: str, index_class: Type[SpatialIndex] = KDTreeIndex
+    ) -> "NetworkSnapshot":
+        """
+        Network of a file written by write_snapshot_file. The documents are
+        decoded and the indexes are built in this process, nothing is shared
+        with other processes that load the same file
+        """
+        with open(path, "rb") as snapshot_file:
+            header, *documents = bson.decode_all(snapshot_file.read())
+
+        if (
+            header.get("format") != SNAPSHOT_FILE_FORMAT
+            or header.get("format_version") != SNAPSHOT_FILE_VERSION
+        ):
+            raise ValueError(f"{path} is not a network snapshot file")
+
+        documents = iter(documents)
+        collections = {
+            name: list(islice(documents, header["counts"][name]))
+            for name in SNAPSHOT_COLLECTIONS
+        }
+        return cls(**collections, index_class=index_class)
+
+    def get_nearby_stations(
+        self,
+        coordinate: Coordinate,
+        max_distance: int = 500,
+        field_names: FieldNames = None,
+        limit: Optional[int] = None,
+    ) -> List[dict]:
+        point = [coordinate.lon, coordinate.lat]
+        stations = self.stations_index.query(point, max_distance)[:limit]
+        if field_names is None:
+            return stations
+        return [project(station, field_names) for station in stations]
+
+    def get_station_by_object_id(
+        self, obj_id: ObjectId, field_names: FieldNames = None
+    ) -> Optional[dict]:
+        station = self.stations.get(obj_id)
+        return project(station, field_names) if station is not None else None
+
+    def get_route_by_object_id(
+        self, obj_id: ObjectId, field_names: FieldNames = None
+    ) -> Optional[dict]:
+        route = self.routes.get(obj_id)
+        return project(route, field_names) if route is not None else None
+
+    def get_nearby_stops(
+        self,
+        coordinate: Coordinate,
+        max_distance: int = 500,
+        field_names: FieldNames = None,
+        limit: Optional[int] = None,
+    ) -> List[dict]:
+        point = [coordinate.lon, coordinate.lat]
+        stops = self.stops_index.query(point, max_distance)[:limit]
+        if field_names is None:
+            return stops
+        return [project(stop, field_names) for stop in stops]
+
+    def get_possible_routes_between_station(
+        self,
+        start_station_id: ObjectId,
+        final_station_id: ObjectId,
+        route_field_names: FieldNames = None,
+    ) -> List[dict]:
+        key = (start_station_id, final_station_id)
+        possible_routes = []
+        for station_route in self.station_routes.get(key, []):
+            possible_route = {
+                "destination_data": dict(station_route["destination_data"])
+            }
+            if "route" in station_route:
+                possible_route["route"] = project(
+                    station_route["route"], route_field_names
+                )
+            possible_routes.append(possible_route)
+
+        return possible_routes
+
+    def get_possible_routes_between_stations(
+        self,
+        start_station_ids: Iterable[ObjectId],
+        final_station_ids: Iterable[ObjectId],
+        route_field_names: FieldNames = None,
+    ) -> Dict[Tuple[ObjectId, ObjectId], List[dict]]:
+        final_station_ids = list(final_station_ids)
+        station_routes = {}
+        for start_station_id in start_station_ids:
+            for final_station_id in final_station_ids:
+                key = (start_station_id, final_station_id)
+                if key in self.station_routes:
+                    station_routes[key] = self.get_possible_routes_between_station(
+                        start_station_id, final_station_id, route_field_names
+                    )
+        return station_routes
+
+
+_snapshot: Optional[NetworkSnapshot] = None
+
+
+def get_snapshot() -> Optional[NetworkSnapshot]:
+    return _snapshot
+
+
+def set_snapshot(snapshot: Optional[NetworkSnapshot]) -> None:
+    global _snapshot
+    _snapshot = snapshot
+
+
+def set_loaded_snapshot(snapshot: NetworkSnapshot) -> NetworkSnapshot:
+    logger.info(
+        f"Network snapshot loaded: {len(snapshot.stations)} stations, "
+        f"{len(snapshot.routes)} routes, {len(snapshot.stops)} stops"
+    )
+    set_snapshot(snapshot)
+    return snapshot
+
+
+def write_snapshot_file(
+    path: str, collections: Dict[str, List[dict]], version: str
+) -> dict:
+    """
+    Write the network to a file read by NetworkSnapshot.from_file, the old file
+    is replaced only when the new one is complete. Returns the header
+    """
+    header = {
+        "format": SNAPSHOT_FILE_FORMAT,
+        "format_version": SNAPSHOT_FILE_VERSION,
+        "version": version,
+        "created_at": datetime.utcnow(),
+        "counts": {name: len(collections[name]) for name in SNAPSHOT_COLLECTIONS},
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(bson.encode(header))
+        for name in SNAPSHOT_COLLECTIONS:
+            for document in collections[name]:
+                snapshot_file.write(bson.encode(document))
+    os.replace(tmp_path, path)
+
+    return header
+
+
+def load_snapshot(db, index_class: Type[SpatialIndex] = KDTreeIndex) -> NetworkSnapshot:
+    logger.info(f"Load network snapshot using {index_class.__name__}")
+    return set_loaded_snapshot(
+        NetworkSnapshot.from_database(db, index_class=index_class)
+    )
+
+
+def load_snapshot_file(
+    path: str, index_class: Type[SpatialIndex] = KDTreeIndex
+) -> NetworkSnapshot:
+    logger.info(f"Load network snapshot from {path} using {index_class.__name__}")
+    return set_loaded_snapshot(NetworkSnapshot.from_file(path, index_class=index_class))
@@ -0,0 +1,155 @@
+"""
+In process spatial indexes over documents with a GeoJSON point as location.
+
+Every index answers the same question as a spherical $geoNear with a
+maxDistance: the documents within a radius of a point, annotated with their
+distance and sorted by it. Candidates are found with the index and the exact
+distance is always computed with get_spherical_distance, so all the indexes
+return the same result
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.utils import EARTH_RADIUS_IN_METERS, get_spherical_distance
+
+
+def get_point(document: dict) -> List[float]:
+    return document["location"]["coordinates"]
+
+
+class SpatialIndex:
+    def __init__(self, documents: List[dict]) -> None:
+        self.documents = list(documents)
+
+    def get_candidates(self, point: List[float], max_distance: float) -> Iterable[int]:
+        """
+        Positions of the documents that may be within max_distance of the point
+        """
+        raise NotImplementedError
+
+    def query(self, point: List[float], max_distance: float) -> List[dict]:
+        nearby = []
+        # sorted so ties keep the same order whatever index is used
+        for i in sorted(self.get_candidates(point, max_distance)):
+            doc = self.documents[i]
+            distance = get_spherical_distance(point, get_point(doc))
+            if distance <= max_distance:
+                nearby.append({**doc, "distance": distance})
+
+        return sorted(nearby, key=lambda d: d["distance"])
+
+
+class BruteForceIndex(SpatialIndex):
+    def get_candidates(self, point: List[float], max_distance: float) -> Iterable[int]:
+        return range(len(self.documents))
+
+
+class GridIndex(SpatialIndex):
+    """
+    Uniform grid of lat/lon cells, a query only visits the cells that overlap
+    the bounding box of the search circle
+    """
+
+    def __init__(self, documents: List[dict], cell_size: float = 500) -> None:
+        super().__init__(documents)
+        self.cell_degrees = math.degrees(cell_size / EARTH_RADIUS_IN_METERS)
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+
+        for i, doc in enumerate(self.documents):
+            lon, lat = get_point(doc)
+            self.cells.setdefault(self.get_cell(lon, lat), []).append(i)
+
+    def get_cell(self, lon: float, lat: float) -> Tuple[int, int]:
+        return (
+            math.floor(lon / self.cell_degrees),
+            math.floor(lat / self.cell_degrees),
+        )
+
+    def get_candidates(self, point: List[float], max_distance: float) -> Iterable[int]:
+        lon, lat = point
+        delta_lat = math.degrees(max_distance / EARTH_RADIUS_IN_METERS)
+        max_lat = min(abs(lat) + delta_lat, 89.9)
+        delta_lon = min(delta_lat / math.cos(math.radians(max_lat)), 180)
+
+        min_x, min_y = self.get_cell(lon - delta_lon, lat - delta_lat)
+        max_x, max_y = self.get_cell(lon + delta_lon, lat + delta_lat)
+
+        candidates = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                candidates.extend(self.cells.get((x, y), []))
+        return candidates
+
+
+def to_cartesian(point: List[float]) -> Tuple[float, float, float]:
+    lon, lat = map(math.radians, point)
+    return (
+        EARTH_RADIUS_IN_METERS * math.cos(lat) * math.cos(lon),
+        EARTH_RADIUS_IN_METERS * math.cos(lat) * math.sin(lon),
+        EARTH_RADIUS_IN_METERS * math.sin(lat),
+    )
+
+
+class KDTreeIndex(SpatialIndex):
+    """
+    KD-tree over the points projected to 3D cartesian coordinates. The straight
+    line distance between two points of the sphere grows with the distance over
+    the surface, so a radius search in 3D gives exactly the wanted candidates
+    """
+
+    def __init__(self, documents: List[dict]) -> None:
+        super().__init__(documents)
+        self.points = [to_cartesian(get_point(doc)) for doc in self.documents]
+        self.root = self.build(list(range(len(self.points))), depth=0)
+
+    def build(self, positions: List[int], depth: int) -> Optional[tuple]:
+        if not positions:
+            return None
+
+        axis = depth % 3
+        positions.sort(key=lambda i: self.points[i][axis])
+        median = len(positions) // 2
+
+        return (
+            positions[median],
+            axis,
+            self.build(positions[:median], depth + 1),
+            self.build(positions[median + 1 :], depth + 1),
+        )
+
+    def get_candidates(self, point: List[float], max_distance: float) -> Iterable[int]:
+        target = to_cartesian(point)
+        # chord of the arc of length max_distance, a bit wider to avoid
+        # discarding points on the border because of rounding errors
+        angle = min(max_distance / EARTH_RADIUS_IN_METERS, math.pi)
+        chord = 2 * EARTH_RADIUS_IN_METERS * math.sin(angle / 2) * (1 + 1e-9) + 1e-6
+        squared_chord = chord**2
+
+        candidates = []
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            if node is None:
+                continue
+
+            position, axis, left, right = node
+            p = self.points[position]
+            squared_distance = sum((a - b) ** 2 for a, b in zip(p, target))
+            if squared_distance <= squared_chord:
+                candidates.append(position)
+
+            diff = target[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            pending.append(near)
+            if diff**2 <= squared_chord:
+                pending.append(far)
+
+        return candidates
+
+
+SPATIAL_INDEXES = {
+    "brute": BruteForceIndex,
+    "grid": GridIndex,
+    "kdtree": KDTreeIndex,
+}
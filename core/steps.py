@@ -0,0 +1,145 @@
+"""
+Lightweight steps used while the paths are built.
+
+Building pydantic models for every step validates and copies the documents of
+the stations, stops and routes, so the builders use these slotted objects,
+which only keep a reference to the documents, and the steps are converted to
+the response models once at the end
+"""
+
+from typing import List, Optional, Union
+
+from core.models import (
+    Coordinate,
+    Method,
+    SinglePathResponse,
+    ThroughRoute,
+    ThroughWalk,
+    ToPlace,
+    ToSomewhere,
+    ToStation,
+    ToStop,
+    ToType,
+)
+
+STEP_MODELS = {
+    ToType.STATION: ToStation,
+    ToType.STOP: ToStop,
+    ToType.PLACE: ToPlace,
+}
+
+
+class Walk:
+    __slots__ = ("distance",)
+
+    method = Method.WALK
+
+    def __init__(self, distance: float) -> None:
+        self.distance = float(distance)
+
+    def to_model(self) -> ThroughWalk:
+        return ThroughWalk.construct(method=self.method, distance=self.distance)
+
+    def to_dict(self) -> dict:
+        return {"method": self.method, "distance": self.distance}
+
+
+class Ride:
+    __slots__ = ("method", "route_data", "amount_to_arrive")
+
+    def __init__(self, method: Method, route_data: dict, amount_to_arrive) -> None:
+        self.method = method
+        self.route_data = route_data
+        self.amount_to_arrive = int(amount_to_arrive)
+
+    def to_model(self) -> ThroughRoute:
+        return ThroughRoute.construct(
+            method=self.method,
+            route_data=self.route_data,
+            amount_to_arrive=self.amount_to_arrive,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "route_data": self.route_data,
+            "amount_to_arrive": self.amount_to_arrive,
+        }
+
+
+class Step:
+    __slots__ = ("place_type", "data", "through")
+
+    def __init__(
+        self, place_type: ToType, data: dict, through: Optional[Union[Walk, Ride]]
+    ) -> None:
+        self.place_type = place_type
+        self.data = data
+        self.through = through
+
+    @classmethod
+    def station(cls, data: dict, through: Union[Walk, Ride]) -> "Step":
+        return cls(ToType.STATION, data, through)
+
+    @classmethod
+    def stop(cls, data: dict, through: Union[Walk, Ride]) -> "Step":
+        return cls(ToType.STOP, data, through)
+
+    @classmethod
+    def place(cls, data: dict, through: Union[Walk, Ride]) -> "Step":
+        return cls(ToType.PLACE, data, through)
+
+    def to_model(self) -> ToSomewhere:
+        return STEP_MODELS[self.place_type].construct(
+            through=self.through.to_model() if self.through else None,
+            data=self.data,
+            place_type=self.place_type,
+        )
+
+    def to_dict(self) -> dict:
+        """
+        Same content and order of keys as the dict of the response model
+        """
+        return {
+            "through": self.through.to_dict() if self.through else None,
+            "data": self.data,
+            "place_type": self.place_type,
+        }
+
+
+def get_paths_response(
+    start: Coordinate,
+    final: Coordinate,
+    paths: List[List[Step]],
+    search_radius: Optional[dict] = None,
+) -> SinglePathResponse:
+    response = SinglePathResponse.construct(
+        start=start,
+        final=final,
+        paths=[[step.to_model() for step in path] for path in paths],
+    )
+    # only the adaptive search reports the radius it used, otherwise it is unset
+    if search_radius is not None:
+        response.search_radius = search_radius
+    return response
+
+
+def get_paths_content(
+    start: Coordinate,
+    final: Coordinate,
+    paths: List[List[Step]],
+    search_radius: Optional[dict] = None,
+) -> dict:
+    """
+    Content of a SinglePathResponse without building the model, to be encoded by
+    core.encoders
+    """
+    content = {
+        "start": {"lat": start.lat, "lon": start.lon},
+        "final": {"lat": final.lat, "lon": final.lon},
+        "paths": [[step.to_dict() for step in path] for path in paths],
+    }
+    # only the adaptive search reports the radius it used
+    if search_radius is not None:
+        content["search_radius"] = search_radius
+    return content
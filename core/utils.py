@@ -1,5 +1,62 @@
+import math
 from typing import List
 
 
 def flatten(t: List[List]):
     return [item for sublist in t for item in sublist]
+
+
+# Same radius used by MongoDB for spherical queries
+EARTH_RADIUS_IN_METERS = 6378.1 * 1000
+
+
+def get_spherical_distance(a: List[float], b: List[float]) -> float:
+    """
+    Distance in meters between two [lon, lat] points, equivalent to the
+    distance field computed by a spherical $geoNear
+    """
+    lon1, lat1 = map(math.radians, a)
+    lon2, lat2 = map(math.radians, b)
+
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_IN_METERS * math.asin(min(1.0, math.sqrt(h)))
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(lon: float, lat: float, precision: int = 7) -> str:
+    """
+    Geohash of a point, points with the same geohash are in the same cell. With
+    a precision of 7 a cell is around 150 x 150 meters
+    """
+    lon_range = [-180.0, 180.0]
+    lat_range = [-90.0, 90.0]
+
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even_bit = True
+
+    while len(geohash) < precision:
+        value, value_range = (lon, lon_range) if even_bit else (lat, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+
+        even_bit = not even_bit
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
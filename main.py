@@ -1,12 +1,182 @@
-from typing import Tuple
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional, Tuple
 
-from fastapi import Depends, FastAPI
+from bson import ObjectId
+from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 
-from core.commons import get_station_and_stops
-from core.models import Coordinate, SinglePathResponse
-from core.paths import SingleAlternativePathBuilder
+from config.constants import MAX_ALTERNATIVES, MAX_BATCH_LOOKUPS
+from config.database import (
+    BATCH_STREAM_MAX_PAIRS,
+    IN_MEMORY_NETWORK,
+    MONGO_URL,
+    MONGO_WARMUP_CONNECTIONS,
+    NETWORK_SNAPSHOT_FILE,
+    NETWORK_VERSION_CHECK_INTERVAL,
+    PATHS_CACHE_MAX_STEPS,
+    PATHS_CACHE_PRECISION,
+    PATHS_CACHE_SIZE,
+    QUERY_PROFILER,
+    QUERY_PROFILER_REPEAT_THRESHOLD,
+    QUERY_PROFILER_TRACES,
+    SPATIAL_INDEX,
+    add_event_listener,
+    close_client,
+    db,
+)
+from core import async_queries
+from core.async_queries import run_blocking
+from core.cache import LRUCache
+from core.commons import (
+    BatchStationAndStops,
+    get_batch_station_and_stops,
+    get_station_and_stops_async,
+)
+from core.encoders import FastJSONResponse, NDJSONResponse
+from core.graph import GraphPathBuilder, invalidate_transit_graph
+from core.metrics import (
+    CONTENT_TYPE,
+    PATHS_RETURNED,
+    CacheCollector,
+    MetricsMiddleware,
+    registry,
+)
+from core.models import (
+    BatchPathRequest,
+    BatchPathStreamRequest,
+    Coordinate,
+    Fields,
+    SinglePathResponse,
+)
+from core.network_version import NetworkVersionMiddleware, NetworkVersionWatcher
+from core.paths import MultiAlternativePathBuilder, SingleAlternativePathBuilder
+from core.profiler import ProfilerMiddleware, QueryProfiler
+from core.queries import (
+    SLIM_STATION_FIELDS,
+    documents_cache,
+    get_route_by_object_id,
+    get_slim_field_names,
+    get_station_by_object_id,
+    shared_lookups,
+    warm_up,
+)
+from core.reachability import (
+    MAX_TRANSFERS,
+    get_reachability_index,
+    invalidate_reachability_index,
+)
+from core.response_cache import PathsCache
+from core.snapshot import load_snapshot, load_snapshot_file, project
+from core.spatial import SPATIAL_INDEXES
+from core.steps import Step, get_paths_content
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+app.state.ready = False
+app.add_middleware(NetworkVersionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+query_profiler = QueryProfiler(
+    max_traces=QUERY_PROFILER_TRACES,
+    repeat_threshold=QUERY_PROFILER_REPEAT_THRESHOLD,
+)
+if QUERY_PROFILER:
+    add_event_listener(query_profiler)
+    app.add_middleware(ProfilerMiddleware, profiler=query_profiler)
+
+DOCUMENTS_CACHE_CONTROL = "public, max-age=86400"
+
+paths_cache = PathsCache(
+    precision=PATHS_CACHE_PRECISION,
+    maxsize=PATHS_CACHE_SIZE,
+    max_steps=PATHS_CACHE_MAX_STEPS,
+)
+
+registry.register(
+    CacheCollector(
+        "transmetro_cache",
+        lambda: {"documents": documents_cache, "paths": paths_cache.cache},
+    )
+)
+
+
+def load_network():
+    index_class = SPATIAL_INDEXES[SPATIAL_INDEX]
+    if NETWORK_SNAPSHOT_FILE:
+        load_snapshot_file(NETWORK_SNAPSHOT_FILE, index_class=index_class)
+    elif IN_MEMORY_NETWORK:
+        load_snapshot(db, index_class=index_class)
+
+
+def reload_network():
+    # The new snapshot replaces the old one when it is ready, requests in
+    # progress keep using the old one
+    load_network()
+    invalidate_transit_graph()
+    invalidate_reachability_index()
+    documents_cache.invalidate()
+    paths_cache.cache.invalidate()
+
+
+network_watcher = NetworkVersionWatcher(db, on_change=reload_network)
+
+
+async def watch_network_version():
+    while True:
+        await asyncio.sleep(NETWORK_VERSION_CHECK_INTERVAL)
+        try:
+            await run_in_threadpool(network_watcher.check)
+        except Exception:
+            logger.exception("Could not check the network version")
+
+
+@app.on_event("startup")
+async def start_network():
+    # The network file is not updated by the scripts that change the version
+    if MONGO_URL and NETWORK_VERSION_CHECK_INTERVAL > 0 and not NETWORK_SNAPSHOT_FILE:
+        # The version is taken before loading so a change during the load is
+        # not missed. If the database is not available, the first check takes it
+        try:
+            await run_blocking(network_watcher.sync)
+        except Exception:
+            logger.exception("Could not read the network version")
+        app.state.network_watch_task = asyncio.create_task(watch_network_version())
+
+    await run_blocking(load_network)
+
+
+def warm_up_database() -> bool:
+    try:
+        if MONGO_URL:
+            warm_up(MONGO_WARMUP_CONNECTIONS)
+    except Exception:
+        logger.exception("Could not warm up the database")
+        return False
+
+    app.state.ready = True
+    return True
+
+
+# After start_network, the queries are not sent to the database if the network
+# is in memory
+@app.on_event("startup")
+def start_database():
+    warm_up_database()
+
+
+@app.on_event("shutdown")
+async def stop_network():
+    task = getattr(app.state, "network_watch_task", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("shutdown")
+def stop_database():
+    close_client()
 
 
 def points_query(start: str, final: str):
@@ -17,13 +187,299 @@ def points_query(start: str, final: str):
     return start, final
 
 
-@app.get("/paths/single", response_model=SinglePathResponse)
-def single_paths(points: Tuple[Coordinate, Coordinate] = Depends(points_query)):
+def point_query(point: str):
+    lon, lat = tuple(map(float, point.split(",")))
+    return Coordinate(lat=lat, lon=lon)
+
+
+@app.get(
+    "/paths/single",
+    response_model=SinglePathResponse,
+    response_class=FastJSONResponse,
+)
+async def single_paths(
+    points: Tuple[Coordinate, Coordinate] = Depends(points_query),
+    fields: Fields = Fields.FULL,
+    adaptive: bool = False,
+):
+    start, final = points
+
+    # the cached paths don't keep the radius of the adaptive search
+    paths = None if adaptive else paths_cache.get(start, final, fields)
+    search_radius = None
+    if paths is None:
+        stations_stops = await get_station_and_stops_async(
+            start, final, fields, adaptive
+        )
+        path_builder = SingleAlternativePathBuilder(
+            start, final, stations_stops, fields
+        )
+        paths = await path_builder.get_all_possible_paths_async()
+        search_radius = stations_stops.get("search_radius")
+        if not adaptive:
+            paths_cache.set(start, final, paths, fields)
+
+    PATHS_RETURNED.observe(len(paths), endpoint="single")
+
+    # returning the response skips the validation of the response model
+    return FastJSONResponse(get_paths_content(start, final, paths, search_radius))
+
+
+@app.get(
+    "/paths/best",
+    response_model=SinglePathResponse,
+    response_class=FastJSONResponse,
+)
+async def best_paths(
+    points: Tuple[Coordinate, Coordinate] = Depends(points_query),
+    fields: Fields = Fields.FULL,
+    adaptive: bool = False,
+):
+    start, final = points
+
+    stations_stops = await get_station_and_stops_async(start, final, fields, adaptive)
+    path_builder = await run_blocking(
+        GraphPathBuilder, start, final, stations_stops, fields
+    )
+    paths = await path_builder.get_all_possible_paths_async()
+    PATHS_RETURNED.observe(len(paths), endpoint="best")
+
+    return FastJSONResponse(
+        get_paths_content(start, final, paths, stations_stops.get("search_radius"))
+    )
+
+
+@app.get(
+    "/paths/alternatives",
+    response_model=SinglePathResponse,
+    response_class=FastJSONResponse,
+)
+async def alternative_paths(
+    points: Tuple[Coordinate, Coordinate] = Depends(points_query),
+    fields: Fields = Fields.FULL,
+    max_paths: int = Query(MAX_ALTERNATIVES, ge=1, le=20),
+    adaptive: bool = False,
+):
+    start, final = points
+
+    stations_stops = await get_station_and_stops_async(start, final, fields, adaptive)
+    path_builder = MultiAlternativePathBuilder(
+        start, final, stations_stops, fields, max_paths
+    )
+    paths = await path_builder.get_all_possible_paths_async()
+    PATHS_RETURNED.observe(len(paths), endpoint="alternatives")
+
+    return FastJSONResponse(
+        get_paths_content(start, final, paths, stations_stops.get("search_radius"))
+    )
+
+
+async def stream_paths(
+    paths: AsyncIterator[List[Step]], endpoint: str
+) -> AsyncIterator[list]:
+    number_of_paths = 0
+    async for path in paths:
+        number_of_paths += 1
+        yield [step.to_dict() for step in path]
+
+    PATHS_RETURNED.observe(number_of_paths, endpoint=endpoint)
+
+
+@app.get("/paths/alternatives/stream", response_class=NDJSONResponse)
+async def alternative_paths_stream(
+    points: Tuple[Coordinate, Coordinate] = Depends(points_query),
+    fields: Fields = Fields.FULL,
+    max_paths: int = Query(MAX_ALTERNATIVES, ge=1, le=20),
+    adaptive: bool = False,
+):
+    """
+    Same paths as /paths/alternatives as newline delimited JSON, each line is
+    the list of steps of a path and is sent as soon as the path is built
+    """
     start, final = points
 
-    stations_stops = get_station_and_stops(start, final)
-    path_builder = SingleAlternativePathBuilder(start, final, stations_stops)
-    paths = path_builder.get_all_possible_paths()
-    single_path_response = SinglePathResponse(start=start, final=final, paths=paths)
+    stations_stops = await get_station_and_stops_async(start, final, fields, adaptive)
+    path_builder = MultiAlternativePathBuilder(
+        start, final, stations_stops, fields, max_paths
+    )
+
+    return NDJSONResponse(
+        stream_paths(path_builder.iter_paths_async(), endpoint="alternatives")
+    )
+
+
+@app.post(
+    "/paths/batch",
+    response_model=List[SinglePathResponse],
+    response_class=FastJSONResponse,
+)
+def batch_paths(batch: BatchPathRequest, fields: Fields = Fields.FULL):
+    points = [(pair.start, pair.final) for pair in batch.pairs]
+
+    all_paths = [paths_cache.get(start, final, fields) for start, final in points]
+    missing = [i for i, paths in enumerate(all_paths) if paths is None]
+
+    # stations and routes shared by many pairs are only retrieved once
+    with shared_lookups():
+        all_stations_stops = get_batch_station_and_stops(
+            [points[i] for i in missing], fields
+        )
+        for i, stations_stops in zip(missing, all_stations_stops):
+            start, final = points[i]
+            path_builder = SingleAlternativePathBuilder(
+                start, final, stations_stops, fields
+            )
+            all_paths[i] = path_builder.get_all_possible_paths()
+            paths_cache.set(start, final, all_paths[i], fields)
+
+    for paths in all_paths:
+        PATHS_RETURNED.observe(len(paths), endpoint="batch")
+
+    return FastJSONResponse(
+        [
+            get_paths_content(start, final, paths)
+            for (start, final), paths in zip(points, all_paths)
+        ]
+    )
+
+
+def get_pair_paths(
+    start: Coordinate,
+    final: Coordinate,
+    fields: Fields,
+    batch_station_and_stops: BatchStationAndStops,
+    lookups: LRUCache,
+) -> List[List[Step]]:
+    paths = paths_cache.get(start, final, fields)
+    if paths is None:
+        with shared_lookups(lookups):
+            path_builder = SingleAlternativePathBuilder(
+                start, final, batch_station_and_stops.get(start, final), fields
+            )
+            paths = path_builder.get_all_possible_paths()
+        paths_cache.set(start, final, paths, fields)
+    return paths
+
+
+async def stream_batch_paths(
+    points: List[Tuple[Coordinate, Coordinate]], fields: Fields
+) -> AsyncIterator[dict]:
+    # stations, stops and routes shared by many pairs are only retrieved once
+    batch_station_and_stops = BatchStationAndStops(fields)
+    lookups = LRUCache(maxsize=MAX_BATCH_LOOKUPS)
+
+    for start, final in points:
+        paths = await run_blocking(
+            get_pair_paths, start, final, fields, batch_station_and_stops, lookups
+        )
+        PATHS_RETURNED.observe(len(paths), endpoint="batch")
+        yield get_paths_content(start, final, paths)
+
+
+@app.post("/paths/batch/stream", response_class=NDJSONResponse)
+async def batch_paths_stream(
+    batch: BatchPathStreamRequest, fields: Fields = Fields.FULL
+):
+    """
+    Same responses as /paths/batch as newline delimited JSON, each line is the
+    response of a pair of points and is sent as soon as its paths are built.
+    It accepts up to BATCH_STREAM_MAX_PAIRS pairs
+    """
+    if len(batch.pairs) > BATCH_STREAM_MAX_PAIRS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {BATCH_STREAM_MAX_PAIRS} pairs can be requested",
+        )
+
+    points = [(pair.start, pair.final) for pair in batch.pairs]
+    return NDJSONResponse(stream_batch_paths(points, fields))
+
+
+@app.get("/reachability", response_class=FastJSONResponse)
+async def reachability(
+    point: Coordinate = Depends(point_query),
+    max_transfers: int = Query(MAX_TRANSFERS, ge=0, le=MAX_TRANSFERS),
+    max_stops: Optional[int] = Query(None, ge=0),
+    fields: Fields = Fields.FULL,
+):
+    """
+    Stations reachable from the point with at most max_transfers transfers and
+    max_stops stops, with the fewest transfers and stops to arrive to each one
+    """
+    nearby_stations, nearby_stops = await asyncio.gather(
+        async_queries.get_nearby_stations(point, fields=Fields.SLIM),
+        async_queries.get_nearby_stops(point, fields=Fields.SLIM),
+    )
+    index = await run_blocking(get_reachability_index)
+    reachable = index.get_reachable_stations(
+        nearby_stations, nearby_stops, max_transfers, max_stops
+    )
+
+    field_names = get_slim_field_names(fields, SLIM_STATION_FIELDS)
+    return FastJSONResponse(
+        {
+            "point": {"lat": point.lat, "lon": point.lon},
+            "stations": [
+                {
+                    "station": project(station, field_names),
+                    "transfers": transfers,
+                    "amount_to_arrive": amount_to_arrive,
+                }
+                for station, transfers, amount_to_arrive in reachable
+            ],
+        }
+    )
+
+
+def get_object_id(obj_id: str) -> ObjectId:
+    if not ObjectId.is_valid(obj_id):
+        raise HTTPException(status_code=404, detail="Not found")
+    return ObjectId(obj_id)
+
+
+def get_document_response(document: Optional[dict]) -> FastJSONResponse:
+    if document is None:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # The network rarely changes, clients can keep the full documents
+    return FastJSONResponse(
+        document, headers={"Cache-Control": DOCUMENTS_CACHE_CONTROL}
+    )
+
+
+@app.get("/stations/{station_id}", response_class=FastJSONResponse)
+def station_detail(station_id: str):
+    return get_document_response(get_station_by_object_id(get_object_id(station_id)))
+
+
+@app.get("/routes/{route_id}", response_class=FastJSONResponse)
+def route_detail(route_id: str):
+    return get_document_response(get_route_by_object_id(get_object_id(route_id)))
+
+
+@app.get("/ready")
+def readiness():
+    """
+    Ready once the database is warmed up, until then it retries the warm up
+    """
+    if app.state.ready or warm_up_database():
+        return {"ready": True}
+    return JSONResponse({"ready": False}, status_code=503)
+
+
+@app.get("/metrics", response_class=Response)
+def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    return {"documents": documents_cache.stats(), "paths": paths_cache.cache.stats()}
+
 
-    return single_path_response
+@app.get("/stats/queries")
+def query_traces():
+    """
+    Queries of the last requests, only recorded when QUERY_PROFILER is enabled
+    """
+    return query_profiler.get_traces()
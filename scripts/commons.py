@@ -1,16 +1,38 @@
+import os
+import sys
+
 import pymongo
 from decouple import config
 
+# The modules of the API are shared with the scripts
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_FOLDER not in sys.path:
+    sys.path.append(ROOT_FOLDER)
+
+
+def clean_station_name(name):
+    return name.replace("Est. ", "")
+
 
 def get_station_data_by_name(db, name):
-    clean_name = name.replace("Est. ", "")
-    return db["stations"].find_one({"name": clean_name})
+    return db["stations"].find_one({"name": clean_station_name(name)})
 
 
 def get_route_data_by_name(db, name):
     return db["routes"].find_one({"name": name})
 
 
+def get_stations_by_name(db):
+    """
+    All the stations in one query, to look them up by name in memory
+    """
+    return {station["name"]: station for station in db["stations"].find()}
+
+
+def get_routes_by_name(db):
+    return {route["name"]: route for route in db["routes"].find()}
+
+
 def get_location_from_coordinates(coordinates):
     return {
         "type": "Point",
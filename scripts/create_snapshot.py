@@ -0,0 +1,49 @@
+import logging
+import sys
+import time
+from datetime import datetime
+
+from commons import get_database
+
+from core.network_version import get_version_collections, get_version_document
+from core.snapshot import SNAPSHOT_COLLECTIONS, write_snapshot_file
+
+DEFAULT_SNAPSHOT_PATH = "data/network.bson"
+
+
+def create_snapshot(db, path=DEFAULT_SNAPSHOT_PATH):
+    """
+    Export the collections of the served version to a file the API can load
+    instead of the database, see core.snapshot
+    """
+
+    start_time = time.perf_counter()
+
+    # The collections of the served version
+    version_document = get_version_document(db)
+    collection_names = get_version_collections(version_document)
+
+    logging.info(f"Get network collections {collection_names}")
+    collections = {
+        name: list(db[collection_names[name]].find()) for name in SNAPSHOT_COLLECTIONS
+    }
+
+    if version_document is not None:
+        version = version_document["version"]
+    else:
+        version = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    header = write_snapshot_file(path, collections, version)
+    logging.info(f"Network version {header['version']}: {header['counts']}")
+
+    elapsed_time = time.perf_counter() - start_time
+    logging.info(f"Snapshot saved in {path} in {elapsed_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+    logging.info("Connect to database")
+    db = get_database()
+
+    create_snapshot(db, *sys.argv[1:2])
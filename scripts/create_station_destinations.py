@@ -1,19 +1,16 @@
 import csv
 import json
 import logging
+import time
 from collections import defaultdict
 
-import pymongo
-from decouple import config
-
-
-def get_station_data_by_name(db, name):
-    clean_name = name.replace("Est. ", "")
-    return db["stations"].find_one({"name": clean_name})
-
-
-def get_route_data_by_name(db, name):
-    return db["routes"].find_one({"name": name})
+from commons import (
+    clean_station_name,
+    get_database,
+    get_routes_by_name,
+    get_stations_by_name,
+)
+from pymongo import UpdateOne
 
 
 def get_normal_routes():
@@ -46,51 +43,63 @@ def get_route_stops():
 
 def add_destinations_to_station(db):
 
+    start_time = time.perf_counter()
+
     logging.info("Get route stops")
     route_stops = get_route_stops()
 
+    logging.info("Get stations and routes")
+    stations = get_stations_by_name(db)
+    routes = get_routes_by_name(db)
+
+    station_destinations = defaultdict(list)
+
     for route_name, route_stations in route_stops.items():
         logging.info(f"Process route {route_name}")
 
-        route_data = get_route_data_by_name(db, route_name)
+        route_data = routes[route_name]
+        station_ids = [
+            stations[clean_station_name(station["stop_name"])]["_id"]
+            for station in route_stations
+        ]
         route_length = len(route_stations)
 
         for i in range(route_length):
-            destinations = []
-            station_name = route_stations[i]["stop_name"]
-            starting_station_data = get_station_data_by_name(db, station_name)
             for j in range(i + 1, route_length):
-                destination_station_name = route_stations[j]["stop_name"]
-                destination_station_data = get_station_data_by_name(
-                    db, destination_station_name
-                )
                 amonut_to_arrive = int(route_stations[j]["stop_sequence"]) - int(
                     route_stations[i]["stop_sequence"]
                 )
-                destinations.append(
+                station_destinations[station_ids[i]].append(
                     {
-                        "station": destination_station_data["_id"],
+                        "station": station_ids[j],
                         "amount_to_arrive": amonut_to_arrive,
                         "route": route_data["_id"],
                     }
                 )
 
-            logging.info(f"Updating station's destinations of {station_name}")
-            old_destinations = starting_station_data.get("destinations", [])
-            starting_station_data["destinations"] = [*old_destinations, *destinations]
-            db["stations"].replace_one(
-                {"_id": starting_station_data["_id"]}, starting_station_data
-            )
+    logging.info(f"Updating destinations of {len(station_destinations)} stations")
+    operations = [
+        UpdateOne(
+            {"_id": station_id},
+            {"$push": {"destinations": {"$each": destinations}}},
+        )
+        for station_id, destinations in station_destinations.items()
+    ]
+    # bulk_write doesn't accept an empty list, e.g. without troncal routes
+    modified_count = 0
+    if operations:
+        modified_count = (
+            db["stations"].bulk_write(operations, ordered=False).modified_count
+        )
+
+    elapsed_time = time.perf_counter() - start_time
+    logging.info(f"{modified_count} stations updated in {elapsed_time:.2f} seconds")
 
 
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
-    MONGO_URL = config("MONGO_URL")
-    DB_NAME = config("DB_NAME")
-
     logging.info("Connect to database")
-    client = pymongo.MongoClient(MONGO_URL)
-    db = client[DB_NAME]
+    db = get_database()
 
     add_destinations_to_station(db)
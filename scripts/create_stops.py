@@ -1,15 +1,22 @@
 import csv
 import logging
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 
 import pymongo
 from commons import (
+    clean_station_name,
     get_database,
     get_location_from_coordinates,
-    get_route_data_by_name,
-    get_station_data_by_name,
+    get_routes_by_name,
+    get_stations_by_name,
 )
 
+# Stops inserted at once and number of inserts made at the same time
+CHUNK_SIZE = 1000
+MAX_WORKERS = 4
+
 
 def extract_location_of_stop(raw_value):
     raw_coordinates = raw_value[7:-1]
@@ -26,10 +33,9 @@ def get_all_alimentadores_route_names(db):
     return list(aggregate_result)[0]["routes"]
 
 
-def get_route_stops(route_names):
+def read_route_stops(route_names):
     # headers info
     # route name, stop name, stop sequence, useless, useless, geoData
-    route_stops = defaultdict(list)
     with open("data/raw_structure_data/all_stops.csv", encoding="utf-8") as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=",")
 
@@ -39,73 +45,164 @@ def get_route_stops(route_names):
             row_splited = row[0].split(" ")
             route_name = row_splited[0]
             if route_name in route_names:
-                route_stops[route_name].append(
-                    {
-                        "description": row[1],
-                        "stop_sequence": row[2],
-                        "location": extract_location_of_stop(row[5]),
-                    }
-                )
-    return route_stops
+                yield route_name, row
 
 
-def create_stops(db):
+def get_route_summaries(route_names):
+    """
+    Number of stops and the first descriptions of each route, the only data of
+    a route needed before creating its stops
+    """
+    route_summaries = {}
+    for route_name, row in read_route_stops(route_names):
+        summary = route_summaries.setdefault(
+            route_name, {"number_of_stops": 0, "descriptions": []}
+        )
+        summary["number_of_stops"] += 1
+        if len(summary["descriptions"]) < 3:
+            summary["descriptions"].append(row[1])
+    return route_summaries
 
-    stop_collection = db["stops"]
 
-    logging.info("Delete old collection")
-    stop_collection.delete_many({})
+def get_route_processors(db, route_summaries):
+    """
+    For each route, a function that returns the stop document of a row given
+    its position in the route, or None if the row is not a stop
+    """
 
-    logging.info("Get alimentadores route names")
-    route_names = get_all_alimentadores_route_names(db)
+    stations = get_stations_by_name(db)
+    routes = get_routes_by_name(db)
 
-    logging.info("Get route stops")
-    route_stops = get_route_stops(route_names)
+    def get_station_id(description):
+        return stations[clean_station_name(description)]["_id"]
 
-    stop_documents = []
+    route_processors = {}
 
-    for route_name, stops in route_stops.items():
+    for route_name, summary in route_summaries.items():
         logging.info(f"Process route {route_name}")
 
+        descriptions = summary["descriptions"]
+        number_of_stops = summary["number_of_stops"]
+
         logging.info(f"Get parent station for {route_name}")
-        parent_station_name = stops[0]["description"]
-        parent_station_data = get_station_data_by_name(db, parent_station_name)
+        parent_station_data = stations.get(clean_station_name(descriptions[0]))
 
         if not parent_station_data:
             logging.info(f"Could not find parent station for route {route_name}")
             continue
 
-        logging.info(f"Get route data for {route_name}")
-        route_data = get_route_data_by_name(db, route_name)
-
-        number_of_stops = len(stops)
-
         # For normal stops, first and last stop is a station
-        stops_with_out_stations = stops[1:-1]
+        first_stop, last_stop = 1, number_of_stops - 2
 
         # Special case A8-3
         other_parent_stations = []
         if route_name == "A8-3":
             logging.info(f"Process special case for {route_name}")
-            psd2 = get_station_data_by_name(db, stops[1]["description"])
-            psd3 = get_station_data_by_name(db, stops[2]["description"])
-            other_parent_stations.extend([psd2["_id"], psd3["_id"]])
-            stops_with_out_stations = stops[3:-3]
-
-        for i, stop in enumerate(stops_with_out_stations, start=1):
-            amount_to_arrive = number_of_stops - i
-            stop_documents.append(
-                {
-                    **stop,
-                    "amount_to_arrive": amount_to_arrive,
-                    "route": route_data["_id"],
-                    "parent_station": parent_station_data["_id"],
-                    "other_parent_stations": other_parent_stations,
-                }
-            )
+            other_parent_stations.extend(map(get_station_id, descriptions[1:3]))
+            first_stop, last_stop = 3, number_of_stops - 4
+
+        route_processors[route_name] = partial(
+            get_stop_document,
+            first_stop=first_stop,
+            last_stop=last_stop,
+            number_of_stops=number_of_stops,
+            route_id=routes[route_name]["_id"],
+            parent_station_id=parent_station_data["_id"],
+            other_parent_stations=other_parent_stations,
+        )
+
+    return route_processors
+
+
+def get_stop_document(
+    row,
+    position,
+    first_stop,
+    last_stop,
+    number_of_stops,
+    route_id,
+    parent_station_id,
+    other_parent_stations,
+):
+    if position < first_stop or position > last_stop:
+        return None
+
+    amount_to_arrive = number_of_stops - (position - first_stop + 1)
+    return {
+        "description": row[1],
+        "stop_sequence": row[2],
+        "location": extract_location_of_stop(row[5]),
+        "amount_to_arrive": amount_to_arrive,
+        "route": route_id,
+        "parent_station": parent_station_id,
+        "other_parent_stations": other_parent_stations,
+    }
+
+
+def generate_stop_documents(route_names, route_processors):
+    positions = defaultdict(int)
+    for route_name, row in read_route_stops(route_names):
+        position = positions[route_name]
+        positions[route_name] += 1
+
+        if route_name in route_processors:
+            stop_document = route_processors[route_name](row, position)
+            if stop_document is not None:
+                yield stop_document
+
+
+def insert_in_chunks(collection, documents):
+    """
+    Insert the documents in chunks of CHUNK_SIZE, up to MAX_WORKERS chunks are
+    inserted at the same time so only a few chunks are in memory
+    """
+    number_of_documents = 0
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for chunk in chunked(documents, CHUNK_SIZE):
+            if len(pending) >= MAX_WORKERS:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    number_of_documents += len(future.result().inserted_ids)
+
+            pending.add(executor.submit(collection.insert_many, chunk, ordered=False))
+
+        for future in pending:
+            number_of_documents += len(future.result().inserted_ids)
+
+    return number_of_documents
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_stops(db):
+
+    stop_collection = db["stops"]
+
+    logging.info("Delete old collection")
+    stop_collection.delete_many({})
+
+    logging.info("Get alimentadores route names")
+    route_names = set(get_all_alimentadores_route_names(db))
+
+    logging.info("Get route summaries")
+    route_summaries = get_route_summaries(route_names)
+    route_processors = get_route_processors(db, route_summaries)
 
     logging.info("Add documents to stop collection ")
-    stop_collection.insert_many(stop_documents)
+    stop_documents = generate_stop_documents(route_names, route_processors)
+    number_of_documents = insert_in_chunks(stop_collection, stop_documents)
+    logging.info(f"{number_of_documents} stops added")
 
     logging.info("Create 2d sphere index")
     idx_resp = stop_collection.create_index([("location", pymongo.GEOSPHERE)])
@@ -0,0 +1,181 @@
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+
+from commons import get_database
+from create_routes import create_station_routes
+from create_station_destinations import add_destinations_to_station
+from create_stations import create_stations
+from create_stops import create_stops
+
+from core.network_version import (
+    CURRENT_VERSION_ID,
+    NETWORK_COLLECTIONS,
+    NETWORK_VERSION_COLLECTION,
+)
+
+GEO_COLLECTIONS = ["stations", "stops"]
+
+VERSION_FORMAT = "%Y%m%d%H%M%S"
+VERSION_COLLECTION_PATTERN = re.compile(
+    rf"^({'|'.join(NETWORK_COLLECTIONS)})_(\d{{14}})$"
+)
+
+# Versions kept after a rebuild, besides the current one
+KEEP_VERSIONS = 2
+# Older versions are kept until they have been replaced for this long, API
+# instances read the current version again every NETWORK_COLLECTIONS_TTL
+# seconds, and the requests in progress keep using the version they started with
+DROP_GRACE_PERIOD = timedelta(hours=1)
+
+
+class StagingDatabase:
+    """
+    Database where the network collections are the collections of a new
+    version, the scripts fill them as if they were the real ones
+    """
+
+    def __init__(self, db, version):
+        self.db = db
+        self.version = version
+
+    def get_collection_name(self, name):
+        if name in NETWORK_COLLECTIONS:
+            return f"{name}_{self.version}"
+        return name
+
+    def get_collections(self):
+        return {name: self.get_collection_name(name) for name in NETWORK_COLLECTIONS}
+
+    def __getitem__(self, name):
+        return self.db[self.get_collection_name(name)]
+
+    def drop(self):
+        for name in NETWORK_COLLECTIONS:
+            self[name].drop()
+
+
+def build_network(staging_db):
+    create_stations(staging_db)
+    create_station_routes(staging_db)
+    add_destinations_to_station(staging_db)
+    create_stops(staging_db)
+
+
+def validate_network(staging_db):
+    errors = []
+
+    for name in NETWORK_COLLECTIONS:
+        if staging_db[name].count_documents({}) == 0:
+            errors.append(f"{name} is empty")
+
+    for name in GEO_COLLECTIONS:
+        if "location_2dsphere" not in staging_db[name].index_information():
+            errors.append(f"{name} has no 2d sphere index")
+
+    station_ids = set(staging_db["stations"].distinct("_id"))
+    route_ids = set(staging_db["routes"].distinct("_id"))
+
+    for station in staging_db["stations"].find({}, {"destinations": 1}):
+        for destination in station.get("destinations", []):
+            if destination["station"] not in station_ids:
+                errors.append(f"Station {station['_id']} has an unknown destination")
+            if destination["route"] not in route_ids:
+                errors.append(f"Station {station['_id']} has an unknown route")
+
+    for stop in staging_db["stops"].find({}, {"parent_station": 1, "route": 1}):
+        if stop["parent_station"] not in station_ids:
+            errors.append(f"Stop {stop['_id']} has an unknown parent station")
+        if stop["route"] not in route_ids:
+            errors.append(f"Stop {stop['_id']} has an unknown route")
+
+    if errors:
+        raise ValueError(f"Invalid network {staging_db.version}: {errors}")
+
+
+def swap_network(db, staging_db):
+    """
+    Serve the collections of the new version. The API reads the names of the
+    collections from the version document, so replacing it swaps all of them at
+    once
+    """
+    logging.info(f"Serve collections {staging_db.get_collections()}")
+    db[NETWORK_VERSION_COLLECTION].replace_one(
+        {"_id": CURRENT_VERSION_ID},
+        {
+            "version": staging_db.version,
+            "collections": staging_db.get_collections(),
+            "created_at": datetime.utcnow(),
+        },
+        upsert=True,
+    )
+
+
+def drop_old_versions(
+    db,
+    current_version,
+    keep_versions=KEEP_VERSIONS,
+    grace_period=DROP_GRACE_PERIOD,
+):
+    """
+    Drop the collections of the versions before the current one, except the
+    last keep_versions and the ones replaced less than grace_period ago. A
+    version is replaced by the next one, when it was built at the latest
+    """
+    collection_versions = {}
+    for name in db.list_collection_names():
+        match = VERSION_COLLECTION_PATTERN.match(name)
+        if match:
+            collection_versions.setdefault(match.group(2), []).append(name)
+
+    old_versions = sorted(
+        (version for version in collection_versions if version < current_version),
+        reverse=True,
+    )
+    now = datetime.utcnow()
+    replaced_by = current_version
+
+    for i, version in enumerate(old_versions):
+        replaced_at = datetime.strptime(replaced_by, VERSION_FORMAT)
+        replaced_by = version
+        if i < keep_versions or now - replaced_at < grace_period:
+            continue
+
+        for name in collection_versions[version]:
+            logging.info(f"Drop {name}")
+            db[name].drop()
+
+
+def rebuild_network(db):
+    start_time = time.perf_counter()
+
+    version = datetime.utcnow().strftime(VERSION_FORMAT)
+    staging_db = StagingDatabase(db, version)
+
+    logging.info(f"Build network version {version}")
+    try:
+        staging_db.drop()
+        build_network(staging_db)
+        logging.info("Validate network")
+        validate_network(staging_db)
+    except Exception:
+        logging.exception(f"Could not build network version {version}")
+        staging_db.drop()
+        raise
+
+    swap_network(db, staging_db)
+    drop_old_versions(db, version)
+
+    elapsed_time = time.perf_counter() - start_time
+    logging.info(f"Network version {version} built in {elapsed_time:.2f} seconds")
+    return version
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+    logging.info("Connect to database")
+    db = get_database()
+
+    rebuild_network(db)
@@ -0,0 +1,150 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.network import generate_network
+from benchmarks.run import get_query_points
+from config.constants import MAX_BATCH_PAIRS
+from core import commons
+from core.commons import (
+    BatchStationAndStops,
+    get_batch_station_and_stops,
+    get_station_and_stops,
+)
+from core.queries import documents_cache, get_station_by_object_id, shared_lookups
+from core.snapshot import NetworkSnapshot, get_snapshot, set_snapshot
+
+
+class TestBatchPaths(unittest.TestCase):
+    def setUp(self):
+        self.network = generate_network()
+        set_snapshot(
+            NetworkSnapshot(
+                self.network["stations"],
+                self.network["routes"],
+                self.network["stops"],
+            )
+        )
+        self.client = TestClient(main.app)
+
+        # the last pairs repeat points of the first ones
+        points = get_query_points(self.network, 6, seed=1)
+        self.points = points + [(final, start) for start, final in points[:3]]
+
+    def tearDown(self):
+        set_snapshot(None)
+        documents_cache.invalidate()
+
+    def test_same_responses_as_single_paths(self):
+        pairs = [
+            {"start": start.dict(), "final": final.dict()}
+            for start, final in self.points
+        ]
+        response = self.client.post("/paths/batch", json={"pairs": pairs})
+
+        self.assertEqual(response.status_code, 200)
+        single_responses = [
+            self.client.get(
+                "/paths/single",
+                params={
+                    "start": f"{start.lon},{start.lat}",
+                    "final": f"{final.lon},{final.lat}",
+                },
+            ).json()
+            for start, final in self.points
+        ]
+        self.assertEqual(response.json(), single_responses)
+
+    def test_too_many_pairs(self):
+        start, final = self.points[0]
+        pairs = [{"start": start.dict(), "final": final.dict()}] * (MAX_BATCH_PAIRS + 1)
+
+        response = self.client.post("/paths/batch", json={"pairs": pairs})
+        self.assertEqual(response.status_code, 422)
+
+        # the stream has its own limit
+        response = self.client.post("/paths/batch/stream", json={"pairs": pairs})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.text.splitlines()), len(pairs))
+
+        with mock.patch.object(main, "BATCH_STREAM_MAX_PAIRS", MAX_BATCH_PAIRS):
+            response = self.client.post("/paths/batch/stream", json={"pairs": pairs})
+        self.assertEqual(response.status_code, 422)
+
+    def test_nearby_queries_are_made_once_per_point(self):
+        with mock.patch.object(
+            commons, "get_nearby_stations", wraps=commons.get_nearby_stations
+        ) as get_nearby_stations:
+            all_stations_stops = get_batch_station_and_stops(self.points)
+
+        points = {(c.lon, c.lat) for pair in self.points for c in pair}
+        self.assertEqual(get_nearby_stations.call_count, len(points))
+        self.assertEqual(
+            all_stations_stops,
+            [get_station_and_stops(start, final) for start, final in self.points],
+        )
+
+    def test_nearby_queries_of_the_database_overlap(self):
+        lock = threading.Lock()
+        in_progress = 0
+        max_in_progress = 0
+
+        def get_nearby_stations(*args, **kwargs):
+            nonlocal in_progress, max_in_progress
+            with lock:
+                in_progress += 1
+                max_in_progress = max(max_in_progress, in_progress)
+            time.sleep(0.02)
+            try:
+                return original_get_nearby_stations(*args, **kwargs)
+            finally:
+                with lock:
+                    in_progress -= 1
+
+        original_get_nearby_stations = commons.get_nearby_stations
+        # the queries run as if they were made to the database
+        with mock.patch.object(
+            commons, "get_snapshot", return_value=None
+        ), mock.patch.object(commons, "get_nearby_stations", get_nearby_stations):
+            all_stations_stops = get_batch_station_and_stops(self.points)
+
+        self.assertGreater(max_in_progress, 1)
+        self.assertEqual(
+            all_stations_stops,
+            [get_station_and_stops(start, final) for start, final in self.points],
+        )
+
+    def test_lookups_of_the_batch_are_bounded(self):
+        batch_station_and_stops = BatchStationAndStops(max_lookups=2)
+
+        all_stations_stops = [
+            batch_station_and_stops.get(start, final) for start, final in self.points
+        ]
+
+        self.assertLessEqual(len(batch_station_and_stops.nearby), 2)
+        self.assertEqual(
+            all_stations_stops,
+            [get_station_and_stops(start, final) for start, final in self.points],
+        )
+
+    def test_shared_lookups_are_made_once(self):
+        station_id = self.network["stations"][0]["_id"]
+        snapshot = get_snapshot()
+
+        with mock.patch.object(
+            snapshot,
+            "get_station_by_object_id",
+            wraps=snapshot.get_station_by_object_id,
+        ) as lookup, mock.patch.object(documents_cache, "maxsize", 0):
+            with shared_lookups():
+                for _ in range(3):
+                    get_station_by_object_id(station_id)
+            self.assertEqual(lookup.call_count, 1)
+
+            # without the context every call is made
+            get_station_by_object_id(station_id)
+            self.assertEqual(lookup.call_count, 2)
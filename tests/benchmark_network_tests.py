@@ -0,0 +1,35 @@
+import unittest
+
+from benchmarks.network import generate_network
+from core.snapshot import NetworkSnapshot
+
+
+class TestBenchmarkNetwork(unittest.TestCase):
+    def setUp(self):
+        self.network = generate_network(
+            stations=10, troncal_routes=4, alimentador_routes=5, stops_per_route=6
+        )
+        self.snapshot = NetworkSnapshot(**self.network)
+
+    def test_same_seed_same_network(self):
+        self.assertEqual(
+            generate_network(
+                stations=10, troncal_routes=4, alimentador_routes=5, stops_per_route=6
+            ),
+            self.network,
+        )
+
+    def test_all_stations_are_connected(self):
+        for start_id in self.snapshot.stations:
+            for final_id in self.snapshot.stations:
+                if start_id != final_id:
+                    routes = self.snapshot.get_possible_routes_between_station(
+                        start_id, final_id
+                    )
+                    self.assertTrue(routes)
+
+    def test_stops_end_at_their_parent_station(self):
+        self.assertEqual(len(self.network["stops"]), 5 * 6)
+        for stop in self.network["stops"]:
+            self.assertIn(stop["parent_station"], self.snapshot.stations)
+            self.assertIn(stop["route"], self.snapshot.routes)
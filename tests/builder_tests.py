@@ -0,0 +1,322 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.network import generate_network
+from benchmarks.run import get_query_points
+from core import graph, paths, queries
+from core.cache import LRUCache
+from core.commons import get_station_and_stops
+from core.graph import (
+    GraphPathBuilder,
+    get_transit_graph,
+    invalidate_transit_graph,
+)
+from core.models import Coordinate, Method, ToType
+from core.paths import (
+    MultiAlternativePathBuilder,
+    SingleAlternativePathBuilder,
+    get_json_from_list_of_paths,
+)
+from core.queries import documents_cache, shared_lookups
+from core.snapshot import NetworkSnapshot, set_snapshot
+from tests import network
+
+
+class TestInMemoryBuilder(unittest.TestCase):
+
+    path_builder_class = SingleAlternativePathBuilder
+
+    def setUp(self):
+        set_snapshot(
+            NetworkSnapshot(
+                network.get_stations(), network.get_routes(), network.get_stops()
+            )
+        )
+
+        # Near the last stops of A1 to the southern station
+        self.start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        self.final = Coordinate(lon=-74.799618, lat=10.9154516)
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def get_path_builder(self, start, final):
+        stations_stops = get_station_and_stops(start, final)
+        return self.path_builder_class(start, final, stations_stops)
+
+    def test_async_paths_keep_the_order(self):
+        path_builder = self.get_path_builder(self.start, self.final)
+
+        paths = path_builder.get_all_possible_paths()
+        async_paths = asyncio.run(path_builder.get_all_possible_paths_async())
+
+        self.assertTrue(paths)
+        self.assertEqual(
+            get_json_from_list_of_paths(async_paths),
+            get_json_from_list_of_paths(paths),
+        )
+
+    def test_iter_paths_returns_the_same_paths(self):
+        path_builder = self.get_path_builder(self.start, self.final)
+
+        async def get_async_paths():
+            return [path async for path in path_builder.iter_paths_async()]
+
+        paths = get_json_from_list_of_paths(path_builder.get_all_possible_paths())
+        self.assertEqual(
+            get_json_from_list_of_paths(list(path_builder.iter_paths())), paths
+        )
+        self.assertEqual(
+            get_json_from_list_of_paths(asyncio.run(get_async_paths())), paths
+        )
+
+
+class TestConcurrentStrategies(unittest.TestCase):
+    """
+    Without a network in memory the strategies run in the threadpool, here the
+    lookups are answered by the snapshot after a delay
+    """
+
+    lookup_names = (
+        "get_station_by_object_id",
+        "get_route_by_object_id",
+        "get_possible_routes_between_station",
+    )
+
+    def setUp(self):
+        network_data = generate_network()
+        self.snapshot = NetworkSnapshot(**network_data)
+        # pairs where at least two strategies make lookups
+        self.points = get_query_points(network_data, 3, seed=1)
+
+        set_snapshot(self.snapshot)
+        self.all_stations_stops = [
+            get_station_and_stops(start, final) for start, final in self.points
+        ]
+        self.expected = [
+            get_json_from_list_of_paths(path_builder.get_all_possible_paths())
+            for path_builder in self.get_path_builders()
+        ]
+        set_snapshot(None)
+        documents_cache.invalidate()
+
+        self.lock = threading.Lock()
+        self.in_progress = 0
+        self.max_in_progress = 0
+
+        for name in self.lookup_names:
+            patcher = mock.patch.object(paths, name, self.delayed(getattr(paths, name)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(queries, "get_snapshot", lambda: self.snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        set_snapshot(None)
+        documents_cache.invalidate()
+
+    def delayed(self, lookup):
+        def wrapper(*args):
+            with self.lock:
+                self.in_progress += 1
+                self.max_in_progress = max(self.max_in_progress, self.in_progress)
+            try:
+                time.sleep(0.02)
+                return lookup(*args)
+            finally:
+                with self.lock:
+                    self.in_progress -= 1
+
+        return wrapper
+
+    def get_path_builders(self):
+        return [
+            SingleAlternativePathBuilder(start, final, stations_stops)
+            for (start, final), stations_stops in zip(
+                self.points, self.all_stations_stops
+            )
+        ]
+
+    def test_strategies_overlap_and_keep_their_order(self):
+        lookups = LRUCache()
+
+        async def get_all_paths():
+            with shared_lookups(lookups):
+                return [
+                    await path_builder.get_all_possible_paths_async()
+                    for path_builder in self.get_path_builders()
+                ]
+
+        all_paths = asyncio.run(get_all_paths())
+
+        self.assertEqual(
+            [get_json_from_list_of_paths(paths) for paths in all_paths], self.expected
+        )
+        self.assertGreater(self.max_in_progress, 1)
+        # the lookups of the request are shared by the threads of the strategies
+        self.assertGreater(len(lookups), 0)
+
+    def test_iter_paths_in_the_threadpool(self):
+        async def get_all_paths():
+            return [
+                [path async for path in path_builder.iter_paths_async()]
+                for path_builder in self.get_path_builders()
+            ]
+
+        self.assertEqual(
+            [get_json_from_list_of_paths(p) for p in asyncio.run(get_all_paths())],
+            self.expected,
+        )
+
+
+class TestGraphBuilder(TestInMemoryBuilder):
+
+    path_builder_class = GraphPathBuilder
+
+    def test_best_path(self):
+        path_builder = self.get_path_builder(self.start, self.final)
+        paths = path_builder.get_all_possible_paths()
+
+        self.assertEqual(len(paths), 1)
+        path = paths[0]
+        self.assertEqual(
+            [step.through.method for step in path],
+            [Method.WALK, Method.ALIMENTADOR, Method.TRONCAL, Method.WALK],
+        )
+        self.assertEqual(path[1].data["station_id"], 205)
+        self.assertEqual(path[2].data["station_id"], 101)
+        self.assertEqual(path[2].through.route_data["name"], "R1")
+        self.assertEqual(path[3].place_type, ToType.PLACE)
+
+    def test_best_path_with_a_transfer(self):
+        # From the southern station to the last stops of A1
+        path_builder = self.get_path_builder(self.final, self.start)
+        path = path_builder.get_all_possible_paths()[0]
+
+        self.assertEqual(
+            [step.through.method for step in path],
+            [Method.WALK, Method.TRONCAL, Method.ALIMENTADOR, Method.WALK],
+        )
+        self.assertEqual(path[1].data["station_id"], 205)
+        self.assertEqual(path[1].through.route_data["name"], "S1")
+
+    def test_no_path_far_from_the_network(self):
+        far = Coordinate(lon=-74.5, lat=10.5)
+        path_builder = self.get_path_builder(self.start, far)
+        self.assertEqual(path_builder.get_all_possible_paths(), [])
+
+    def test_graph_is_built_once_by_concurrent_requests(self):
+        snapshot = NetworkSnapshot(
+            network.get_stations(), network.get_routes(), network.get_stops()
+        )
+
+        def from_database(db):
+            time.sleep(0.05)
+            return snapshot
+
+        set_snapshot(None)
+        invalidate_transit_graph()
+        self.addCleanup(invalidate_transit_graph)
+
+        graphs = []
+        with mock.patch.object(
+            graph.NetworkSnapshot, "from_database", side_effect=from_database
+        ) as load:
+            threads = [
+                threading.Thread(target=lambda: graphs.append(get_transit_graph()))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        load.assert_called_once()
+        self.assertEqual(len(graphs), 4)
+        self.assertTrue(all(transit_graph is graphs[0] for transit_graph in graphs))
+        self.assertIs(graphs[0].snapshot, snapshot)
+
+
+class TestMultiAlternativeBuilder(TestInMemoryBuilder):
+
+    path_builder_class = MultiAlternativePathBuilder
+
+    def get_cost(self, path_builder, start_option, final_option):
+        troncal_cost = path_builder.get_troncal_cost(
+            start_option.station_id, final_option.station_id
+        )
+        return start_option.cost + troncal_cost + final_option.cost
+
+    def test_best_path_first(self):
+        paths = self.get_path_builder(self.start, self.final).get_all_possible_paths()
+
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(
+            [step.through.method for step in paths[0]],
+            [Method.WALK, Method.ALIMENTADOR, Method.TRONCAL, Method.WALK],
+        )
+
+    def test_pruning_keeps_the_best_paths(self):
+        network_data = generate_network(
+            stations=20, alimentador_routes=30, stops_per_route=10
+        )
+        set_snapshot(NetworkSnapshot(**network_data))
+
+        stops = network_data["stops"]
+        for i in range(0, len(stops) - 1, 37):
+            start_lon, start_lat = stops[i]["location"]["coordinates"]
+            final_lon, final_lat = stops[-i - 1]["location"]["coordinates"]
+            start = Coordinate(lon=start_lon, lat=start_lat)
+            final = Coordinate(lon=final_lon, lat=final_lat)
+            stations_stops = get_station_and_stops(start, final)
+
+            path_builder = MultiAlternativePathBuilder(
+                start, final, stations_stops, max_paths=3
+            )
+            all_path_builder = MultiAlternativePathBuilder(
+                start, final, stations_stops, max_paths=1000
+            )
+
+            costs = [
+                self.get_cost(path_builder, *options)
+                for options in path_builder.get_best_options()
+            ]
+            all_costs = [
+                self.get_cost(all_path_builder, *options)
+                for options in all_path_builder.get_best_options()
+            ]
+
+            self.assertEqual(costs, all_costs[:3])
+            self.assertEqual(
+                len(path_builder.get_all_possible_paths()), min(3, len(all_costs))
+            )
+
+    def test_troncal_routes_are_looked_up_at_once(self):
+        path_builder = self.get_path_builder(self.final, self.start)
+
+        with mock.patch.object(
+            paths,
+            "get_possible_routes_between_stations",
+            wraps=paths.get_possible_routes_between_stations,
+        ) as batch_lookup, mock.patch.object(
+            paths,
+            "get_possible_routes_between_station",
+            wraps=paths.get_possible_routes_between_station,
+        ) as lookup:
+            paths_found = path_builder.get_all_possible_paths()
+
+        self.assertTrue(paths_found)
+        self.assertEqual(batch_lookup.call_count, 1)
+        self.assertEqual(lookup.call_count, 0)
+        for (start_id, final_id), route in path_builder.troncal_routes.items():
+            self.assertEqual(
+                route,
+                path_builder.get_shortest_troncal_route(
+                    paths.get_possible_routes_between_station(start_id, final_id)
+                ),
+            )
@@ -0,0 +1,159 @@
+import time
+import unittest
+
+from core.cache import LRUCache, cached
+from core.commons import get_station_and_stops
+from core.models import Coordinate
+from core.paths import SingleAlternativePathBuilder, get_json_from_list_of_paths
+from core.response_cache import PathsCache
+from core.snapshot import NetworkSnapshot, set_snapshot
+from tests import network
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_hits_and_misses(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_max_weight(self):
+        cache = LRUCache(max_weight=10, weigh=len)
+        cache.set("a", "x" * 6)
+        cache.set("b", "x" * 6)
+        cache.set("c", "x" * 11)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.weight, 6)
+
+    def test_cached_function(self):
+        calls = []
+
+        @cached(LRUCache())
+        def get_document(obj_id):
+            calls.append(obj_id)
+            return {"_id": obj_id} if obj_id else None
+
+        get_document(1)
+        get_document(1)
+        get_document(0)
+        get_document(0)
+
+        self.assertEqual(calls, [1, 0, 0])
+
+
+class TestPathsCache(unittest.TestCase):
+    def setUp(self):
+        set_snapshot(
+            NetworkSnapshot(
+                network.get_stations(), network.get_routes(), network.get_stops()
+            )
+        )
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def get_paths(self, start, final):
+        stations_stops = get_station_and_stops(start, final)
+        path_builder = SingleAlternativePathBuilder(start, final, stations_stops)
+        return path_builder.get_all_possible_paths()
+
+    def test_walks_are_relocated_to_the_requested_points(self):
+        paths_cache = PathsCache(precision=7, maxsize=10)
+
+        start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        final = Coordinate(lon=-74.799618, lat=10.9154516)
+        paths_cache.set(start, final, self.get_paths(start, final))
+
+        # a few meters away from the cached points
+        near_start = Coordinate(lon=-74.8497, lat=11.0178)
+        near_final = Coordinate(lon=-74.7997, lat=10.9155)
+        cached_paths = paths_cache.get(near_start, near_final)
+        paths = self.get_paths(near_start, near_final)
+
+        self.assertTrue(paths)
+        self.assertEqual(
+            get_json_from_list_of_paths(cached_paths),
+            get_json_from_list_of_paths(paths),
+        )
+
+    def test_path_to_the_parent_station_of_the_start_stop(self):
+        paths_cache = PathsCache(precision=7, maxsize=10)
+
+        # From the last stops of A1 to its parent station, the northern station
+        start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        final = Coordinate(lon=-74.80262, lat=10.99152)
+        paths_cache.set(start, final, self.get_paths(start, final))
+
+        near_start = Coordinate(lon=-74.8497, lat=11.0178)
+        near_final = Coordinate(lon=-74.80265, lat=10.99149)
+        cached_paths = paths_cache.get(near_start, near_final)
+        paths = self.get_paths(near_start, near_final)
+
+        self.assertEqual(len(paths[0]), 3)
+        self.assertNotIn("distance", paths[0][1].data)
+        self.assertEqual(
+            get_json_from_list_of_paths(cached_paths),
+            get_json_from_list_of_paths(paths),
+        )
+
+    def test_miss_on_other_cells(self):
+        paths_cache = PathsCache(precision=7, maxsize=10)
+
+        start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        final = Coordinate(lon=-74.799618, lat=10.9154516)
+        paths_cache.set(start, final, self.get_paths(start, final))
+
+        self.assertIsNone(paths_cache.get(final, start))
+
+    def test_paths_are_weighed_by_their_steps(self):
+        start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        final = Coordinate(lon=-74.799618, lat=10.9154516)
+        paths = self.get_paths(start, final)
+        steps = sum(len(path) for path in paths)
+
+        paths_cache = PathsCache(precision=7, maxsize=10, max_steps=steps)
+        paths_cache.set(start, final, paths)
+        self.assertEqual(paths_cache.cache.weight, steps)
+
+        # more steps than the limit are not cached
+        paths_cache = PathsCache(precision=7, maxsize=10, max_steps=steps - 1)
+        paths_cache.set(start, final, paths)
+        self.assertIsNone(paths_cache.get(start, final))
@@ -0,0 +1,256 @@
+import asyncio
+import math
+import threading
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.network import generate_network, move
+from config.constants import MAX_CANDIDATE_STOPS, MIN_CANDIDATES, SEARCH_RADII
+from core import commons, queries
+from core.cache import LRUCache
+from core.commons import (
+    CandidateStops,
+    count_candidates,
+    get_best_stops,
+    get_station_and_stops,
+    get_station_and_stops_async,
+    search_nearby,
+)
+from core.models import Coordinate, Fields
+from core.queries import get_nearby_stations, get_nearby_stops, shared_lookups
+from core.snapshot import NetworkSnapshot, set_snapshot
+from tests import network
+
+
+class TestStationAndStops(unittest.TestCase):
+    def setUp(self):
+        set_snapshot(
+            NetworkSnapshot(
+                network.get_stations(), network.get_routes(), network.get_stops()
+            )
+        )
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def test_async_version_returns_the_same(self):
+        start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        final = Coordinate(lon=-74.799618, lat=10.9154516)
+
+        stations_stops = get_station_and_stops(start, final)
+        async_stations_stops = asyncio.run(get_station_and_stops_async(start, final))
+
+        self.assertEqual(async_stations_stops, stations_stops)
+        self.assertTrue(stations_stops["start_stops"])
+        self.assertTrue(stations_stops["final_stations"])
+
+    def test_documents_of_the_selected_stops(self):
+        start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        final = Coordinate(lon=-74.799618, lat=10.9154516)
+
+        stations_stops = get_station_and_stops(start, final)
+        nearby_stops = {
+            stop["_id"]: stop for stop in get_nearby_stops(start, fields=Fields.FULL)
+        }
+
+        for stop in stations_stops["start_stops"]:
+            self.assertIn("parent_station", stop)
+            self.assertIn("location", stop)
+            self.assertEqual(stop["distance"], nearby_stops[stop["_id"]]["distance"])
+
+
+class TestConcurrentQueries(unittest.TestCase):
+    """
+    Without a network in memory the queries run in the threadpool, here they
+    are answered by the snapshot but only after the other queries have started
+    """
+
+    def setUp(self):
+        self.snapshot = NetworkSnapshot(
+            network.get_stations(), network.get_routes(), network.get_stops()
+        )
+        set_snapshot(None)
+
+        self.start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        self.final = Coordinate(lon=-74.799618, lat=10.9154516)
+
+        # the four queries must be in progress at the same time to continue
+        self.barrier = threading.Barrier(4, timeout=5)
+        self.lookups = LRUCache()
+        self.contexts = []
+
+        for name in ("get_nearby_stations", "get_nearby_stops"):
+            patcher = mock.patch.object(
+                queries, name, self.wait_for_all(getattr(queries, name))
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(queries, "get_snapshot", lambda: self.snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def wait_for_all(self, query):
+        def wrapper(coordinate, *args):
+            self.contexts.append(queries._shared_lookups.get())
+            self.barrier.wait()
+            # the queries of the start point finish last
+            time.sleep(0.05 if coordinate == self.start else 0)
+            return query(coordinate, *args)
+
+        return wrapper
+
+    def get_expected(self, **kwargs):
+        set_snapshot(self.snapshot)
+        try:
+            return get_station_and_stops(self.start, self.final, **kwargs)
+        finally:
+            set_snapshot(None)
+
+    def test_queries_overlap_and_keep_their_order(self):
+        expected = self.get_expected()
+
+        async def get_station_and_stops():
+            with shared_lookups(self.lookups):
+                return await get_station_and_stops_async(self.start, self.final)
+
+        self.assertEqual(asyncio.run(get_station_and_stops()), expected)
+        self.assertEqual(self.barrier.n_waiting, 0)
+        self.assertFalse(self.barrier.broken)
+        # the context of the request is seen in the threads of the queries
+        self.assertEqual(self.contexts, [self.lookups] * 4)
+
+    def test_adaptive_queries_overlap(self):
+        expected = self.get_expected(adaptive=True)
+
+        stations_stops = asyncio.run(
+            get_station_and_stops_async(self.start, self.final, adaptive=True)
+        )
+
+        self.assertEqual(stations_stops, expected)
+        self.assertFalse(self.barrier.broken)
+
+
+class TestCandidateStops(unittest.TestCase):
+    def test_same_best_stops_as_each_group(self):
+        data = generate_network(alimentador_routes=20, stops_per_route=15)
+        snapshot = NetworkSnapshot(data["stations"], data["routes"], data["stops"])
+
+        for stop in data["stops"][::7]:
+            lon, lat = stop["location"]["coordinates"]
+            coordinate = Coordinate(lon=lon + 0.001, lat=lat - 0.001)
+            stops = snapshot.get_nearby_stops(coordinate, 1500)
+
+            # groups of stops by route, in the order of their first stop
+            group_stops = {}
+            for nearby_stop in stops:
+                group_stops.setdefault(nearby_stop["route"], []).append(nearby_stop)
+
+            for from_start_node in (True, False):
+                expected = [
+                    best_stop
+                    for stops_group in group_stops.values()
+                    for best_stop in get_best_stops(stops_group, from_start_node)
+                ]
+                self.assertEqual(
+                    CandidateStops(stops).get_best_stops(from_start_node), expected
+                )
+
+    def test_no_stops(self):
+        self.assertEqual(CandidateStops([]).get_best_stops(), [])
+
+
+class TestAdaptiveSearch(unittest.TestCase):
+    def setUp(self):
+        self.network = generate_network(alimentador_routes=20, stops_per_route=15)
+        set_snapshot(
+            NetworkSnapshot(
+                self.network["stations"],
+                self.network["routes"],
+                self.network["stops"],
+            )
+        )
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def get_station_point(self, index: int, meters: float = 0) -> Coordinate:
+        lon, lat = self.network["stations"][index]["location"]["coordinates"]
+        # south of the first station there are no stops
+        lon, lat = move(lon, lat, meters, math.pi)
+        return Coordinate(lon=lon, lat=lat)
+
+    def test_smallest_radius_with_enough_candidates(self):
+        radii = set()
+        for stop in self.network["stops"]:
+            lon, lat = stop["location"]["coordinates"]
+            coordinate = Coordinate(lon=lon, lat=lat)
+            stations, stops, radius = search_nearby(coordinate)
+            radii.add(radius)
+
+            # the largest radius is used even without enough candidates
+            if radius != SEARCH_RADII[-1]:
+                self.assertGreaterEqual(
+                    count_candidates(stations, stops), MIN_CANDIDATES
+                )
+            self.assertTrue(all(s["distance"] <= radius for s in stations + stops))
+            for smaller_radius in SEARCH_RADII[: SEARCH_RADII.index(radius)]:
+                self.assertLess(
+                    count_candidates(
+                        get_nearby_stations(coordinate, smaller_radius),
+                        get_nearby_stops(coordinate, smaller_radius),
+                    ),
+                    MIN_CANDIDATES,
+                )
+
+        # dense and sparse areas
+        self.assertIn(SEARCH_RADII[0], radii)
+        self.assertGreater(len(radii), 1)
+
+    def test_sparse_area_expands_the_radius(self):
+        start = self.get_station_point(0, meters=1200)
+        final = self.get_station_point(15)
+
+        stations_stops = get_station_and_stops(start, final)
+        self.assertFalse(stations_stops["start_stations"])
+        self.assertFalse(stations_stops["start_stops"])
+        self.assertNotIn("search_radius", stations_stops)
+
+        adaptive_stations_stops = get_station_and_stops(start, final, adaptive=True)
+        self.assertTrue(adaptive_stations_stops["start_stations"])
+        self.assertGreater(adaptive_stations_stops["search_radius"]["start"], 1000)
+        self.assertEqual(
+            adaptive_stations_stops["search_radius"]["final"], search_nearby(final)[2]
+        )
+
+    def test_one_query_in_the_largest_radius(self):
+        coordinate = self.get_station_point(0, meters=1200)
+
+        with mock.patch.object(
+            commons, "get_nearby_stations", wraps=commons.get_nearby_stations
+        ) as nearby_stations, mock.patch.object(
+            commons, "get_nearby_stops", wraps=commons.get_nearby_stops
+        ) as nearby_stops:
+            search_nearby(coordinate)
+
+        for query in (nearby_stations, nearby_stops):
+            query.assert_called_once()
+            self.assertEqual(query.call_args.args[1], SEARCH_RADII[-1])
+
+    def test_candidates_are_capped(self):
+        _, stops, _ = search_nearby(self.get_station_point(15, meters=100))
+
+        self.assertLessEqual(len(stops), MAX_CANDIDATE_STOPS)
+
+    def test_async_version_returns_the_same(self):
+        start = self.get_station_point(0, meters=1200)
+        final = self.get_station_point(15)
+
+        self.assertEqual(
+            asyncio.run(get_station_and_stops_async(start, final, adaptive=True)),
+            get_station_and_stops(start, final, adaptive=True),
+        )
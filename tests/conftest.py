@@ -1,5 +1,9 @@
 import logging
 import logging.config
+import os
+
+# logging.conf is the local configuration, made from logging_example.conf
+LOGGING_CONFIG_FILES = ("logging.conf", "logging_example.conf")
 
 
 def pytest_sessionstart(session):
@@ -7,7 +11,8 @@ def pytest_sessionstart(session):
     Called after the Session object has been created and
     before performing collection and entering the run test loop.
     """
-    logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
+    config_file = next(name for name in LOGGING_CONFIG_FILES if os.path.exists(name))
+    logging.config.fileConfig(fname=config_file, disable_existing_loggers=False)
     logger = logging.getLogger(__name__)
 
-    logger.info("Config logging Loaded")
+    logger.info(f"Config logging Loaded from {config_file}")
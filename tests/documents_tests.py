@@ -0,0 +1,136 @@
+import unittest
+
+from bson.objectid import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+from core.queries import (
+    SLIM_ROUTE_FIELDS,
+    SLIM_STATION_FIELDS,
+    SLIM_STOP_FIELDS,
+    documents_cache,
+)
+from core.snapshot import NetworkSnapshot, set_snapshot
+from tests import network
+
+
+class TestDocuments(unittest.TestCase):
+    def setUp(self):
+        set_snapshot(
+            NetworkSnapshot(
+                network.get_stations(), network.get_routes(), network.get_stops()
+            )
+        )
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        set_snapshot(None)
+        documents_cache.invalidate()
+
+    def test_station_detail(self):
+        response = self.client.get(f"/stations/{network.NORTH_STATION_ID}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers["cache-control"], main.DOCUMENTS_CACHE_CONTROL
+        )
+        station = response.json()
+        self.assertEqual(station["_id"], str(network.NORTH_STATION_ID))
+        self.assertEqual(station["station_id"], 205)
+        self.assertNotIn("destinations", station)
+
+    def test_route_detail(self):
+        response = self.client.get(f"/routes/{network.A1_ROUTE_ID}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers["cache-control"], main.DOCUMENTS_CACHE_CONTROL
+        )
+        self.assertEqual(
+            response.json(),
+            {
+                "_id": str(network.A1_ROUTE_ID),
+                "transmetro_id": 37,
+                "name": "A1",
+                "type_of_route": "alimentador",
+            },
+        )
+
+    def test_not_found(self):
+        for path in ("/stations", "/routes"):
+            for document_id in ("not-an-id", str(ObjectId())):
+                response = self.client.get(f"{path}/{document_id}")
+
+                self.assertEqual(response.status_code, 404)
+                self.assertNotIn("cache-control", response.headers)
+
+        # a station is not a route
+        response = self.client.get(f"/routes/{network.NORTH_STATION_ID}")
+        self.assertEqual(response.status_code, 404)
+
+
+class TestSlimPaths(unittest.TestCase):
+    def setUp(self):
+        set_snapshot(
+            NetworkSnapshot(
+                network.get_stations(), network.get_routes(), network.get_stops()
+            )
+        )
+        self.client = TestClient(main.app)
+        main.paths_cache.cache.invalidate()
+
+        # Near the last stops of A1 to the southern station
+        self.params = {
+            "start": "-74.8497828,11.0177671",
+            "final": "-74.799618,10.9154516",
+        }
+
+    def tearDown(self):
+        set_snapshot(None)
+        documents_cache.invalidate()
+        main.paths_cache.cache.invalidate()
+
+    def get_paths(self, fields):
+        response = self.client.get(
+            "/paths/single", params={**self.params, "fields": fields}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["paths"]
+
+    def test_slim_fields_of_the_steps(self):
+        slim_fields = {
+            "Station": SLIM_STATION_FIELDS,
+            "Stop": SLIM_STOP_FIELDS,
+        }
+
+        paths = self.get_paths("slim")
+
+        self.assertTrue(paths)
+        for step in paths[0]:
+            if step["place_type"] in slim_fields:
+                self.assertLessEqual(
+                    set(step["data"]), set(slim_fields[step["place_type"]])
+                )
+            if "route_data" in step["through"]:
+                self.assertLessEqual(
+                    set(step["through"]["route_data"]), set(SLIM_ROUTE_FIELDS)
+                )
+
+        stop = paths[0][0]["data"]
+        self.assertNotIn("other_parent_stations", stop)
+        self.assertIn("parent_station", stop)
+
+    def test_slim_paths_are_projections_of_the_full_paths(self):
+        full_paths = self.get_paths("full")
+        slim_paths = self.get_paths("slim")
+
+        self.assertEqual(len(slim_paths), len(full_paths))
+        for slim_path, full_path in zip(slim_paths, full_paths):
+            self.assertEqual(len(slim_path), len(full_path))
+            for slim_step, full_step in zip(slim_path, full_path):
+                self.assertEqual(slim_step["through"], full_step["through"])
+                self.assertEqual(slim_step["place_type"], full_step["place_type"])
+                self.assertEqual(
+                    slim_step["data"],
+                    {key: full_step["data"][key] for key in slim_step["data"]},
+                )
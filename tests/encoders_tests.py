@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from core import encoders
+from core.commons import get_station_and_stops
+from core.encoders import NDJSON_MEDIA_TYPE, FastJSONResponse, NDJSONResponse
+from core.models import Coordinate
+from core.paths import SingleAlternativePathBuilder
+from core.snapshot import NetworkSnapshot, set_snapshot
+from core.steps import get_paths_content, get_paths_response
+from tests import network
+
+
+class TestFastJSONResponse(unittest.TestCase):
+    def setUp(self):
+        set_snapshot(
+            NetworkSnapshot(
+                network.get_stations(), network.get_routes(), network.get_stops()
+            )
+        )
+
+        self.start = Coordinate(lon=-74.8497828, lat=11.0177671)
+        self.final = Coordinate(lon=-74.799618, lat=10.9154516)
+        stations_stops = get_station_and_stops(self.start, self.final)
+        path_builder = SingleAlternativePathBuilder(
+            self.start, self.final, stations_stops
+        )
+        self.paths = path_builder.get_all_possible_paths()
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def get_default_body(self, search_radius=None):
+        response = get_paths_response(self.start, self.final, self.paths, search_radius)
+        return JSONResponse(jsonable_encoder(response, exclude_unset=True)).body
+
+    def get_fast_body(self, search_radius=None):
+        content = get_paths_content(self.start, self.final, self.paths, search_radius)
+        return FastJSONResponse(content).body
+
+    def test_same_bytes_as_default_response(self):
+        self.assertTrue(self.paths)
+        self.assertEqual(self.get_fast_body(), self.get_default_body())
+
+    def test_same_bytes_with_search_radius(self):
+        search_radius = {"start": 250, "final": 1000}
+        self.assertEqual(
+            self.get_fast_body(search_radius), self.get_default_body(search_radius)
+        )
+
+    def test_same_bytes_without_orjson(self):
+        with mock.patch.object(encoders, "orjson", None):
+            self.assertEqual(self.get_fast_body(), self.get_default_body())
+
+
+class TestNDJSONResponse(unittest.TestCase):
+    def setUp(self):
+        self.records = [{"_id": ObjectId(), "number": i} for i in range(3)]
+
+        app = FastAPI()
+
+        async def get_records():
+            for record in self.records:
+                yield record
+
+        @app.get("/records", response_class=NDJSONResponse)
+        async def records():
+            return NDJSONResponse(get_records())
+
+        self.client = TestClient(app)
+
+    def test_a_line_of_json_by_record(self):
+        response = self.client.get("/records")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith(NDJSON_MEDIA_TYPE))
+        self.assertEqual(
+            response.text.splitlines(),
+            [encoders.dumps(record).decode() for record in self.records],
+        )
+        self.assertTrue(response.text.endswith("\n"))
+
+    def test_no_records(self):
+        self.records = []
+        response = self.client.get("/records")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
@@ -0,0 +1,57 @@
+import unittest
+
+from core.metrics import Counter, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def render(self):
+        return self.registry.render().decode().splitlines()
+
+    def test_counter(self):
+        counter = self.registry.register(
+            Counter("requests_total", "Requests", ["path"])
+        )
+        counter.inc(path="/a")
+        counter.inc(2, path='/"b"')
+
+        self.assertEqual(
+            self.render(),
+            [
+                "# HELP requests_total Requests",
+                "# TYPE requests_total counter",
+                'requests_total{path="/a"} 1',
+                'requests_total{path="/\\"b\\""} 2',
+            ],
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.register(
+            Histogram("duration_seconds", "Duration", buckets=(0.1, 1))
+        )
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(3)
+
+        self.assertEqual(
+            self.render()[2:],
+            [
+                'duration_seconds_bucket{le="0.1"} 2',
+                'duration_seconds_bucket{le="1"} 3',
+                'duration_seconds_bucket{le="+Inf"} 4',
+                "duration_seconds_sum 3.65",
+                "duration_seconds_count 4",
+            ],
+        )
+
+    def test_histogram_time(self):
+        histogram = Histogram("stage_seconds", "Stage", ["stage"])
+        with histogram.time(stage="a"):
+            pass
+
+        counts, total = histogram.values[("a",)]
+        self.assertEqual(sum(counts), 1)
+        self.assertGreaterEqual(total[0], 0)
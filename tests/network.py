@@ -0,0 +1,128 @@
+"""
+Small hand made network used by the tests that don't need a database.
+
+Three stations along a troncal route (R1 goes north to south, S1 goes south to
+north) and one alimentador route (A1) whose stops end at the northern station
+"""
+
+from bson import ObjectId
+
+NORTH_STATION_ID = ObjectId()
+CENTER_STATION_ID = ObjectId()
+SOUTH_STATION_ID = ObjectId()
+
+R1_ROUTE_ID = ObjectId()
+S1_ROUTE_ID = ObjectId()
+A1_ROUTE_ID = ObjectId()
+
+
+def get_location(lon, lat):
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def get_stations():
+    return [
+        {
+            "_id": NORTH_STATION_ID,
+            "station_id": 205,
+            "name": "Norte",
+            "location": get_location(-74.8026, 10.9915),
+            "destinations": [
+                {
+                    "station": CENTER_STATION_ID,
+                    "amount_to_arrive": 4,
+                    "route": R1_ROUTE_ID,
+                },
+                {
+                    "station": SOUTH_STATION_ID,
+                    "amount_to_arrive": 9,
+                    "route": R1_ROUTE_ID,
+                },
+            ],
+        },
+        {
+            "_id": CENTER_STATION_ID,
+            "station_id": 104,
+            "name": "Centro",
+            "location": get_location(-74.8001, 10.9630),
+            "destinations": [
+                {
+                    "station": SOUTH_STATION_ID,
+                    "amount_to_arrive": 5,
+                    "route": R1_ROUTE_ID,
+                },
+                {
+                    "station": NORTH_STATION_ID,
+                    "amount_to_arrive": 4,
+                    "route": S1_ROUTE_ID,
+                },
+            ],
+        },
+        {
+            "_id": SOUTH_STATION_ID,
+            "station_id": 101,
+            "name": "Sur",
+            "location": get_location(-74.7996, 10.9154),
+            "destinations": [
+                {
+                    "station": CENTER_STATION_ID,
+                    "amount_to_arrive": 5,
+                    "route": S1_ROUTE_ID,
+                },
+                {
+                    "station": NORTH_STATION_ID,
+                    "amount_to_arrive": 9,
+                    "route": S1_ROUTE_ID,
+                },
+            ],
+        },
+    ]
+
+
+def get_routes():
+    return [
+        {
+            "_id": R1_ROUTE_ID,
+            "transmetro_id": 2,
+            "name": "R1",
+            "type_of_route": "troncal",
+        },
+        {
+            "_id": S1_ROUTE_ID,
+            "transmetro_id": 6,
+            "name": "S1",
+            "type_of_route": "troncal",
+        },
+        {
+            "_id": A1_ROUTE_ID,
+            "transmetro_id": 37,
+            "name": "A1",
+            "type_of_route": "alimentador",
+        },
+    ]
+
+
+def get_stops():
+    # Stops of A1 going west from the northern station
+    coordinates = [
+        (-74.8100, 10.9950),
+        (-74.8200, 11.0000),
+        (-74.8300, 11.0050),
+        (-74.8400, 11.0100),
+        (-74.8497, 11.0177),
+        (-74.8500, 11.0180),
+    ]
+    number_of_stops = len(coordinates) + 2
+    return [
+        {
+            "_id": ObjectId(),
+            "description": f"Parada {i}",
+            "stop_sequence": str(i + 1),
+            "location": get_location(lon, lat),
+            "amount_to_arrive": number_of_stops - i,
+            "route": A1_ROUTE_ID,
+            "parent_station": NORTH_STATION_ID,
+            "other_parent_stations": [],
+        }
+        for i, (lon, lat) in enumerate(coordinates, start=1)
+    ]
@@ -0,0 +1,100 @@
+import unittest
+from unittest import mock
+
+from core import network_version
+from core.network_version import (
+    CURRENT_VERSION_ID,
+    NETWORK_VERSION_COLLECTION,
+    NetworkVersionWatcher,
+    get_network_collections,
+    pinned_network_collections,
+    set_network_collections,
+)
+
+
+class VersionCollection:
+    def __init__(self):
+        self.document = None
+
+    def find_one(self, filter):
+        return self.document
+
+
+class TestNetworkVersionWatcher(unittest.TestCase):
+    def setUp(self):
+        self.collection = VersionCollection()
+        self.db = {NETWORK_VERSION_COLLECTION: self.collection}
+        self.changes = 0
+        self.watcher = NetworkVersionWatcher(self.db, on_change=self.on_change)
+
+    def on_change(self):
+        self.changes += 1
+
+    def tearDown(self):
+        set_network_collections(None)
+
+    def set_version(self, version):
+        self.collection.document = {
+            "_id": CURRENT_VERSION_ID,
+            "version": version,
+            "collections": {
+                name: f"{name}_{version}" for name in ("stations", "routes", "stops")
+            },
+        }
+
+    def test_sync_does_not_call_on_change(self):
+        self.set_version("1")
+        self.watcher.sync()
+
+        self.assertEqual(self.watcher.version, "1")
+        self.assertFalse(self.watcher.check())
+        self.assertEqual(self.changes, 0)
+
+    def test_check_calls_on_change_once_per_version(self):
+        self.watcher.sync()
+        self.set_version("1")
+
+        self.assertTrue(self.watcher.check())
+        self.assertFalse(self.watcher.check())
+        self.set_version("2")
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(self.changes, 2)
+        self.assertEqual(self.watcher.version, "2")
+
+    def test_collections_without_a_version(self):
+        self.assertEqual(
+            get_network_collections(self.db),
+            {"stations": "stations", "routes": "routes", "stops": "stops"},
+        )
+
+    def test_collections_change_with_the_version(self):
+        self.set_version("1")
+        self.watcher.sync()
+        self.assertEqual(get_network_collections(self.db)["stops"], "stops_1")
+
+        self.set_version("2")
+        self.watcher.check()
+        self.assertEqual(get_network_collections(self.db)["stops"], "stops_2")
+
+    def test_request_keeps_its_collections(self):
+        self.set_version("1")
+        self.watcher.sync()
+
+        with pinned_network_collections():
+            self.assertEqual(get_network_collections(self.db)["stations"], "stations_1")
+            self.set_version("2")
+            self.watcher.check()
+            # every collection of the request is from the same version
+            self.assertEqual(get_network_collections(self.db)["stops"], "stops_1")
+
+        self.assertEqual(get_network_collections(self.db)["stops"], "stops_2")
+
+    def test_collections_are_read_again_without_the_watcher(self):
+        self.set_version("1")
+        self.assertEqual(get_network_collections(self.db)["stops"], "stops_1")
+
+        self.set_version("2")
+        with mock.patch.object(network_version, "NETWORK_COLLECTIONS_TTL", 60):
+            self.assertEqual(get_network_collections(self.db)["stops"], "stops_1")
+        with mock.patch.object(network_version, "NETWORK_COLLECTIONS_TTL", 0):
+            self.assertEqual(get_network_collections(self.db)["stops"], "stops_2")
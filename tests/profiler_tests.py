@@ -0,0 +1,86 @@
+import json
+import unittest
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from core.profiler import QueryProfiler, get_command_shape
+
+
+def get_events(request_id, command_name, command, reply):
+    started = SimpleNamespace(
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        command_name=command_name,
+        command=command,
+    )
+    succeeded = SimpleNamespace(
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        duration_micros=1500,
+        reply=reply,
+    )
+    return started, succeeded
+
+
+def find_station(request_id):
+    return get_events(
+        request_id,
+        "find",
+        {"find": "stations", "filter": {"_id": ObjectId()}, "limit": 1},
+        {"cursor": {"firstBatch": [{"_id": ObjectId(), "name": "Norte"}]}, "ok": 1},
+    )
+
+
+class TestQueryProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = QueryProfiler(repeat_threshold=3)
+
+    def send(self, events):
+        started, succeeded = events
+        self.profiler.started(started)
+        self.profiler.succeeded(succeeded)
+
+    def test_shape_has_no_values(self):
+        shape = get_command_shape(
+            "aggregate",
+            {
+                "aggregate": "stops",
+                "pipeline": [
+                    {"$geoNear": {"near": {"coordinates": [-74.8, 10.9]}}},
+                    {"$group": {"_id": "$route"}},
+                ],
+            },
+        )
+        self.assertEqual(
+            json.loads(shape),
+            [
+                {"$geoNear": {"near": {"coordinates": ["?", "?"]}}},
+                {"$group": {"_id": "?"}},
+            ],
+        )
+
+    def test_queries_are_attributed_to_the_request(self):
+        with self.profiler.trace("GET /paths/single"):
+            self.send(find_station(1))
+
+        # outside of a request
+        self.send(find_station(2))
+
+        traces = self.profiler.get_traces()
+        self.assertEqual(len(traces), 1)
+        query = traces[0]["queries"][0]
+        self.assertEqual(query["command"], "find")
+        self.assertEqual(query["collection"], "stations")
+        self.assertEqual(query["duration_ms"], 1.5)
+        self.assertEqual(query["documents"], 1)
+        self.assertGreater(query["bytes"], 0)
+
+    def test_repeated_queries_are_flagged(self):
+        with self.profiler.trace("GET /paths/single"):
+            for request_id in range(3):
+                self.send(find_station(request_id))
+
+        repeated_queries = self.profiler.get_traces()[0]["repeated_queries"]
+        self.assertEqual(len(repeated_queries), 1)
+        self.assertEqual(repeated_queries[0]["count"], 3)
@@ -0,0 +1,119 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.network import generate_network
+from core import reachability
+from core.reachability import (
+    ReachabilityIndex,
+    get_reachability_index,
+    get_station_indexes,
+    invalidate_reachability_index,
+)
+from core.snapshot import NetworkSnapshot, set_snapshot
+
+
+class TestReachabilityIndex(unittest.TestCase):
+    def setUp(self):
+        self.network = generate_network(
+            stations=12, alimentador_routes=10, stops_per_route=8
+        )
+        self.index = ReachabilityIndex(
+            NetworkSnapshot(
+                self.network["stations"], self.network["routes"], self.network["stops"]
+            )
+        )
+        self.stations = self.network["stations"]
+
+    def get_reachable(self, station_numbers, stops=(), **kwargs):
+        stations = [self.stations[i] for i in station_numbers]
+        return {
+            station["station_id"] - 100: (transfers, amount)
+            for station, transfers, amount in self.index.get_reachable_stations(
+                stations, list(stops), **kwargs
+            )
+        }
+
+    def test_station_indexes_of_bitset(self):
+        self.assertEqual(get_station_indexes(0b100101), [0, 2, 5])
+        self.assertEqual(get_station_indexes(0), [])
+
+    def test_every_station_without_transfers(self):
+        # the first pair of troncal routes stops at every station
+        reachable = self.get_reachable([3], max_transfers=0)
+
+        self.assertEqual(
+            reachable, {i: (0, abs(i - 3)) for i in range(len(self.stations))}
+        )
+
+    def test_max_stops(self):
+        reachable = self.get_reachable([0], max_stops=3)
+
+        self.assertEqual(reachable, {i: (0, i) for i in range(4)})
+
+    def test_stop_rides_to_its_parent_station(self):
+        stop = self.network["stops"][0]
+        parent = next(
+            i
+            for i, station in enumerate(self.stations)
+            if station["_id"] == stop["parent_station"]
+        )
+        amount = stop["amount_to_arrive"]
+
+        self.assertEqual(
+            self.get_reachable([], [stop], max_transfers=0), {parent: (0, amount)}
+        )
+        self.assertEqual(
+            self.get_reachable([], [stop]),
+            {
+                i: (0 if i == parent else 1, amount + abs(i - parent))
+                for i in range(len(self.stations))
+            },
+        )
+
+    def test_fewest_stops_of_any_origin(self):
+        reachable = self.get_reachable([2, 9], max_transfers=0)
+
+        self.assertEqual(reachable[4], (0, 2))
+        self.assertEqual(reachable[8], (0, 1))
+
+
+class TestReachabilityIndexOfTheDatabase(unittest.TestCase):
+    def setUp(self):
+        network = generate_network(
+            stations=12, alimentador_routes=10, stops_per_route=8
+        )
+        self.snapshot = NetworkSnapshot(
+            network["stations"], network["routes"], network["stops"]
+        )
+        set_snapshot(None)
+        invalidate_reachability_index()
+
+    def tearDown(self):
+        invalidate_reachability_index()
+
+    def test_index_is_built_once_by_concurrent_requests(self):
+        def from_database(db):
+            time.sleep(0.05)
+            return self.snapshot
+
+        indexes = []
+        with mock.patch.object(
+            reachability.NetworkSnapshot, "from_database", side_effect=from_database
+        ) as load:
+            threads = [
+                threading.Thread(
+                    target=lambda: indexes.append(get_reachability_index())
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        load.assert_called_once()
+        self.assertEqual(len(indexes), 4)
+        self.assertTrue(all(index is indexes[0] for index in indexes))
+        self.assertIs(indexes[0].snapshot, self.snapshot)
@@ -0,0 +1,50 @@
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+class TestReadiness(unittest.TestCase):
+    def setUp(self):
+        main.app.state.ready = False
+        self.client = TestClient(main.app)
+
+        patcher = mock.patch.object(main, "MONGO_URL", "mongodb://localhost")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        main.app.state.ready = False
+
+    def test_not_ready_when_the_warm_up_fails(self):
+        with mock.patch.object(
+            main, "warm_up", side_effect=ConnectionError("No database")
+        ) as warm_up:
+            response = self.client.get("/ready")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"ready": False})
+        self.assertFalse(main.app.state.ready)
+        warm_up.assert_called_once_with(main.MONGO_WARMUP_CONNECTIONS)
+
+    def test_ready_when_the_warm_up_succeeds(self):
+        with mock.patch.object(main, "warm_up") as warm_up:
+            response = self.client.get("/ready")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {"ready": True})
+
+            # once ready, the database is not warmed up again
+            self.assertEqual(self.client.get("/ready").status_code, 200)
+
+        warm_up.assert_called_once_with(main.MONGO_WARMUP_CONNECTIONS)
+
+    def test_retries_the_warm_up_until_it_succeeds(self):
+        with mock.patch.object(
+            main, "warm_up", side_effect=[ConnectionError("No database"), None]
+        ):
+            self.assertEqual(self.client.get("/ready").status_code, 503)
+            self.assertEqual(self.client.get("/ready").status_code, 200)
+
+        self.assertTrue(main.app.state.ready)
@@ -0,0 +1,168 @@
+import os
+import tempfile
+import unittest
+
+import bson
+
+from core import queries
+from core.models import Coordinate, Fields
+from core.snapshot import (
+    SNAPSHOT_FILE_FORMAT,
+    SNAPSHOT_FILE_VERSION,
+    NetworkSnapshot,
+    set_snapshot,
+    write_snapshot_file,
+)
+from tests import network
+
+
+class TestNetworkSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = NetworkSnapshot(
+            network.get_stations(), network.get_routes(), network.get_stops()
+        )
+        set_snapshot(self.snapshot)
+
+    def tearDown(self):
+        set_snapshot(None)
+
+    def test_nearby_stations_are_sorted_and_without_destinations(self):
+        coordinate = Coordinate(lon=-74.8026641, lat=10.9915344)
+        stations = queries.get_nearby_stations(coordinate, max_distance=5000)
+
+        self.assertEqual(
+            [s["_id"] for s in stations],
+            [network.NORTH_STATION_ID, network.CENTER_STATION_ID],
+        )
+        self.assertLess(stations[0]["distance"], 10)
+        self.assertNotIn("destinations", stations[0])
+
+    def test_nearby_stops_are_sorted(self):
+        coordinate = Coordinate(lon=-74.8497828, lat=11.0177671)
+        stops = queries.get_nearby_stops(coordinate)
+
+        self.assertEqual(len(stops), 2)
+        self.assertEqual(stops[0]["route"], stops[1]["route"])
+        self.assertLessEqual(stops[0]["distance"], stops[1]["distance"])
+        self.assertIn("other_parent_stations", stops[0])
+
+    def test_get_by_object_id(self):
+        station = queries.get_station_by_object_id(network.SOUTH_STATION_ID)
+        route = queries.get_route_by_object_id(network.A1_ROUTE_ID)
+
+        self.assertEqual(station["station_id"], 101)
+        self.assertNotIn("destinations", station)
+        self.assertEqual(route["transmetro_id"], 37)
+
+    def test_possible_routes_between_station(self):
+        routes = queries.get_possible_routes_between_station(
+            network.NORTH_STATION_ID, network.SOUTH_STATION_ID
+        )
+
+        self.assertEqual(len(routes), 1)
+        self.assertEqual(routes[0]["route"]["name"], "R1")
+        self.assertEqual(routes[0]["destination_data"]["amount_to_arrive"], 9)
+
+    def test_possible_routes_of_every_pair_of_stations(self):
+        # what the aggregation of the database returns, from the destinations
+        routes = {route["_id"]: route for route in network.get_routes()}
+        expected = {}
+        for station in network.get_stations():
+            for destination in station["destinations"]:
+                key = (station["_id"], destination["station"])
+                expected.setdefault(key, []).append(
+                    {
+                        "destination_data": destination,
+                        "route": routes[destination["route"]],
+                    }
+                )
+
+        station_ids = [station["_id"] for station in network.get_stations()]
+        for start_station_id in station_ids:
+            for final_station_id in station_ids:
+                key = (start_station_id, final_station_id)
+                self.assertEqual(
+                    queries.get_possible_routes_between_station(*key),
+                    expected.get(key, []),
+                )
+
+        self.assertEqual(
+            queries.get_possible_routes_between_stations(station_ids, station_ids),
+            expected,
+        )
+
+    def test_no_routes_against_direction(self):
+        routes = queries.get_possible_routes_between_station(
+            network.SOUTH_STATION_ID, network.SOUTH_STATION_ID
+        )
+        self.assertEqual(routes, [])
+
+    def test_slim_fields(self):
+        coordinate = Coordinate(lon=-74.8497828, lat=11.0177671)
+        stations = queries.get_nearby_stations(coordinate, 10000, Fields.SLIM)
+        stops = queries.get_nearby_stops(coordinate, 500, Fields.SLIM)
+        route = queries.get_route_by_object_id(network.A1_ROUTE_ID, Fields.SLIM)
+        possible_routes = queries.get_possible_routes_between_station(
+            network.NORTH_STATION_ID, network.SOUTH_STATION_ID, Fields.SLIM
+        )
+
+        self.assertLessEqual(set(stations[0]), set(queries.SLIM_STATION_FIELDS))
+        self.assertIn("distance", stations[0])
+        self.assertNotIn("other_parent_stations", stops[0])
+        self.assertIn("parent_station", stops[0])
+        self.assertLessEqual(set(route), set(queries.SLIM_ROUTE_FIELDS))
+        self.assertLessEqual(
+            set(possible_routes[0]["route"]), set(queries.SLIM_ROUTE_FIELDS)
+        )
+
+
+class TestNetworkSnapshotFile(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write_file(self, header, collections):
+        with open(self.path, "wb") as snapshot_file:
+            snapshot_file.write(bson.encode(header))
+            for documents in collections:
+                for document in documents:
+                    snapshot_file.write(bson.encode(document))
+
+    def test_from_file(self):
+        stations = network.get_stations()
+        routes = network.get_routes()
+        stops = network.get_stops()
+        header = write_snapshot_file(
+            self.path, {"stations": stations, "routes": routes, "stops": stops}, "1"
+        )
+
+        snapshot = NetworkSnapshot.from_file(self.path)
+        expected = NetworkSnapshot(stations, routes, stops)
+
+        self.assertEqual(
+            header["counts"],
+            {"stations": len(stations), "routes": len(routes), "stops": len(stops)},
+        )
+        self.assertEqual(snapshot.stations, expected.stations)
+        self.assertEqual(snapshot.routes, expected.routes)
+        self.assertEqual(snapshot.stops, expected.stops)
+        self.assertEqual(snapshot.station_routes, expected.station_routes)
+
+    def test_other_files_are_rejected(self):
+        self.write_file({"format": "other"}, [])
+
+        with self.assertRaises(ValueError):
+            NetworkSnapshot.from_file(self.path)
+
+    def test_other_format_versions_are_rejected(self):
+        header = {
+            "format": SNAPSHOT_FILE_FORMAT,
+            "format_version": SNAPSHOT_FILE_VERSION + 1,
+        }
+        self.write_file(header, [])
+
+        with self.assertRaises(ValueError):
+            NetworkSnapshot.from_file(self.path)
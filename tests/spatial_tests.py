@@ -0,0 +1,49 @@
+import random
+import unittest
+
+from core.spatial import BruteForceIndex, GridIndex, KDTreeIndex
+from tests.network import get_location
+
+
+class TestSpatialIndexes(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(7)
+        self.documents = [
+            {
+                "_id": i,
+                "location": get_location(
+                    -74.80 + rand.uniform(-0.05, 0.05),
+                    10.97 + rand.uniform(-0.05, 0.05),
+                ),
+            }
+            for i in range(500)
+        ]
+        self.points = [
+            [-74.80 + rand.uniform(-0.06, 0.06), 10.97 + rand.uniform(-0.06, 0.06)]
+            for _ in range(50)
+        ]
+
+    def assert_same_as_brute_force(self, index_class):
+        brute_force = BruteForceIndex(self.documents)
+        index = index_class(self.documents)
+
+        for point in self.points:
+            for max_distance in (100, 500, 2000):
+                expected = brute_force.query(point, max_distance)
+                result = index.query(point, max_distance)
+                self.assertEqual(
+                    [d["_id"] for d in result], [d["_id"] for d in expected]
+                )
+
+    def test_grid_index(self):
+        self.assert_same_as_brute_force(GridIndex)
+
+    def test_kdtree_index(self):
+        self.assert_same_as_brute_force(KDTreeIndex)
+
+    def test_results_are_sorted_by_distance(self):
+        result = KDTreeIndex(self.documents).query(self.points[0], 2000)
+        distances = [d["distance"] for d in result]
+
+        self.assertTrue(distances)
+        self.assertEqual(distances, sorted(distances))
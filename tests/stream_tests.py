@@ -0,0 +1,59 @@
+import json
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.network import generate_network
+from benchmarks.run import get_query_points
+from core.encoders import NDJSON_MEDIA_TYPE
+from core.queries import documents_cache
+from core.snapshot import NetworkSnapshot, set_snapshot
+
+
+class TestStreams(unittest.TestCase):
+    def setUp(self):
+        self.network = generate_network()
+        set_snapshot(
+            NetworkSnapshot(
+                self.network["stations"],
+                self.network["routes"],
+                self.network["stops"],
+            )
+        )
+        self.client = TestClient(main.app)
+        self.points = get_query_points(self.network, 4, seed=2)
+
+    def tearDown(self):
+        set_snapshot(None)
+        documents_cache.invalidate()
+
+    def get_lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith(NDJSON_MEDIA_TYPE))
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    def test_alternatives_stream_same_paths(self):
+        for start, final in self.points:
+            params = {
+                "start": f"{start.lon},{start.lat}",
+                "final": f"{final.lon},{final.lat}",
+                "max_paths": 3,
+            }
+            response = self.client.get("/paths/alternatives", params=params)
+            stream_response = self.client.get(
+                "/paths/alternatives/stream", params=params
+            )
+
+            self.assertEqual(self.get_lines(stream_response), response.json()["paths"])
+
+    def test_batch_stream_same_responses(self):
+        pairs = [
+            {"start": start.dict(), "final": final.dict()}
+            for start, final in self.points + self.points[:2]
+        ]
+        response = self.client.post("/paths/batch", json={"pairs": pairs})
+        stream_response = self.client.post("/paths/batch/stream", json={"pairs": pairs})
+
+        self.assertEqual(len(self.get_lines(stream_response)), len(pairs))
+        self.assertEqual(self.get_lines(stream_response), response.json())